@@ -3,18 +3,27 @@ Daemon base class
 Useful to create daemons which can use Django easily.
 """
 import argparse
+import collections
+import contextlib
 import datetime
 import importlib.util
 import logging
 import logging.config
+import logging.handlers
 import os
+import queue
+import signal
 import socket
 import subprocess
 import sys
+import time
 import traceback
 from pathlib import Path
 
 from django_web_utils.daemon.daemonization import daemonize
+from django_web_utils.daemon.metrics import DaemonMetrics
+from django_web_utils.daemon.rpc import RPCServer, call as rpc_call
+from django_web_utils.daemon.zygote import ForkServer, run_task
 
 logger = logging.getLogger('djwutils.daemon.base')
 
@@ -28,6 +37,11 @@ class BaseDaemon:
 
     Log file will be located in `LOG_DIR/<daemon_file_name>.log`.
     PID file is located in `PID_DIR/<daemon_file_name>.pid`.
+    Configuration file is located in `CONF_DIR/<daemon_file_name>.py`,
+    it is reloaded when the daemon receives a SIGHUP signal (see `on_config_reload`).
+    Metrics file is located in `PID_DIR/<daemon_file_name>.metrics`,
+    call `heartbeat` in the daemon loop to update it.
+    RPC socket is located in `PID_DIR/<daemon_file_name>.rpc.sock` (see `RPC_METHODS`).
     """
 
     CONF_DIR = Path('/tmp/djwutils-daemon')
@@ -38,10 +52,39 @@ class BaseDaemon:
     SERVER_DIR = None
     # Django settings module (for example: `'myproject.settings'`). Django is not loaded if set to `None`.
     SETTINGS_MODULE = None
+    # Defer `django.setup()` until the first use of the applications registry (models import or ORM use).
+    # Django logging configuration is not applied in this mode (the daemon logging configuration is used).
+    DJANGO_LAZY_SETUP = False
+    # Log the duration and the number of imported modules of each startup phase (also enabled by `--profile-startup`).
+    STARTUP_PROFILE = False
+
+    # Names of custom counters in the metrics file (8 at most), use `self.metrics.incr(name)` to update them.
+    METRICS_COUNTERS = []
+    # Number of seconds without heartbeat after which the daemon is considered as stalled. Ignored if set to `None`.
+    HEARTBEAT_TIMEOUT = None
+
+    # Log file rotation: maximum size in bytes and/or interval (number of seconds or `'midnight'`).
+    # The log file is never rotated if both are set to `None`.
+    LOG_MAX_SIZE = None
+    LOG_ROTATION_INTERVAL = None
+    LOG_BACKUP_COUNT = 5
+    LOG_COMPRESS = True
+    # Write logs from a separate thread so that the daemon never waits for disk writes when logging.
+    LOG_QUEUE = False
+
+    # Tasks which can be run in isolated processes with `run_task` (dict of callables or python paths by name).
+    # A fork server is started with the daemon if tasks are defined, its socket is `PID_DIR/<daemon_file_name>.fork.sock`.
+    FORK_SERVER_TASKS = {}
+
+    # Methods which can be called by other processes with `call` (dict of daemon method names by name).
+    # A RPC server is started with the daemon if methods are defined, its socket is `PID_DIR/<daemon_file_name>.rpc.sock`.
+    RPC_METHODS = {}
+    RPC_SOCKET_MODE = 0o600
 
     DEFAULTS = dict(LOGGING_LEVEL='INFO')
 
     def __init__(self, args=None):
+        self._startup_phases = []
         # Set env
         # get daemon script path before changing dir
         self.daemon_path = Path.cwd() / sys.argv[0]
@@ -49,9 +92,16 @@ class BaseDaemon:
         os.environ['LC_ALL'] = 'C.UTF-8'
         os.chdir(self.WORK_DIR)
 
+        # Metrics are only written by started daemons
+        self.metrics = None
+        self._log_listener = None
+        self.fork_server = None
+        self.rpc_server = None
+
         # Get config
         self.config = {}
-        self.load_config()
+        with self._startup_phase('load_config'):
+            self.load_config()
 
         # Parse args
         parser = argparse.ArgumentParser(
@@ -67,7 +117,10 @@ class BaseDaemon:
             '-l', '--log', action='store_true',
             help='Force log to file and not the standard output.')
         parser.add_argument(
-            'action', choices=['start', 'stop', 'restart', 'clear_log'],
+            '--profile-startup', action='store_true',
+            help='Log the duration of each startup phase.')
+        parser.add_argument(
+            'action', choices=['start', 'stop', 'restart', 'reload', 'clear_log'],
             help='Action to run.')
         parser.add_argument(
             'extra', nargs=argparse.REMAINDER,
@@ -78,6 +131,7 @@ class BaseDaemon:
         self._simultaneous = args.simultaneous
         self._log_in_file = self._should_daemonize or args.log
         self._extra_args = args.extra
+        self._profile_startup = self.STARTUP_PROFILE or args.profile_startup
 
         # Run command
         try:
@@ -102,6 +156,24 @@ class BaseDaemon:
             cls._pid_path = cls.PID_DIR / f'{cls.get_name()}.pid'
         return cls._pid_path
 
+    @classmethod
+    def get_metrics_path(cls):
+        if not hasattr(cls, '_metrics_path'):
+            cls._metrics_path = cls.PID_DIR / f'{cls.get_name()}.metrics'
+        return cls._metrics_path
+
+    @classmethod
+    def get_fork_server_path(cls):
+        if not hasattr(cls, '_fork_server_path'):
+            cls._fork_server_path = cls.PID_DIR / f'{cls.get_name()}.fork.sock'
+        return cls._fork_server_path
+
+    @classmethod
+    def get_rpc_path(cls):
+        if not hasattr(cls, '_rpc_path'):
+            cls._rpc_path = cls.PID_DIR / f'{cls.get_name()}.rpc.sock'
+        return cls._rpc_path
+
     @classmethod
     def get_log_path(cls):
         if not hasattr(cls, '_log_path'):
@@ -129,6 +201,30 @@ class BaseDaemon:
                 self.config[key] = cfg.__dict__[key]
         return True
 
+    def on_config_reload(self, old_config, new_config):
+        """
+        Function called after the configuration has been reloaded (on SIGHUP).
+        Override it to apply configuration changes without restarting the daemon.
+        """
+        pass
+
+    def _reload_config(self, signum=None, frame=None):
+        old_config = dict(self.config)
+        try:
+            self.load_config()
+        except Exception as err:
+            logger.error('Failed to reload configuration of daemon %s, the previous configuration is kept: %s', self.get_name(), err)
+            self.config = old_config
+            return False
+        logging.getLogger().setLevel(self.config.get('LOGGING_LEVEL', 'INFO'))
+        logger.info('Configuration of daemon %s reloaded.', self.get_name())
+        try:
+            self.on_config_reload(old_config, self.config)
+        except Exception as err:
+            logger.error('Failed to apply reloaded configuration of daemon %s: %s', self.get_name(), err, exc_info=True)
+            return False
+        return True
+
     def _run_command(self, command):
         if command in ('restart', 'stop'):
             # check if daemon is already launched
@@ -150,6 +246,18 @@ class BaseDaemon:
             if pid and not self._simultaneous:
                 print(f'{self.get_name()} is already running.', file=sys.stderr)
                 self.exit(130)
+        elif command == 'reload':
+            pid = self._look_for_existing_process()
+            if pid:
+                print(f'Reloading {self.get_name()} configuration...', file=sys.stdout)
+                try:
+                    os.kill(pid, signal.SIGHUP)
+                except OSError as err:
+                    print(f'Cannot reload {self.get_name()}: {err}', file=sys.stderr)
+                    self.exit(132)
+                print(f'Reload signal sent to {self.get_name()}.', file=sys.stdout)
+            else:
+                print(f'{self.get_name()} is not running.', file=sys.stdout)
         elif command == 'clear_log':
             if self.get_log_path().exists():
                 self.get_log_path().write_text('')
@@ -163,18 +271,71 @@ class BaseDaemon:
             sys.stdout.flush()
             try:
                 if self._should_daemonize:
-                    daemonize(redirect_to=str(self.get_log_path()) if self._log_in_file else None)
+                    with self._startup_phase('daemonize'):
+                        daemonize(redirect_to=str(self.get_log_path()) if self._log_in_file else None)
                 if not self._simultaneous:
-                    self._write_pid()
+                    with self._startup_phase('write_pid'):
+                        self._write_pid()
+                        self._setup_metrics()
                 self._setup_sys_path()
                 if self.SETTINGS_MODULE:
-                    self._setup_django()
-                self._setup_logging()
+                    with self._startup_phase('setup_django'):
+                        if self.DJANGO_LAZY_SETUP:
+                            self._setup_django_lazily()
+                        else:
+                            self._setup_django()
+                with self._startup_phase('setup_logging'):
+                    self._setup_logging()
+                if self.FORK_SERVER_TASKS and not self._simultaneous:
+                    with self._startup_phase('fork_server'):
+                        self._setup_fork_server()
+                # Started after the fork server because threads are not copied in forked processes
+                if self.RPC_METHODS and not self._simultaneous:
+                    with self._startup_phase('rpc_server'):
+                        self._setup_rpc_server()
+                signal.signal(signal.SIGHUP, self._reload_config)
+                if self._profile_startup:
+                    self._log_startup_profile()
             except Exception:
                 self._exit_with_error(f'Error when starting {self.get_name()}.', code=134)
         else:
             self.exit(0)
 
+    @contextlib.contextmanager
+    def _startup_phase(self, name):
+        modules = set(sys.modules)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._startup_phases.append((name, time.perf_counter() - start, sorted(set(sys.modules) - modules)))
+
+    def _log_startup_profile(self):
+        lines = []
+        for name, duration, modules in self._startup_phases:
+            line = f'    {name}: {duration * 1000:.1f} ms, {len(modules)} imported modules'
+            # Show packages with the most imported modules
+            packages = collections.Counter(module.split('.')[0] for module in modules if not module.startswith('_'))
+            if packages:
+                line += ' (' + ', '.join(f'{package}: {count}' for package, count in packages.most_common(5)) + ')'
+            lines.append(line)
+        total = sum(duration for _name, duration, _modules in self._startup_phases)
+        logger.info('Startup profile of daemon %s (%.1f ms):\n%s', self.get_name(), total * 1000, '\n'.join(lines))
+
+    def _setup_metrics(self):
+        self.metrics = DaemonMetrics(
+            self.get_metrics_path(),
+            counters=self.METRICS_COUNTERS,
+            heartbeat_timeout=self.HEARTBEAT_TIMEOUT,
+        )
+
+    def heartbeat(self, items=0):
+        """
+        Update the heartbeat in the metrics file, this should be called at each iteration of the daemon loop.
+        """
+        if self.metrics:
+            self.metrics.heartbeat(items)
+
     def _setup_sys_path(self):
         if self.SERVER_DIR and self.SERVER_DIR.is_dir():
             # Remove current file directory from sys.path to avoid incorrect imports
@@ -195,6 +356,24 @@ class BaseDaemon:
         import django
         django.setup()
 
+    def _setup_django_lazily(self):
+        if os.environ.get('DJANGO_SETTINGS_MODULE') != self.SETTINGS_MODULE:
+            os.environ['DJANGO_SETTINGS_MODULE'] = self.SETTINGS_MODULE
+        from django.apps import apps
+
+        # Populate the applications registry when it is required for the first time
+        def get_check_function(check):
+            def check_ready():
+                if not apps.ready and not apps.loading:
+                    from django.conf import settings
+                    logger.debug('Setting up Django applications on first use.')
+                    apps.populate(settings.INSTALLED_APPS)
+                check()
+            return check_ready
+
+        apps.check_apps_ready = get_check_function(apps.check_apps_ready)
+        apps.check_models_ready = get_check_function(apps.check_models_ready)
+
     def _setup_logging(self):
         try:
             self.LOG_DIR.mkdir(parents=True, exist_ok=True)
@@ -221,11 +400,7 @@ class BaseDaemon:
                     'formatter': 'verbose',
                     'stream': 'ext://sys.stdout',
                 },
-                'log_file': {
-                    'class': 'logging.FileHandler',
-                    'formatter': 'verbose',
-                    'filename': self.get_log_path(),
-                },
+                'log_file': self._get_log_file_handler_conf(),
             },
             'loggers': {
                 'django': {
@@ -251,8 +426,80 @@ class BaseDaemon:
         for key, lg in loggers.items():
             lg.handlers = []
             lg.propagate = 1
+        if self.LOG_QUEUE:
+            self._setup_logging_queue()
         logger.debug('Logging configured.')
 
+    def _get_log_file_handler_conf(self):
+        if not self.LOG_MAX_SIZE and not self.LOG_ROTATION_INTERVAL:
+            return {
+                'class': 'logging.FileHandler',
+                'formatter': 'verbose',
+                'filename': self.get_log_path(),
+            }
+        return {
+            '()': 'django_web_utils.logging_utils.RotatingCompressedFileHandler',
+            'formatter': 'verbose',
+            'filename': self.get_log_path(),
+            'max_bytes': self.LOG_MAX_SIZE,
+            'interval': self.LOG_ROTATION_INTERVAL,
+            'backup_count': self.LOG_BACKUP_COUNT,
+            'compress': self.LOG_COMPRESS,
+            # Standard outputs are redirected to the log file when daemonized
+            'redirect_std': self._should_daemonize and self._log_in_file,
+        }
+
+    def _setup_logging_queue(self):
+        # Move root handlers to a listener thread fed by a queue
+        root = logging.getLogger()
+        handlers = list(root.handlers)
+        for handler in handlers:
+            root.removeHandler(handler)
+        log_queue = queue.SimpleQueue()
+        root.addHandler(logging.handlers.QueueHandler(log_queue))
+        self._log_listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        self._log_listener.start()
+
+    def _setup_fork_server(self):
+        def post_fork():
+            # The log listener thread does not exist in the forked process
+            if self._log_listener:
+                logging.getLogger().handlers = list(self._log_listener.handlers)
+                self._log_listener = None
+            self.metrics = None
+
+        self.fork_server = ForkServer(self.get_fork_server_path(), self.FORK_SERVER_TASKS, post_fork=post_fork)
+        self.fork_server.start()
+
+    def run_task(self, name, args=None, kwargs=None, timeout=None):
+        """
+        Run a task of `FORK_SERVER_TASKS` in a child process of the fork server.
+        Returns a `TaskResult` (exit code, result and error message).
+        """
+        if not self.fork_server:
+            raise RuntimeError('The fork server is not started.')
+        return run_task(self.get_fork_server_path(), name, args=args, kwargs=kwargs, timeout=timeout)
+
+    def _setup_rpc_server(self):
+        handlers = {name: getattr(self, method) for name, method in self.RPC_METHODS.items()}
+        self.rpc_server = RPCServer(self.get_rpc_path(), handlers, mode=self.RPC_SOCKET_MODE)
+        self.rpc_server.start()
+
+    @classmethod
+    def call(cls, method, *args, timeout=5, **kwargs):
+        """
+        Call a method of `RPC_METHODS` in the running daemon and return its result.
+        This function is intended to be used by other processes (web views for example).
+        Raises a `django_web_utils.daemon.rpc.RPCError` if the daemon is not running or if the method failed.
+        """
+        return rpc_call(cls.get_rpc_path(), method, *args, timeout=timeout, **kwargs)
+
+    def _stop_logging_queue(self):
+        if self._log_listener:
+            # Write all pending records
+            self._log_listener.stop()
+            self._log_listener = None
+
     def _look_for_existing_process(self):
         """
         Check if the daemon is already launched and return its pid if it is, else None
@@ -284,6 +531,8 @@ class BaseDaemon:
             self._pid_written = True
 
     def _exit_with_error(self, msg=None, code=-1):
+        if self.metrics:
+            self.metrics.set_error('%s %s' % (msg or '', traceback.format_exc().strip().split('\n')[-1]))
         if self._log_in_file:
             try:
                 with open(self.get_log_path(), 'a') as fo:
@@ -334,12 +583,18 @@ class BaseDaemon:
         logger.debug('Restarting daemon.\n    Command: %s\n    Stdout: %s\n    Stderr: %s', cmd, out, err)
         if p.returncode != 0:
             logger.error('Error when restarting daemon:\n    %s', err)
+        self._stop_logging_queue()
         sys.exit(0)
 
     def exit(self, code=0):
         if getattr(self, '_pid_written', False):
             self.get_pid_path().unlink(missing_ok=True)
+        if self.fork_server:
+            self.fork_server.stop()
+        if self.rpc_server:
+            self.rpc_server.stop()
         logger.debug('Daemon %s ended (return code: %s).', self.get_name(), code)
+        self._stop_logging_queue()
         sys.exit(code)
 
     def send_error_email(self, msg, tb=False, recipients=None):
@@ -0,0 +1,53 @@
+"""
+Inter-process messages
+Length-prefixed JSON messages exchanged over stream sockets (unix sockets for example).
+Each message is a 4 bytes big-endian length followed by the JSON payload.
+"""
+import json
+import struct
+
+HEADER = struct.Struct('!I')
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024
+
+
+class MessageError(Exception):
+    pass
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+    remaining = size
+    while remaining:
+        chunk = sock.recv(min(remaining, 1024 * 1024))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+
+def send_message(sock, data):
+    payload = json.dumps(data).encode('utf-8')
+    if len(payload) > MAX_MESSAGE_SIZE:
+        raise MessageError(f'Message too large ({len(payload)} bytes).')
+    sock.sendall(HEADER.pack(len(payload)) + payload)
+
+
+def recv_message(sock):
+    """
+    Receive a message from the socket.
+    Returns None if the connection has been closed before the start of a message.
+    """
+    header = _recv_exactly(sock, HEADER.size)
+    if header is None:
+        return None
+    size = HEADER.unpack(header)[0]
+    if size > MAX_MESSAGE_SIZE:
+        raise MessageError(f'Message too large ({size} bytes).')
+    payload = _recv_exactly(sock, size)
+    if payload is None:
+        raise MessageError('Connection closed while receiving a message.')
+    try:
+        return json.loads(payload)
+    except ValueError as err:
+        raise MessageError(f'Invalid message: {err}') from err
@@ -1,8 +1,12 @@
 """
 Lock functions
 This simple lock system is based on a file and is using the system hostname as reference.
+Other backends can be given to the lock functions to share locks across hosts without a shared filesystem:
+- `AdvisoryLockBackend`: PostgreSQL advisory locks (session or transaction scoped).
+- `TableLockBackend`: Django model inheriting from `django_web_utils.daemon.models.AbstractLockModel` with lease expiry.
 """
 import datetime
+import hashlib
 import logging
 import socket
 import time
@@ -16,58 +20,189 @@ class LockAlreadyAcquired(Exception):
     pass
 
 
-def acquire_lock(path, timeout=None):
-    # The timeout value can be None or a timedelta object
-    path = Path(path)
-    path.parent.mkdir(parents=True, exist_ok=True)
-    hostname = socket.gethostname()
-    try:
-        mtime = datetime.datetime.fromtimestamp(path.stat().st_mtime)
-    except FileNotFoundError:
-        pass
-    else:
-        if timeout and mtime < datetime.datetime.now() - timeout:
-            logger.info(f'Lock file "{path}" has timed out.')
+class FileLockBackend:
+    """
+    Lock backend using a file containing the hostname of the lock owner.
+    The lock path must be on a filesystem shared by all hosts using the lock.
+    """
+
+    def acquire(self, path, timeout=None):
+        # The timeout value can be None or a timedelta object
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        hostname = socket.gethostname()
+        try:
+            mtime = datetime.datetime.fromtimestamp(path.stat().st_mtime)
+        except FileNotFoundError:
+            pass
         else:
-            try:
-                content = path.read_text()
-            except OSError as e:
-                logger.debug(f'Failed to read lock file "{path}", retrying in 2s. Error was: {e}')
-                time.sleep(2)
+            if timeout and mtime < datetime.datetime.now() - timeout:
+                logger.info(f'Lock file "{path}" has timed out.')
+            else:
                 try:
                     content = path.read_text()
                 except OSError as e:
-                    logger.info(f'Failed to read lock file "{path}", assuming another host is using it. Error was: {e}')
+                    logger.debug(f'Failed to read lock file "{path}", retrying in 2s. Error was: {e}')
+                    time.sleep(2)
+                    try:
+                        content = path.read_text()
+                    except OSError as e:
+                        logger.info(f'Failed to read lock file "{path}", assuming another host is using it. Error was: {e}')
+                        return False
+                if content != hostname:
+                    logger.info(f'Could not acquire lock file "{path}" because it is currently attributed to host "{content}".')
                     return False
-            if content != hostname:
-                logger.info(f'Could not acquire lock file "{path}" because it is currently attributed to host "{content}".')
-                return False
+                else:
+                    logger.info(f'Lock file "{path}" already exists and is attributed to current hostname.')
+        path.write_text(hostname)
+        logger.info(f'Lock file "{path}" acquired.')
+        return True
+
+    def release(self, path):
+        path = Path(path)
+        if path.exists():
+            hostname = socket.gethostname()
+            content = path.read_text()
+            if content == hostname:
+                path.unlink(missing_ok=True)
+                logger.info(f'Lock file "{path}" released.')
             else:
-                logger.info(f'Lock file "{path}" already exists and is attributed to current hostname.')
-    path.write_text(hostname)
-    logger.info(f'Lock file "{path}" acquired.')
-    return True
+                logger.warning(f'Cannot release lock file "{path}" because it is owned by host "{content}".')
+                return False
+        return True
 
 
-def release_lock(path):
-    path = Path(path)
-    if path.exists():
-        hostname = socket.gethostname()
-        content = path.read_text()
-        if content == hostname:
-            path.unlink(missing_ok=True)
-            logger.info(f'Lock file "{path}" released.')
-        else:
-            logger.warning(f'Cannot release lock file "{path}" because it is owned by host "{content}".')
+class AdvisoryLockBackend:
+    """
+    Lock backend using PostgreSQL advisory locks.
+    The lock name is hashed to get the advisory lock key.
+    With the "session" scope, the lock is held until released or until the database connection is closed.
+    With the "transaction" scope, the lock is held until the end of the current transaction,
+    so `acquire` must be called in an atomic block (`require_lock` opens one).
+    The timeout is ignored because locks cannot outlive the connection of their owner.
+    """
+
+    def __init__(self, scope='session', using='default'):
+        if scope not in ('session', 'transaction'):
+            raise ValueError(f'Invalid advisory lock scope: "{scope}".')
+        self.scope = scope
+        self.using = using
+        self.needs_transaction = scope == 'transaction'
+
+    @staticmethod
+    def get_key(name):
+        digest = hashlib.blake2b(str(name).encode('utf-8'), digest_size=8).digest()
+        return int.from_bytes(digest, 'big', signed=True)
+
+    def acquire(self, name, timeout=None):
+        from django.db import connections
+
+        key = self.get_key(name)
+        # Django connections are per thread, so locks are owned by the current thread connection
+        connection = connections[self.using]
+        if self.scope == 'transaction' and not connection.in_atomic_block:
+            raise RuntimeError('Transaction scoped advisory locks must be acquired in an atomic block.')
+        fct = 'pg_try_advisory_xact_lock' if self.scope == 'transaction' else 'pg_try_advisory_lock'
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT {fct}(%s)', [key])
+            acquired = cursor.fetchone()[0]
+        if not acquired:
+            logger.info(f'Could not acquire advisory lock "{name}" because it is held by another session.')
+            return False
+        logger.info(f'Advisory lock "{name}" acquired.')
+        return True
+
+    def release(self, name):
+        from django.db import connections
+
+        if self.scope == 'transaction':
+            # Released by PostgreSQL at the end of the transaction
+            return True
+        key = self.get_key(name)
+        # Session advisory locks are reentrant and stacked in PostgreSQL, so each release only cancels one acquisition
+        # (the lock is held until the outermost holder of the session releases it).
+        with connections[self.using].cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_unlock(%s)', [key])
+            released = cursor.fetchone()[0]
+        if not released:
+            logger.warning(f'Cannot release advisory lock "{name}" because it is not held by current session.')
             return False
-    return True
+        logger.info(f'Advisory lock "{name}" released.')
+        return True
 
 
-def require_lock(path, timeout=None, silent=True):
+class TableLockBackend:
+    """
+    Lock backend using a Django model inheriting from `AbstractLockModel`.
+    A lock acquired with a timeout is a lease: it can be taken by another owner once expired.
+    The owner defaults to the system hostname, like the file backend.
+    """
+
+    def __init__(self, model, owner=None, using='default'):
+        self.model = model
+        self.owner = owner or socket.gethostname()
+        self.using = using
+
+    def acquire(self, name, timeout=None):
+        # The timeout value can be None or a timedelta object
+        from django.db import connections
+        from django.utils import timezone
+
+        now = timezone.now()
+        expires_at = now + timeout if timeout else None
+        table = connections[self.using].ops.quote_name(self.model._meta.db_table)
+        # Insert the lock or take it over if it is owned by current owner or expired
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (name, owner, acquired_at, expires_at) VALUES (%s, %s, %s, %s) '
+                f'ON CONFLICT (name) DO UPDATE SET owner = EXCLUDED.owner, acquired_at = EXCLUDED.acquired_at, expires_at = EXCLUDED.expires_at '
+                f'WHERE {table}.owner = EXCLUDED.owner OR {table}.expires_at < %s',
+                [str(name), self.owner, now, expires_at, now]
+            )
+            acquired = cursor.rowcount > 0
+        if not acquired:
+            logger.info(f'Could not acquire lock "{name}" because it is currently attributed to another owner.')
+            return False
+        logger.info(f'Lock "{name}" acquired.')
+        return True
+
+    def release(self, name):
+        deleted, _details = self.model.objects.using(self.using).filter(name=str(name), owner=self.owner).delete()
+        if deleted:
+            logger.info(f'Lock "{name}" released.')
+            return True
+        owner = self.model.objects.using(self.using).filter(name=str(name)).values_list('owner', flat=True).first()
+        if owner is not None:
+            logger.warning(f'Cannot release lock "{name}" because it is owned by "{owner}".')
+            return False
+        return True
+
+
+DEFAULT_BACKEND = FileLockBackend()
+
+
+def acquire_lock(path, timeout=None, backend=None):
+    # The timeout value can be None or a timedelta object
+    return (backend or DEFAULT_BACKEND).acquire(path, timeout)
+
+
+def release_lock(path, backend=None):
+    return (backend or DEFAULT_BACKEND).release(path)
+
+
+def require_lock(path, timeout=None, silent=True, backend=None):
     def _wrap(function):
         @wraps(function)
         def _wrapped_function(*args, **kwargs):
-            if not acquire_lock(path, timeout):
+            if getattr(backend, 'needs_transaction', False):
+                from django.db import transaction
+
+                with transaction.atomic(using=backend.using):
+                    return _call(*args, **kwargs)
+            return _call(*args, **kwargs)
+
+        def _call(*args, **kwargs):
+            if not acquire_lock(path, timeout, backend=backend):
                 msg = f'Could not get lock "{path}".'
                 if silent:
                     logger.info(msg)
@@ -77,6 +212,6 @@ def require_lock(path, timeout=None, silent=True):
                 try:
                     return function(*args, **kwargs)
                 finally:
-                    release_lock(path)
+                    release_lock(path, backend=backend)
         return _wrapped_function
     return _wrap
@@ -0,0 +1,150 @@
+"""
+Daemon metrics
+Fixed-layout memory-mapped file updated by a daemon and readable by other processes (the monitoring for example).
+Updates are plain memory writes, so they can be done in the hot loop of a daemon.
+A sequence number is incremented before and after each update to allow consistent reads without locks.
+"""
+import mmap
+import os
+import struct
+import time
+from pathlib import Path
+
+MAGIC = b'DJWM'
+VERSION = 1
+MAX_COUNTERS = 8
+NAME_SIZE = 32
+ERROR_SIZE = 512
+
+# magic, version, counters count, pid, started at, heartbeat timeout
+_HEADER = struct.Struct('<4sHHIdd')
+_SEQ = struct.Struct('<Q')
+# heartbeat, iterations, items processed
+_HEARTBEAT = struct.Struct('<dQQ')
+_COUNTERS = struct.Struct(f'<{MAX_COUNTERS}q')
+_NAMES = struct.Struct(f'<{MAX_COUNTERS * NAME_SIZE}s')
+# last error date, last error message
+_ERROR = struct.Struct(f'<d{ERROR_SIZE}s')
+
+_SEQ_OFFSET = _HEADER.size
+_HEARTBEAT_OFFSET = _SEQ_OFFSET + _SEQ.size
+_COUNTERS_OFFSET = _HEARTBEAT_OFFSET + _HEARTBEAT.size
+_NAMES_OFFSET = _COUNTERS_OFFSET + _COUNTERS.size
+_ERROR_OFFSET = _NAMES_OFFSET + _NAMES.size
+SIZE = _ERROR_OFFSET + _ERROR.size
+
+
+class DaemonMetrics:
+    """
+    Writer of the metrics file of a daemon.
+    The file is reset when the object is created.
+    """
+
+    def __init__(self, path, counters=None, heartbeat_timeout=None):
+        counters = list(counters or [])
+        if len(counters) > MAX_COUNTERS:
+            raise ValueError(f'Too many metrics counters (max {MAX_COUNTERS}).')
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, SIZE)
+            self._mm = mmap.mmap(fd, SIZE, access=mmap.ACCESS_WRITE)
+        finally:
+            os.close(fd)
+        self._counters_index = {name: index for index, name in enumerate(counters)}
+        self._counters = [0] * MAX_COUNTERS
+        self._seq = 0
+        self.iterations = 0
+        self.items = 0
+        _HEADER.pack_into(self._mm, 0, MAGIC, VERSION, len(counters), os.getpid(), time.time(), heartbeat_timeout or 0)
+        names = b''.join(name.encode('utf-8')[:NAME_SIZE].ljust(NAME_SIZE, b'\0') for name in counters)
+        _NAMES.pack_into(self._mm, _NAMES_OFFSET, names)
+
+    def _begin(self):
+        self._seq += 1
+        _SEQ.pack_into(self._mm, _SEQ_OFFSET, self._seq)
+
+    def _end(self):
+        self._seq += 1
+        _SEQ.pack_into(self._mm, _SEQ_OFFSET, self._seq)
+
+    def heartbeat(self, items=0):
+        """
+        Mark a loop iteration, optionally with the number of items processed in it.
+        """
+        self.iterations += 1
+        self.items += items
+        self._begin()
+        _HEARTBEAT.pack_into(self._mm, _HEARTBEAT_OFFSET, time.time(), self.iterations, self.items)
+        self._end()
+
+    def incr(self, name, value=1):
+        self.set(name, self._counters[self._counters_index[name]] + value)
+
+    def set(self, name, value):
+        index = self._counters_index[name]
+        self._counters[index] = value
+        self._begin()
+        struct.pack_into('<q', self._mm, _COUNTERS_OFFSET + index * 8, value)
+        self._end()
+
+    def set_error(self, msg):
+        self._begin()
+        _ERROR.pack_into(self._mm, _ERROR_OFFSET, time.time(), str(msg).encode('utf-8')[:ERROR_SIZE])
+        self._end()
+
+    def close(self):
+        self._mm.close()
+
+
+def read_metrics(path, retries=10):
+    """
+    Read the metrics file of a daemon.
+    Returns None if the file does not exist or is invalid.
+    """
+    try:
+        with open(path, 'rb') as fo:
+            if os.fstat(fo.fileno()).st_size < SIZE:
+                return None
+            mm = mmap.mmap(fo.fileno(), SIZE, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    try:
+        magic, version, nb_counters, pid, started_at, heartbeat_timeout = _HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or version != VERSION:
+            return None
+        for _i in range(retries):
+            seq = _SEQ.unpack_from(mm, _SEQ_OFFSET)[0]
+            if seq % 2:
+                # Update in progress
+                continue
+            data = mm[:SIZE]
+            if _SEQ.unpack_from(mm, _SEQ_OFFSET)[0] == seq:
+                break
+        else:
+            return None
+    finally:
+        mm.close()
+
+    heartbeat, iterations, items = _HEARTBEAT.unpack_from(data, _HEARTBEAT_OFFSET)
+    counters = _COUNTERS.unpack_from(data, _COUNTERS_OFFSET)
+    names = _NAMES.unpack_from(data, _NAMES_OFFSET)[0]
+    error_at, error = _ERROR.unpack_from(data, _ERROR_OFFSET)
+    now = time.time()
+    last_seen = heartbeat or started_at
+    return dict(
+        pid=pid,
+        started_at=started_at,
+        heartbeat=heartbeat or None,
+        heartbeat_age=now - last_seen,
+        stale=bool(heartbeat_timeout) and now - last_seen > heartbeat_timeout,
+        iterations=iterations,
+        items=items,
+        counters={
+            names[i * NAME_SIZE:(i + 1) * NAME_SIZE].rstrip(b'\0').decode('utf-8', 'replace'): counters[i]
+            for i in range(nb_counters)
+        },
+        last_error=error.rstrip(b'\0').decode('utf-8', 'replace') or None,
+        last_error_at=error_at or None,
+    )
@@ -0,0 +1,75 @@
+# Django
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+
+class AbstractLockModel(models.Model):
+    """
+    Table of named locks for `django_web_utils.daemon.lock.TableLockBackend`.
+    A lock without expiration date is held until released.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    owner = models.CharField(max_length=255)
+    acquired_at = models.DateTimeField()
+    expires_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        abstract = True
+
+
+class AbstractQueueJob(models.Model):
+    """
+    Jobs table for `django_web_utils.daemon.queue.QueueDaemon`.
+    Use `enqueue` to add jobs, daemons listening on the queue are notified when the transaction is committed.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    queue = models.CharField(max_length=64, default='default')
+    payload = models.JSONField(blank=True, null=True)
+    status = models.CharField(max_length=16, choices=STATUSES, default=PENDING)
+    priority = models.IntegerField(default=0)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    # Date after which the job can be claimed (used for delays and retries backoff)
+    available_at = models.DateTimeField()
+    # Worker currently processing the job, another worker can claim it after the "locked_until" date
+    locked_by = models.CharField(max_length=255, blank=True)
+    locked_until = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        abstract = True
+        indexes = [
+            models.Index(fields=['queue', 'status', 'available_at']),
+        ]
+
+    @classmethod
+    def get_channel(cls, queue):
+        return f'{cls._meta.db_table}_{queue}'
+
+    @classmethod
+    def enqueue(cls, payload=None, queue='default', priority=0, delay=None, max_attempts=5):
+        job = cls.objects.create(
+            queue=queue,
+            payload=payload,
+            priority=priority,
+            max_attempts=max_attempts,
+            available_at=timezone.now() + delay if delay else timezone.now(),
+        )
+        if connection.vendor == 'postgresql':
+            def notify():
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT pg_notify(%s, %s)', [cls.get_channel(queue), str(job.pk)])
+            transaction.on_commit(notify)
+        return job
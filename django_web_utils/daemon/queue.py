@@ -0,0 +1,220 @@
+"""
+Database queue daemon
+Daemon base class processing jobs stored in a model inheriting from `django_web_utils.daemon.models.AbstractQueueJob`.
+Jobs are claimed in batches with `SELECT ... FOR UPDATE SKIP LOCKED`, so several daemons (on several hosts)
+can process the same queue without processing a job twice.
+With PostgreSQL, the daemon waits for `NOTIFY` messages sent by `enqueue` instead of polling the table.
+"""
+import datetime
+import logging
+import select
+import socket
+import threading
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django_web_utils.daemon.base import BaseDaemon
+from django_web_utils.module_utils import import_module_by_python_path
+
+logger = logging.getLogger('djwutils.daemon.queue')
+
+
+class QueueDaemon(BaseDaemon):
+    """
+    Daemon processing queued jobs.
+    Implement `process_job` to handle a job, an exception raised in this function makes the job retried later.
+    The visibility timeout must be longer than the processing time of a job,
+    otherwise the job could be claimed by another worker while it is processed.
+    """
+    # Python path to the jobs model (or the model class)
+    MODEL = None
+    QUEUE_NAME = 'default'
+    # Number of jobs claimed at once
+    BATCH_SIZE = 10
+    # Number of threads processing jobs
+    WORKERS = 4
+    # Number of seconds after which a claimed job can be claimed by another worker
+    VISIBILITY_TIMEOUT = 300
+    # Retries delay: RETRY_DELAY * 2 ** (attempts - 1) seconds, limited to RETRY_MAX_DELAY
+    RETRY_DELAY = 10
+    RETRY_MAX_DELAY = 3600
+    # Maximum delay in seconds between two checks of the table (without notification)
+    POLL_INTERVAL = 30
+    # Delete jobs when done instead of keeping them with the "done" status
+    DELETE_DONE_JOBS = False
+
+    def process_job(self, job):
+        msg = f'Function "process_job" is not implemented in daemon "{self.get_name()}".'
+        logger.error(msg)
+        raise NotImplementedError(msg)
+
+    def get_model(self):
+        return import_module_by_python_path(self.MODEL)
+
+    def get_worker_id(self):
+        if not hasattr(self, '_worker_id'):
+            self._worker_id = f'{socket.gethostname()}:{self.get_name()}:{id(self)}'
+        return self._worker_id
+
+    def get_retry_delay(self, attempts):
+        return min(self.RETRY_DELAY * 2 ** max(attempts - 1, 0), self.RETRY_MAX_DELAY)
+
+    def claim_jobs(self, limit=None):
+        """
+        Claim available jobs (including jobs with an expired visibility timeout) and return them.
+        """
+        from django.db import transaction
+        from django.db.models import F, Q
+        from django.utils import timezone
+
+        model = self.get_model()
+        now = timezone.now()
+        with transaction.atomic():
+            # Jobs which have used all their attempts without ending (crash of their worker for example) have failed
+            expired = list(
+                model.objects
+                .select_for_update(skip_locked=True)
+                .filter(queue=self.QUEUE_NAME, status=model.RUNNING, locked_until__lt=now, attempts__gte=F('max_attempts'))
+                .values_list('pk', flat=True)
+            )
+            if expired:
+                logger.error('Jobs %s have not ended before their visibility timeout after their last attempt.', expired)
+                model.objects.filter(pk__in=expired).update(
+                    status=model.FAILED,
+                    locked_by='',
+                    locked_until=None,
+                    last_error='The visibility timeout has expired during the last attempt.',
+                )
+            ids = list(
+                model.objects
+                .select_for_update(skip_locked=True)
+                .filter(queue=self.QUEUE_NAME)
+                .filter(
+                    Q(status=model.PENDING, available_at__lte=now)
+                    | Q(status=model.RUNNING, locked_until__lt=now, attempts__lt=F('max_attempts'))
+                )
+                .order_by('-priority', 'available_at', 'pk')
+                .values_list('pk', flat=True)[:limit or self.BATCH_SIZE]
+            )
+            if not ids:
+                return []
+            model.objects.filter(pk__in=ids).update(
+                status=model.RUNNING,
+                attempts=F('attempts') + 1,
+                locked_by=self.get_worker_id(),
+                locked_until=now + datetime.timedelta(seconds=self.VISIBILITY_TIMEOUT),
+            )
+        return list(model.objects.filter(pk__in=ids).order_by('-priority', 'available_at', 'pk'))
+
+    def handle_job(self, job):
+        """
+        Process a claimed job and store its result.
+        Returns True if the job has been processed successfully.
+        """
+        from django.utils import timezone
+
+        model = self.get_model()
+        owned = model.objects.filter(pk=job.pk, locked_by=self.get_worker_id())
+        try:
+            self.process_job(job)
+        except Exception as err:
+            logger.error('Failed to process job %s (attempt %s/%s): %s', job.pk, job.attempts, job.max_attempts, err, exc_info=True)
+            if job.attempts < job.max_attempts:
+                delay = datetime.timedelta(seconds=self.get_retry_delay(job.attempts))
+                owned.update(status=model.PENDING, available_at=timezone.now() + delay, locked_by='', locked_until=None, last_error=traceback.format_exc())
+            else:
+                owned.update(status=model.FAILED, locked_by='', locked_until=None, last_error=traceback.format_exc())
+            return False
+        else:
+            if self.DELETE_DONE_JOBS:
+                owned.delete()
+            else:
+                owned.update(status=model.DONE, locked_by='', locked_until=None)
+            return True
+
+    def _listen(self):
+        from django.db import connection
+
+        if connection.vendor != 'postgresql':
+            logger.info('Notifications are not supported by the database, the queue table will be polled.')
+            return False
+        channel = self.get_model().get_channel(self.QUEUE_NAME)
+        with connection.cursor() as cursor:
+            cursor.execute(f'LISTEN {connection.ops.quote_name(channel)}')
+        self._notified = threading.Event()
+        connection.connection.add_notify_handler(lambda notify: self._notified.set())
+        # LISTEN only applies to this connection, it must be issued again after a reconnection
+        self._listen_connection = connection.connection
+        return True
+
+    def _wait_for_notification(self, timeout):
+        from django.db import connection
+
+        if not getattr(self, '_notified', None):
+            time.sleep(timeout)
+            return
+        if connection.connection is None or connection.connection is not self._listen_connection:
+            logger.info('The database connection has changed, listening to notifications again.')
+            self._listen()
+            # Notifications may have been missed, the table is checked again
+            return
+        try:
+            if not self._notified.is_set():
+                select.select([connection.connection.fileno()], [], [], timeout)
+                # Notifications are handled when results are received
+                connection.connection.execute('SELECT 1')
+        except (connection.Database.Error, OSError) as err:
+            # The connection will be opened again by the next query
+            logger.warning('Failed to wait for notifications: %s', err)
+            connection.close()
+        self._notified.clear()
+
+    def _get_stop_event(self):
+        if not hasattr(self, '_stop_event'):
+            self._stop_event = threading.Event()
+        return self._stop_event
+
+    def stop(self):
+        self._get_stop_event().set()
+
+    def _close_worker_connections(self, executor):
+        # Database connections are per thread, close them in each worker thread
+        from django.db import connections
+
+        barrier = threading.Barrier(self.WORKERS)
+
+        def close():
+            try:
+                barrier.wait(timeout=10)
+            except threading.BrokenBarrierError:
+                pass
+            connections.close_all()
+
+        for _i in range(self.WORKERS):
+            executor.submit(close)
+
+    def run(self, *args):
+        stop_event = self._get_stop_event()
+        listening = self._listen()
+        logger.info('Processing queue "%s" (notifications: %s).', self.QUEUE_NAME, 'yes' if listening else 'no')
+        in_flight = set()
+        max_in_flight = self.WORKERS + self.BATCH_SIZE
+        with ThreadPoolExecutor(max_workers=self.WORKERS, thread_name_prefix='djwutils-queue') as executor:
+            while not stop_event.is_set():
+                jobs = []
+                if len(in_flight) < max_in_flight:
+                    jobs = self.claim_jobs(limit=min(self.BATCH_SIZE, max_in_flight - len(in_flight)))
+                    for job in jobs:
+                        in_flight.add(executor.submit(self.handle_job, job))
+                if in_flight:
+                    # Claim again after each processed job or every second if workers are busy
+                    done, in_flight = wait(in_flight, timeout=0 if jobs else 1, return_when=FIRST_COMPLETED)
+                    self.heartbeat(items=len(done))
+                else:
+                    self.heartbeat()
+                    self._wait_for_notification(self.POLL_INTERVAL)
+            self._close_worker_connections(executor)
+        from django.db import connection
+        connection.close()
+        logger.info('Queue "%s" processing stopped.', self.QUEUE_NAME)
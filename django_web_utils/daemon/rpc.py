@@ -0,0 +1,136 @@
+"""
+Daemon RPC
+Unix socket server to call functions of a running daemon from other processes (web workers for example).
+Requests and responses are messages of `django_web_utils.daemon.ipc`:
+    request: {"method": <name>, "args": [...], "kwargs": {...}}
+    response: {"result": <value>} or {"error": <message>}
+Several requests can be sent over the same connection.
+
+Handlers are run in the server threads, so they must be thread safe regarding the daemon main loop.
+"""
+import logging
+import selectors
+import socket
+import threading
+from pathlib import Path
+
+from django_web_utils.daemon.ipc import MessageError, recv_message, send_message
+
+logger = logging.getLogger('djwutils.daemon.rpc')
+
+
+class RPCError(Exception):
+    pass
+
+
+class RPCServer:
+    """
+    RPC server listening on a unix socket in a thread of the current process.
+    The "handlers" argument is a dict of callables by name, use `register` to add handlers later.
+    Handlers arguments and results must be JSON serializable.
+    """
+
+    def __init__(self, path, handlers=None, mode=0o600):
+        self.path = Path(path)
+        self.handlers = dict(handlers or {})
+        self.mode = mode
+        self._sock = None
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def register(self, name, function):
+        self.handlers[name] = function
+
+    def start(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.unlink(missing_ok=True)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(str(self.path))
+        self.path.chmod(self.mode)
+        self._sock.listen(128)
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._serve, name='djwutils-rpc', daemon=True)
+        self._thread.start()
+        logger.info('RPC server listening on %s.', self.path)
+
+    def stop(self):
+        if not self._thread:
+            return
+        self._stop_event.set()
+        self._thread.join(timeout=5)
+        self._thread = None
+        self._sock.close()
+        self._sock = None
+        self.path.unlink(missing_ok=True)
+
+    def _serve(self):
+        with selectors.DefaultSelector() as selector:
+            selector.register(self._sock, selectors.EVENT_READ)
+            while not self._stop_event.is_set():
+                if not selector.select(timeout=0.5):
+                    continue
+                try:
+                    conn, _address = self._sock.accept()
+                except OSError as err:
+                    logger.warning('Failed to accept RPC connection: %s', err)
+                    continue
+                threading.Thread(target=self._handle_connection, args=(conn,), name='djwutils-rpc-conn', daemon=True).start()
+
+    def _handle_connection(self, conn):
+        with conn:
+            while not self._stop_event.is_set():
+                try:
+                    request = recv_message(conn)
+                except (OSError, MessageError) as err:
+                    logger.warning('Invalid RPC request: %s', err)
+                    return
+                if request is None:
+                    return
+                response = self._get_response(request)
+                try:
+                    try:
+                        send_message(conn, response)
+                    except (TypeError, ValueError) as err:
+                        send_message(conn, dict(error=f'The result cannot be serialized: {err}'))
+                except (OSError, MessageError) as err:
+                    logger.warning('Failed to send RPC response: %s', err)
+                    return
+
+    def _get_response(self, request):
+        if not isinstance(request, dict):
+            return dict(error='Invalid request.')
+        handler = self.handlers.get(request.get('method'))
+        if handler is None:
+            return dict(error=f'Unknown method "{request.get("method")}".')
+        try:
+            result = handler(*request.get('args', []), **request.get('kwargs', {}))
+        except Exception as err:
+            logger.error('RPC method "%s" failed: %s', request['method'], err, exc_info=True)
+            return dict(error=f'{err.__class__.__name__}: {err}')
+        return dict(result=result)
+
+
+def call(path, method, *args, timeout=5, **kwargs):
+    """
+    Call a method of a RPC server and return its result.
+    A `RPCError` is raised if the server cannot be reached or if the method failed,
+    a `TimeoutError` is raised if the server does not respond in time.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        try:
+            sock.connect(str(path))
+        except TimeoutError:
+            raise
+        except OSError as err:
+            raise RPCError(f'Cannot connect to RPC server: {err}') from err
+        send_message(sock, dict(method=method, args=list(args), kwargs=kwargs))
+        try:
+            response = recv_message(sock)
+        except MessageError as err:
+            raise RPCError(str(err)) from err
+    if response is None:
+        raise RPCError('Connection closed by the RPC server.')
+    if 'error' in response:
+        raise RPCError(response['error'])
+    return response.get('result')
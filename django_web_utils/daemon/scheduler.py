@@ -0,0 +1,307 @@
+"""
+Periodic jobs scheduler
+Scheduler to run jobs at fixed intervals or using cron expressions in a daemon.
+Jobs are run in a bounded thread pool so that a slow job does not delay the others.
+
+Usage example in a daemon:
+
+    def run(self, *args):
+        scheduler = Scheduler(max_workers=4, heartbeat=self.heartbeat)
+        scheduler.add_job(self.refresh, every=60, jitter=5)
+        scheduler.add_job(self.cleanup, cron='0 3 * * *', lock='/var/lock/cleanup', timeout=3600)
+        scheduler.run()
+"""
+import datetime
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django_web_utils.daemon.lock import acquire_lock, release_lock
+
+logger = logging.getLogger('djwutils.daemon.scheduler')
+
+# Missed runs policies
+# Missed runs are dropped, the job will run at its next scheduled time.
+MISFIRE_SKIP = 'skip'
+# Missed runs are merged in a single run, executed immediately.
+MISFIRE_RUN_ONCE = 'run_once'
+# All missed runs are executed, one after another.
+MISFIRE_RUN_ALL = 'run_all'
+MISFIRE_POLICIES = (MISFIRE_SKIP, MISFIRE_RUN_ONCE, MISFIRE_RUN_ALL)
+
+
+class IntervalTrigger:
+    """
+    Trigger firing every given number of seconds.
+    Next runs are computed from the previous scheduled time and not from the job end, so there is no drift.
+    """
+
+    def __init__(self, seconds):
+        if isinstance(seconds, datetime.timedelta):
+            seconds = seconds.total_seconds()
+        if seconds <= 0:
+            raise ValueError('The interval must be positive.')
+        self.seconds = seconds
+
+    def get_next(self, after):
+        return after + self.seconds
+
+    def __str__(self):
+        return f'every {self.seconds}s'
+
+
+class CronTrigger:
+    """
+    Trigger using a cron expression: "minute hour day month weekday".
+    Fields accept "*", values, ranges ("1-5"), lists ("1,15") and steps ("*/10", "0-30/5").
+    Weekday 0 (or 7) is Sunday. Like cron, a run matches if day or weekday matches when both are restricted.
+    """
+    FIELDS = (
+        ('minute', 0, 59),
+        ('hour', 0, 23),
+        ('day', 1, 31),
+        ('month', 1, 12),
+        ('weekday', 0, 7),
+    )
+
+    def __init__(self, expression):
+        self.expression = expression
+        parts = expression.split()
+        if len(parts) != len(self.FIELDS):
+            raise ValueError(f'Invalid cron expression "{expression}": 5 fields are expected.')
+        values = {}
+        for part, (name, min_val, max_val) in zip(parts, self.FIELDS):
+            values[name] = self._parse_field(part, min_val, max_val, expression)
+        self.minutes = sorted(values['minute'])
+        self.hours = sorted(values['hour'])
+        self.days = values['day']
+        self.months = values['month']
+        self.weekdays = {7 if val == 0 else val for val in values['weekday']}  # Use ISO weekdays
+        self.any_day = parts[2] == '*'
+        self.any_weekday = parts[4] == '*'
+
+    @staticmethod
+    def _parse_field(field, min_val, max_val, expression):
+        values = set()
+        for item in field.split(','):
+            step = 1
+            if '/' in item:
+                item, step = item.split('/', 1)
+                step = int(step)
+            if item == '*':
+                start, end = min_val, max_val
+            elif '-' in item:
+                start, end = (int(val) for val in item.split('-', 1))
+            else:
+                start = end = int(item)
+                if step != 1:
+                    end = max_val
+            if start < min_val or end > max_val or start > end or step < 1:
+                raise ValueError(f'Invalid cron expression "{expression}": "{field}" is out of range.')
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _match_day(self, date):
+        day_ok = date.day in self.days
+        weekday_ok = date.isoweekday() in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day_ok and weekday_ok
+        return day_ok or weekday_ok
+
+    def get_next(self, after):
+        start = datetime.datetime.fromtimestamp(after).replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        date = start.date()
+        # Look for a matching day in the next 5 years (leap days included)
+        for _i in range(366 * 5):
+            if date.month in self.months and self._match_day(date):
+                for hour in self.hours:
+                    if date == start.date() and hour < start.hour:
+                        continue
+                    for minute in self.minutes:
+                        if date == start.date() and hour == start.hour and minute < start.minute:
+                            continue
+                        return datetime.datetime(date.year, date.month, date.day, hour, minute).timestamp()
+            date += datetime.timedelta(days=1)
+        raise ValueError(f'The cron expression "{self.expression}" never matches.')
+
+    def __str__(self):
+        return f'cron "{self.expression}"'
+
+
+class Job:
+    def __init__(self, function, trigger, name=None, args=None, kwargs=None, jitter=0, timeout=None,
+                 lock=None, lock_timeout=None, lock_backend=None, misfire_policy=MISFIRE_RUN_ONCE, misfire_grace=1):
+        if misfire_policy not in MISFIRE_POLICIES:
+            raise ValueError(f'Invalid missed runs policy: "{misfire_policy}".')
+        self.function = function
+        self.trigger = trigger
+        self.name = name or getattr(function, '__name__', repr(function))
+        self.args = args or ()
+        self.kwargs = kwargs or {}
+        self.jitter = jitter
+        self.timeout = timeout
+        self.lock = lock
+        self.lock_timeout = lock_timeout
+        self.lock_backend = lock_backend
+        self.misfire_policy = misfire_policy
+        self.misfire_grace = misfire_grace
+        # Scheduled time without jitter (used to compute next runs)
+        self.scheduled = None
+        self.run_at = None
+        self.future = None
+        self.started_at = None
+        self.timeout_reported = False
+        self.runs = 0
+
+    def __str__(self):
+        return f'{self.name} ({self.trigger})'
+
+    def schedule(self, scheduled):
+        self.scheduled = scheduled
+        self.run_at = scheduled + (random.uniform(0, self.jitter) if self.jitter else 0)
+
+    @property
+    def running(self):
+        return self.future is not None and not self.future.done()
+
+    def execute(self):
+        # Errors are logged here because the result of the future is never read
+        locked = False
+        start = time.monotonic()
+        try:
+            if self.lock:
+                if not acquire_lock(self.lock, self.lock_timeout, backend=self.lock_backend):
+                    logger.info('Job %s skipped because the lock "%s" could not be acquired.', self, self.lock)
+                    return
+                locked = True
+            self.function(*self.args, **self.kwargs)
+        except Exception as err:
+            logger.error('Job %s failed: %s', self, err, exc_info=True)
+        else:
+            logger.debug('Job %s done in %.3fs.', self, time.monotonic() - start)
+        finally:
+            if locked:
+                try:
+                    release_lock(self.lock, backend=self.lock_backend)
+                except Exception as err:
+                    logger.error('Job %s failed to release the lock "%s": %s', self, self.lock, err, exc_info=True)
+
+
+class Scheduler:
+    """
+    Periodic jobs scheduler.
+    Jobs never overlap: a run is skipped (or delayed with the "run_all" policy) while the previous one is running.
+    Python threads cannot be interrupted, so a job exceeding its timeout is only reported in logs.
+    """
+
+    def __init__(self, max_workers=4, heartbeat=None):
+        self.max_workers = max_workers
+        self.heartbeat = heartbeat
+        self.jobs = []
+        self._heap = []
+        self._counter = itertools.count()
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+
+    def add_job(self, function, every=None, cron=None, run_at_start=False, **kwargs):
+        """
+        Add a job running every given seconds (or timedelta) or using a cron expression.
+        Other keyword arguments are given to the `Job` class.
+        """
+        if (every is None) == (cron is None):
+            raise ValueError('Either "every" or "cron" must be given.')
+        trigger = IntervalTrigger(every) if every is not None else CronTrigger(cron)
+        job = Job(function, trigger, **kwargs)
+        now = time.time()
+        job.schedule(now if run_at_start else trigger.get_next(now))
+        self.jobs.append(job)
+        self._push(job)
+        self._wake_event.set()
+        logger.debug('Job %s added, next run: %s.', job, datetime.datetime.fromtimestamp(job.run_at))
+        return job
+
+    def _push(self, job):
+        heapq.heappush(self._heap, (job.run_at, next(self._counter), job))
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake_event.set()
+
+    def _on_job_done(self, future):
+        self._wake_event.set()
+
+    def _submit(self, executor, job):
+        job.started_at = time.monotonic()
+        job.timeout_reported = False
+        job.runs += 1
+        job.future = executor.submit(job.execute)
+        job.future.add_done_callback(self._on_job_done)
+
+    def _process_due_job(self, executor, job, now):
+        if job.running:
+            if job.misfire_policy == MISFIRE_RUN_ALL:
+                # Keep the run, it will be done when the previous one ends
+                return False
+            logger.warning('Job %s is still running, the run scheduled at %s is skipped.', job, datetime.datetime.fromtimestamp(job.scheduled))
+            job.schedule(job.trigger.get_next(now))
+            return True
+        late = now - job.run_at > job.misfire_grace
+        if late and job.misfire_policy == MISFIRE_SKIP:
+            logger.warning('Job %s missed its run scheduled at %s, run skipped.', job, datetime.datetime.fromtimestamp(job.scheduled))
+            job.schedule(job.trigger.get_next(now))
+            return True
+        self._submit(executor, job)
+        if late and job.misfire_policy == MISFIRE_RUN_ONCE:
+            job.schedule(job.trigger.get_next(now))
+        else:
+            job.schedule(job.trigger.get_next(job.scheduled))
+        return True
+
+    def _check_timeouts(self):
+        next_check = None
+        now = time.monotonic()
+        for job in self.jobs:
+            if not job.timeout or not job.running or job.timeout_reported:
+                continue
+            deadline = job.started_at + job.timeout
+            if deadline <= now:
+                logger.error('Job %s is running for more than %ss.', job, job.timeout)
+                job.timeout_reported = True
+            elif next_check is None or deadline - now < next_check:
+                next_check = deadline - now
+        return next_check
+
+    def run(self, max_wait=60):
+        """
+        Run the scheduler until `stop` is called.
+        The "max_wait" argument is the maximum delay in seconds between two heartbeats.
+        """
+        logger.info('Scheduler started with %s job(s).', len(self.jobs))
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='djwutils-scheduler') as executor:
+            while not self._stop_event.is_set():
+                self._wake_event.clear()
+                now = time.time()
+                delayed = []
+                while self._heap and self._heap[0][0] <= now:
+                    _run_at, _count, job = heapq.heappop(self._heap)
+                    if self._process_due_job(executor, job, now):
+                        self._push(job)
+                    else:
+                        delayed.append(job)
+                # Delayed jobs are checked again when a job ends
+                wait = max_wait
+                if self._heap:
+                    wait = min(wait, max(self._heap[0][0] - time.time(), 0))
+                for job in delayed:
+                    self._push(job)
+                timeout_check = self._check_timeouts()
+                if timeout_check is not None:
+                    wait = min(wait, timeout_check)
+                if self.heartbeat:
+                    self.heartbeat()
+                self._wake_event.wait(wait)
+            logger.info('Scheduler stopped, waiting for running jobs.')
@@ -0,0 +1,210 @@
+"""
+Fork server (zygote)
+Process forked from an initialized daemon (Django set up and tasks modules imported) which forks a child for each task request.
+Running a task in an isolated process then costs a fork instead of a new Python interpreter start.
+
+Tasks are named callables, declared when the server is created.
+Requests are sent over a unix socket (see `django_web_utils.daemon.ipc`) and the client receives the task result and the child exit code.
+"""
+import collections
+import logging
+import os
+import selectors
+import signal
+import socket
+import sys
+import traceback
+from pathlib import Path
+
+from django_web_utils.daemon.ipc import MessageError, recv_message, send_message
+from django_web_utils.module_utils import import_module_by_python_path
+
+logger = logging.getLogger('djwutils.daemon.zygote')
+
+TaskResult = collections.namedtuple('TaskResult', ['exit_code', 'result', 'error'])
+
+
+class ForkServerError(Exception):
+    pass
+
+
+class ForkServer:
+    """
+    Fork server running in a child process of the current process.
+    The "tasks" argument is a dict of callables or python paths to callables by task name.
+    The "post_fork" argument is a function called in the server process just after it has been forked.
+    Database connections of the current process are closed before forking (they are reopened when needed),
+    so the server should be started outside of any transaction.
+    """
+
+    def __init__(self, path, tasks, post_fork=None):
+        self.path = Path(path)
+        self.tasks = dict(tasks)
+        self.post_fork = post_fork
+        self.pid = None
+
+    def start(self):
+        # Open the socket before forking so that it is ready when this function returns
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.unlink(missing_ok=True)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(str(self.path))
+        self.path.chmod(0o600)
+        sock.listen(128)
+        if 'django.db' in sys.modules:
+            # Forked processes must not share database connections
+            from django.db import connections
+            connections.close_all()
+
+        pid = os.fork()
+        if pid:
+            sock.close()
+            self.pid = pid
+            logger.info('Fork server started (pid: %s, socket: %s).', pid, self.path)
+            return pid
+        code = 0
+        try:
+            self._serve(sock)
+        except Exception as err:
+            logger.error('Fork server error: %s', err, exc_info=True)
+            code = 1
+        finally:
+            os._exit(code)
+
+    def stop(self):
+        if not self.pid:
+            return
+        try:
+            os.kill(self.pid, signal.SIGTERM)
+            os.waitpid(self.pid, 0)
+        except (OSError, ChildProcessError) as err:
+            logger.debug('Fork server already stopped: %s', err)
+        self.pid = None
+        self.path.unlink(missing_ok=True)
+
+    def _serve(self, sock):
+        parent_pid = os.getppid()
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        if self.post_fork:
+            self.post_fork()
+        # Import tasks modules now, so that children do not have to
+        tasks = {name: import_module_by_python_path(task) for name, task in self.tasks.items()}
+
+        # Wake up the select call when a child ends
+        wake_r, wake_w = os.pipe()
+        os.set_blocking(wake_r, False)
+        os.set_blocking(wake_w, False)
+        signal.set_wakeup_fd(wake_w)
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+
+        selector = selectors.DefaultSelector()
+        selector.register(sock, selectors.EVENT_READ)
+        selector.register(wake_r, selectors.EVENT_READ)
+        pending = {}
+        while os.getppid() == parent_pid:
+            for key, _events in selector.select(timeout=1):
+                if key.fileobj is sock:
+                    conn, _address = sock.accept()
+                    child_pid = self._fork_task(conn, tasks, closing=[sock, selector, wake_r, wake_w, *pending.values()])
+                    if child_pid:
+                        pending[child_pid] = conn
+                    else:
+                        conn.close()
+                else:
+                    try:
+                        while os.read(wake_r, 512):
+                            pass
+                    except BlockingIOError:
+                        pass
+            self._reap_children(pending)
+        logger.info('Fork server stopped because its parent process has ended.')
+
+    def _fork_task(self, conn, tasks, closing):
+        conn.settimeout(10)
+        try:
+            request = recv_message(conn)
+        except (OSError, MessageError) as err:
+            logger.warning('Invalid fork server request: %s', err)
+            return None
+        task = tasks.get(request.get('task')) if isinstance(request, dict) else None
+        if task is None:
+            try:
+                send_message(conn, dict(error='Unknown task.', exit_code=None))
+            except OSError:
+                pass
+            return None
+        pid = os.fork()
+        if pid:
+            return pid
+
+        # Child process
+        code = 0
+        try:
+            signal.set_wakeup_fd(-1)
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            for item in closing:
+                if isinstance(item, int):
+                    os.close(item)
+                else:
+                    item.close()
+            conn.settimeout(None)
+            try:
+                result = task(*request.get('args', []), **request.get('kwargs', {}))
+                send_message(conn, dict(result=result))
+            except Exception as err:
+                code = 1
+                logger.error('Fork server task "%s" failed: %s', request['task'], err, exc_info=True)
+                send_message(conn, dict(error=f'{err.__class__.__name__}: {err}', traceback=traceback.format_exc()))
+        except Exception:
+            code = 1
+        finally:
+            os._exit(code)
+
+    @staticmethod
+    def _reap_children(pending):
+        while pending:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            conn = pending.pop(pid, None)
+            if conn:
+                try:
+                    send_message(conn, dict(exit_code=os.waitstatus_to_exitcode(status)))
+                except OSError:
+                    pass
+                conn.close()
+
+
+def run_task(path, task, args=None, kwargs=None, timeout=None):
+    """
+    Run a task in a fork server and return a `TaskResult` (exit code, result and error message).
+    The task arguments and result must be JSON serializable.
+    A `TimeoutError` is raised if the task does not end in time, but the task is not stopped.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        try:
+            sock.connect(str(path))
+        except OSError as err:
+            raise ForkServerError(f'Cannot connect to fork server: {err}') from err
+        send_message(sock, dict(task=task, args=list(args or []), kwargs=dict(kwargs or {})))
+        result = error = None
+        while True:
+            try:
+                msg = recv_message(sock)
+            except MessageError as err:
+                raise ForkServerError(str(err)) from err
+            if msg is None:
+                raise ForkServerError('Connection closed by the fork server.')
+            if 'result' in msg:
+                result = msg['result']
+            if msg.get('error'):
+                error = msg['error']
+            if 'exit_code' in msg:
+                if msg['exit_code'] is None:
+                    raise ForkServerError(error)
+                return TaskResult(msg['exit_code'], result, error)
@@ -0,0 +1,40 @@
+"""
+Background tasks
+Thread pool shared by the file browser to run tasks outside of requests (indexes updates for example).
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django_web_utils.file_browser import config
+
+logger = logging.getLogger('djwutils.file_browser.background')
+
+_executor = None
+_pending = set()
+_lock = threading.Lock()
+
+
+def _run(key, function, args):
+    try:
+        return function(*args)
+    except Exception as err:
+        logger.error('Background task %s failed: %s', key, err, exc_info=True)
+    finally:
+        with _lock:
+            _pending.discard(key)
+
+
+def submit(key, function, *args):
+    """
+    Run a function in a background thread.
+    Returns the future of the task or None if a task with the same key is already pending.
+    """
+    global _executor
+    with _lock:
+        if key in _pending:
+            return None
+        _pending.add(key)
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=config.get_index_workers(), thread_name_prefix='djwutils-fb')
+    return _executor.submit(_run, key, function, args)
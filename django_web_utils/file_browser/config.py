@@ -1,3 +1,5 @@
+import os
+import tempfile
 # Django
 from django.contrib.auth.decorators import user_passes_test
 from django.conf import settings
@@ -32,3 +34,75 @@ def get_base_url(namespace):
     nsp = clean_namespace(namespace)
     url = getattr(settings, 'FILE_BROWSER_DIRS')[nsp][1].rstrip('/')
     return url
+
+
+def get_index_dir():
+    return getattr(settings, 'FILE_BROWSER_INDEX_DIR', None)
+
+
+def get_index_workers():
+    return getattr(settings, 'FILE_BROWSER_INDEX_WORKERS', 2)
+
+
+def get_size_index_ttl():
+    return getattr(settings, 'FILE_BROWSER_SIZE_INDEX_TTL', 300)
+
+
+def get_size_index_measure_files():
+    return getattr(settings, 'FILE_BROWSER_SIZE_INDEX_MEASURE_FILES', False)
+
+
+def get_search_index_ttl():
+    return getattr(settings, 'FILE_BROWSER_SEARCH_INDEX_TTL', 60)
+
+
+def get_thumbnails_dir():
+    return getattr(settings, 'FILE_BROWSER_THUMBNAILS_DIR', None)
+
+
+def get_thumbnails_pregeneration():
+    return getattr(settings, 'FILE_BROWSER_THUMBNAILS_PREGENERATE', False)
+
+
+def get_dirs_tree_depth():
+    return getattr(settings, 'FILE_BROWSER_DIRS_TREE_DEPTH', 1)
+
+
+def get_uploads_dir(namespace):
+    uploads_dir = getattr(settings, 'FILE_BROWSER_UPLOADS_DIR', None) or os.path.join(tempfile.gettempdir(), 'djwutils-uploads')
+    return os.path.join(uploads_dir, clean_namespace(namespace))
+
+
+def get_uploads_chunk_size():
+    return getattr(settings, 'FILE_BROWSER_UPLOADS_CHUNK_SIZE', 8 * 1024 * 1024)
+
+
+def get_uploads_expiration():
+    return getattr(settings, 'FILE_BROWSER_UPLOADS_EXPIRATION', 24 * 3600)
+
+
+def get_uploads_max_size():
+    return getattr(settings, 'FILE_BROWSER_UPLOADS_MAX_SIZE', None)
+
+
+def get_jobs_dir(namespace):
+    jobs_dir = getattr(settings, 'FILE_BROWSER_JOBS_DIR', None) or os.path.join(tempfile.gettempdir(), 'djwutils-jobs')
+    return os.path.join(jobs_dir, clean_namespace(namespace))
+
+
+def get_jobs_workers():
+    return getattr(settings, 'FILE_BROWSER_JOBS_WORKERS', 2)
+
+
+def get_jobs_wait():
+    return getattr(settings, 'FILE_BROWSER_JOBS_WAIT', 2)
+
+
+def get_sendfile_mode():
+    return getattr(settings, 'FILE_BROWSER_SENDFILE', None)
+
+
+def get_sendfile_location(namespace):
+    nsp = clean_namespace(namespace)
+    locations = getattr(settings, 'FILE_BROWSER_SENDFILE_LOCATIONS', None) or {}
+    return locations.get(nsp, '/protected/%s/' % nsp).rstrip('/') + '/'
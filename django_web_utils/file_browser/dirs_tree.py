@@ -0,0 +1,110 @@
+"""
+Directories tree
+Lazy listing of the directories tree of a file browser storage, level by level.
+
+The sub directories of each directory are cached in memory and the cache is validated with the modification time of
+the directory (which changes when an entry is added, removed or renamed in it). So listing a level which did not change
+costs a `stat` call for the directory and for each of its sub directories (to know if they have children).
+"""
+import collections
+import logging
+import os
+import threading
+
+logger = logging.getLogger('djwutils.file_browser.dirs_tree')
+
+# Maximum number of directories in cache
+CACHE_SIZE = 10000
+
+_cache = collections.OrderedDict()
+_lock = threading.Lock()
+
+
+def get_sub_dirs(path):
+    """
+    Get the sorted list of the names of the sub directories of a directory.
+    Names containing quotes are ignored.
+    """
+    path = os.path.normpath(path)
+    mtime_ns = os.stat(path).st_mtime_ns
+    with _lock:
+        cached = _cache.get(path)
+        if cached and cached[0] == mtime_ns:
+            _cache.move_to_end(path)
+            return cached[1]
+    names = []
+    with os.scandir(path) as it:
+        for entry in it:
+            if '\'' in entry.name or '"' in entry.name:
+                continue
+            try:
+                if entry.is_dir():
+                    names.append(entry.name)
+            except OSError:
+                continue
+    names.sort(key=lambda name: name.lower())
+    with _lock:
+        _cache[path] = (mtime_ns, names)
+        _cache.move_to_end(path)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return names
+
+
+def has_sub_dirs(path):
+    try:
+        return len(get_sub_dirs(path)) > 0
+    except OSError:
+        return False
+
+
+def get_dirs_tree(path, depth=None):
+    """
+    Get the tree of the sub directories of a directory.
+    Returns a list of dicts with "dir_name" and "has_children" keys, and a "sub_dirs" key containing the tree of
+    the sub directory if the depth limit is not reached (`None` for no limit).
+    """
+    try:
+        names = get_sub_dirs(path)
+    except OSError as err:
+        logger.error(err)
+        return []
+    dirs = []
+    for name in names:
+        sub_path = os.path.join(path, name)
+        info = dict(dir_name=name)
+        if depth is None or depth > 1:
+            info['sub_dirs'] = get_dirs_tree(sub_path, None if depth is None else depth - 1)
+            info['has_children'] = len(info['sub_dirs']) > 0
+        else:
+            info['has_children'] = has_sub_dirs(sub_path)
+        dirs.append(info)
+    return dirs
+
+
+def get_tree_signature(path, depth=None):
+    """
+    Get the modification times of the directories used to build the tree of a directory (see `get_dirs_tree`).
+    The tree did not change if its signature did not change, so the signature can be used as a validator
+    without building the tree.
+    """
+    try:
+        signature = [os.stat(path).st_mtime_ns]
+        names = get_sub_dirs(path)
+    except OSError:
+        return None
+    for name in names:
+        sub_path = os.path.join(path, name)
+        if depth is None or depth > 1:
+            signature.append((name, get_tree_signature(sub_path, None if depth is None else depth - 1)))
+        else:
+            try:
+                signature.append((name, os.stat(sub_path).st_mtime_ns))
+            except OSError:
+                signature.append((name, None))
+    return signature
+
+
+def clear_cache():
+    with _lock:
+        _cache.clear()
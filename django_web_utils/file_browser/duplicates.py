@@ -0,0 +1,183 @@
+"""
+Duplicate files finder
+Search of files with identical content in a file browser storage, in several stages to read as little data as possible:
+- files are grouped by size (files with a unique size have no duplicate),
+- files of a same size are compared with a hash of their first and last blocks,
+- a hash of the full content is computed only for the remaining candidates.
+Hashes are computed in a thread pool (hashing functions release the GIL on big buffers).
+Paths which are hard links to a same file are considered as a single file.
+"""
+import collections
+import hashlib
+import logging
+import os
+import stat
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger('djwutils.file_browser.duplicates')
+
+# Size of the blocks read at the start and at the end of files for the partial hash
+BLOCK_SIZE = 64 * 1024
+READ_SIZE = 1024 * 1024
+
+
+class FileEntry:
+    """
+    File of the storage (possibly with several paths if it has hard links).
+    """
+
+    def __init__(self, path, st):
+        self.paths = [path]
+        self.size = st.st_size
+        self.dev = st.st_dev
+        self.ino = st.st_ino
+        self.mtime_ns = st.st_mtime_ns
+
+    def is_unchanged(self, path):
+        try:
+            st = os.stat(path, follow_symlinks=False)
+        except OSError:
+            return False
+        return st.st_size == self.size and st.st_mtime_ns == self.mtime_ns
+
+
+def get_partial_hash(path, size):
+    hasher = hashlib.blake2b()
+    with open(path, 'rb') as fo:
+        hasher.update(fo.read(BLOCK_SIZE))
+        if size > 2 * BLOCK_SIZE:
+            fo.seek(size - BLOCK_SIZE)
+        hasher.update(fo.read(BLOCK_SIZE))
+    return hasher.hexdigest()
+
+
+def get_full_hash(path):
+    hasher = hashlib.blake2b()
+    with open(path, 'rb') as fo:
+        while True:
+            data = fo.read(READ_SIZE)
+            if not data:
+                break
+            hasher.update(data)
+    return hasher.hexdigest()
+
+
+def scan_files(base_path, min_size=1):
+    """
+    List the regular files of a directory tree (symbolic links are ignored) with a size of at least `min_size` bytes.
+    Returns a dict of lists of `FileEntry` by size.
+    """
+    inodes = {}
+    for root, dirs, files in os.walk(base_path):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path, follow_symlinks=False)
+            except OSError:
+                continue
+            if not stat.S_ISREG(st.st_mode) or st.st_size < min_size:
+                continue
+            key = (st.st_dev, st.st_ino)
+            if key in inodes:
+                inodes[key].paths.append(path)
+            else:
+                inodes[key] = FileEntry(path, st)
+    by_size = collections.defaultdict(list)
+    for entry in inodes.values():
+        by_size[entry.size].append(entry)
+    return by_size
+
+
+def _group_by_hash(executor, entries, function):
+    groups = collections.defaultdict(list)
+    hashes = executor.map(lambda entry: _safe_hash(function, entry), entries)
+    for entry, digest in zip(entries, hashes):
+        if digest is not None:
+            groups[digest].append(entry)
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def _safe_hash(function, entry):
+    try:
+        return function(entry)
+    except OSError as err:
+        logger.warning('Failed to read "%s": %s', entry.paths[0], err)
+        return None
+
+
+def find_duplicates(base_path, min_size=1, workers=4):
+    """
+    Find the files with identical content in a directory tree.
+    Returns a list of groups of duplicates: lists of `FileEntry` (at least two per group, sorted by path).
+    """
+    by_size = scan_files(base_path, min_size)
+    candidates = [entries for entries in by_size.values() if len(entries) > 1]
+    duplicates = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for entries in candidates:
+            for group in _group_by_hash(executor, entries, lambda entry: get_partial_hash(entry.paths[0], entry.size)):
+                if group[0].size <= 2 * BLOCK_SIZE:
+                    # The partial hash covers the full content
+                    duplicates.append(group)
+                else:
+                    duplicates.extend(_group_by_hash(executor, group, lambda entry: get_full_hash(entry.paths[0])))
+    for group in duplicates:
+        group.sort(key=lambda entry: entry.paths[0])
+    duplicates.sort(key=lambda group: (-group[0].size, group[0].paths[0]))
+    return duplicates
+
+
+def get_reclaimable_size(duplicates):
+    """
+    Get the disk space which can be reclaimed by keeping only one file of each group.
+    """
+    return sum(group[0].size * (len(group) - 1) for group in duplicates)
+
+
+def remove_duplicates(duplicates, mode):
+    """
+    Keep only the first file of each group: other files are replaced by hard links to it (`mode="hardlink"`)
+    or deleted (`mode="delete"`). Files modified since the search are not changed.
+    Returns the list of paths replaced or deleted and the reclaimed size.
+    """
+    if mode not in ('hardlink', 'delete'):
+        raise ValueError('Invalid mode: %s' % mode)
+    changed = []
+    reclaimed = 0
+    for group in duplicates:
+        kept = group[0]
+        if not kept.is_unchanged(kept.paths[0]):
+            logger.warning('Skipping duplicates of "%s": the file changed.', kept.paths[0])
+            continue
+        for entry in group[1:]:
+            if mode == 'hardlink' and entry.dev != kept.dev:
+                logger.warning('Cannot link "%s": not on the same file system.', entry.paths[0])
+                continue
+            done = []
+            for path in entry.paths:
+                if not entry.is_unchanged(path):
+                    logger.warning('Skipping "%s": the file changed.', path)
+                    continue
+                try:
+                    if mode == 'hardlink':
+                        # Replace the file atomically by a link
+                        tmp_path = '%s.%s.tmp' % (path, uuid.uuid4().hex[:8])
+                        os.link(kept.paths[0], tmp_path)
+                        try:
+                            os.replace(tmp_path, path)
+                        except OSError:
+                            os.unlink(tmp_path)
+                            raise
+                    else:
+                        os.unlink(path)
+                except OSError as err:
+                    logger.warning('Failed to %s "%s": %s', mode, path, err)
+                else:
+                    done.append(path)
+            changed.extend(done)
+            if done and len(done) == len(entry.paths):
+                # The space is only reclaimed when all the links of the file have been replaced
+                reclaimed += entry.size
+    return changed, reclaimed
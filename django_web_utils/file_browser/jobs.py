@@ -0,0 +1,201 @@
+"""
+Background jobs
+File browser operations which can take a long time (deletion of big trees for example) run as jobs in background threads.
+The state of each job is stored in a JSON file in the jobs directory (see `FILE_BROWSER_JOBS_DIR` setting),
+so the progress of a job can be read by any process of the application.
+The process running a job is recorded in its state, so unfinished jobs of a process which has been stopped
+(a recycled web worker for example) are marked as failed when they are loaded.
+"""
+import json
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+# Django
+from django.utils import translation
+from django.utils.translation import gettext as _
+# Django web utils
+from django_web_utils.file_browser import config
+from django_web_utils.system_utils import is_process_alive
+
+logger = logging.getLogger('djwutils.file_browser.jobs')
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELED = 'canceled'
+
+# Finished jobs are removed after this number of seconds
+MAX_AGE = 24 * 3600
+
+_executor = None
+_lock = threading.Lock()
+
+
+class JobCanceled(Exception):
+    pass
+
+
+class Job:
+    """
+    Job stored in a "<id>.json" file.
+    A cancellation is requested by creating a "<id>.cancel" file (the state file is only written by the job thread,
+    or by the process loading it if the process of the job does not exist anymore).
+    """
+    # Minimum number of seconds between two writes of the progress
+    SAVE_INTERVAL = 0.5
+
+    def __init__(self, jobs_dir, job_id):
+        self.jobs_dir = Path(jobs_dir)
+        self.id = job_id
+        self.path = self.jobs_dir / f'{job_id}.json'
+        self.cancel_path = self.jobs_dir / f'{job_id}.cancel'
+        self.info = {}
+        self._saved_at = 0
+
+    @classmethod
+    def create(cls, jobs_dir, kind, user_id=None):
+        jobs_dir = Path(jobs_dir)
+        jobs_dir.mkdir(parents=True, exist_ok=True)
+        job = cls(jobs_dir, uuid.uuid4().hex)
+        now = time.time()
+        job.info = dict(
+            kind=kind, user=user_id, status=PENDING, created_at=now, updated_at=now, progress={}, message=None, error=None,
+            host=socket.gethostname(), pid=os.getpid())
+        job.save()
+        return job
+
+    @classmethod
+    def load(cls, jobs_dir, job_id):
+        job = cls(jobs_dir, job_id)
+        try:
+            job.info = json.loads(job.path.read_text())
+        except (OSError, ValueError):
+            return None
+        if job.is_orphaned():
+            logger.warning('Job %s (%s) has been interrupted (process %s stopped).', job.id, job.info['kind'], job.info['pid'])
+            job.info['status'] = FAILED
+            job.info['error'] = _('The operation has been interrupted.')
+            job.save()
+            job.cancel_path.unlink(missing_ok=True)
+        return job
+
+    @property
+    def status(self):
+        return self.info['status']
+
+    @property
+    def finished(self):
+        return self.info['status'] in (DONE, FAILED, CANCELED)
+
+    def is_orphaned(self):
+        """
+        Check if the job is not finished but the process which runs it does not exist anymore
+        (processes of other hosts cannot be checked).
+        """
+        if self.finished or not self.info.get('pid') or self.info.get('host') != socket.gethostname():
+            return False
+        return not is_process_alive(self.info['pid'])
+
+    def cancel(self):
+        """
+        Request the cancellation of the job (the job stops at its next progress update).
+        """
+        if not self.finished:
+            self.cancel_path.touch()
+
+    def is_cancel_requested(self):
+        return self.cancel_path.exists()
+
+    def save(self):
+        self.info['updated_at'] = self._saved_at = time.time()
+        # Write in a temporary file first so that the file is never read while incomplete
+        with tempfile.NamedTemporaryFile('w', dir=self.jobs_dir, suffix='.tmp', delete=False) as fo:
+            fo.write(json.dumps(self.info))
+        os.replace(fo.name, self.path)
+
+    def set_progress(self, force=False, **progress):
+        """
+        Update the progress information of the job (written at most every `SAVE_INTERVAL` seconds unless forced).
+        Raises `JobCanceled` if the cancellation of the job has been requested.
+        """
+        self.info['progress'].update(progress)
+        if force or time.time() - self._saved_at >= self.SAVE_INTERVAL:
+            if self.is_cancel_requested():
+                raise JobCanceled()
+            self.save()
+
+    def get_status(self):
+        return dict(
+            id=self.id,
+            kind=self.info['kind'],
+            status=self.info['status'],
+            progress=self.info['progress'],
+            message=self.info['message'],
+            error=self.info['error'],
+        )
+
+
+def _run(job, function, args, language):
+    job.info['status'] = RUNNING
+    job.save()
+    try:
+        with translation.override(language):
+            if job.is_cancel_requested():
+                raise JobCanceled()
+            job.info['message'] = function(job, *args)
+    except JobCanceled:
+        logger.info('Job %s (%s) canceled.', job.id, job.info['kind'])
+        job.info['status'] = CANCELED
+        with translation.override(language):
+            job.info['error'] = _('The operation has been canceled.')
+    except Exception as err:
+        logger.error('Job %s (%s) failed: %s', job.id, job.info['kind'], err, exc_info=not isinstance(err, OSError))
+        job.info['status'] = FAILED
+        job.info['error'] = str(err)
+    else:
+        job.info['status'] = DONE
+    finally:
+        job.save()
+        job.cancel_path.unlink(missing_ok=True)
+
+
+def start(job, function, *args):
+    """
+    Run a job function in a background thread.
+    The function is called with the job and the given arguments, it should return a message describing the result
+    and raise an exception with a readable message if it fails. It should update the progress of the job regularly
+    to allow its cancellation.
+    Returns the future of the job.
+    """
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=config.get_jobs_workers(), thread_name_prefix='djwutils-fb-jobs')
+    return _executor.submit(_run, job, function, args, translation.get_language())
+
+
+def clean_expired_jobs(jobs_dir, max_age=MAX_AGE):
+    """
+    Remove finished jobs older than `max_age` seconds.
+    Jobs of stopped processes are marked as failed by their loading, so they are removed like other finished jobs.
+    """
+    limit = time.time() - max_age
+    try:
+        entries = list(os.scandir(jobs_dir))
+    except FileNotFoundError:
+        return 0
+    removed = 0
+    for entry in entries:
+        if entry.name.endswith('.json'):
+            job = Job.load(jobs_dir, entry.name[:-5])
+            if job and job.finished and job.info['updated_at'] < limit:
+                job.path.unlink(missing_ok=True)
+                removed += 1
+    return removed
@@ -0,0 +1,55 @@
+import os
+# Django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+# Django web utils
+from django_web_utils.file_browser import config
+from django_web_utils.file_browser.duplicates import find_duplicates, get_reclaimable_size, remove_duplicates
+from django_web_utils.file_browser.search_index import update_search_index
+from django_web_utils.file_browser.size_index import get_size_index
+from django_web_utils.files_utils import get_size_display
+
+
+class Command(BaseCommand):
+    help = (
+        'Find files with identical content in a file browser storage. '
+        'The first file of each group (by path) is kept if duplicates are replaced by hard links or deleted.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('namespace', nargs='?', default=None, help='Namespace of the storage in FILE_BROWSER_DIRS.')
+        parser.add_argument('--min-size', type=int, default=1, help='Ignore files smaller than this size in bytes.')
+        parser.add_argument('--workers', type=int, default=4, help='Number of threads used to compute hashes.')
+        action = parser.add_mutually_exclusive_group()
+        action.add_argument('--hardlink', action='store_true', help='Replace duplicates by hard links to the kept file.')
+        action.add_argument('--delete', action='store_true', help='Delete duplicates.')
+
+    def handle(self, *args, **options):
+        namespace = options['namespace']
+        if config.clean_namespace(namespace) not in getattr(settings, 'FILE_BROWSER_DIRS', {}):
+            raise CommandError('Unknown namespace: %s' % config.clean_namespace(namespace))
+        base_path = config.get_base_path(namespace)
+        duplicates = find_duplicates(base_path, min_size=options['min_size'], workers=options['workers'])
+
+        for group in duplicates:
+            self.stdout.write('%s (%s):' % (get_size_display(group[0].size), len(group)))
+            for entry in group:
+                for path in entry.paths:
+                    self.stdout.write('    %s' % os.path.relpath(path, base_path))
+        nb_files = sum(len(group) - 1 for group in duplicates)
+        reclaimable = get_reclaimable_size(duplicates)
+        self.stdout.write('%s duplicate file(s) in %s group(s), reclaimable space: %s.' % (
+            nb_files, len(duplicates), get_size_display(reclaimable)))
+
+        mode = 'hardlink' if options['hardlink'] else 'delete' if options['delete'] else None
+        if mode and duplicates:
+            changed, reclaimed = remove_duplicates(duplicates, mode)
+            if mode == 'delete':
+                update_search_index(namespace, removed=[os.path.relpath(path, base_path) for path in changed])
+            size_index = get_size_index(namespace)
+            if size_index and changed:
+                # The sizes of the dirs containing changed files and of all their parents must be updated,
+                # the whole storage is refreshed (it costs less than the search of duplicates)
+                size_index.refresh()
+            self.stdout.write(self.style.SUCCESS('%s file(s) %s, reclaimed space: %s.' % (
+                len(changed), 'replaced by hard links' if mode == 'hardlink' else 'deleted', get_size_display(reclaimed))))
@@ -0,0 +1,206 @@
+"""
+Files operations
+Operations on the files of a file browser storage, usable in background jobs (they can report their progress).
+"""
+import errno
+import fcntl
+import os
+import shutil
+import stat
+
+# Number of removed entries between two progress reports
+PROGRESS_INTERVAL = 1000
+# Maximum number of bytes copied by the kernel in one call
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+# "FICLONE" ioctl request (from linux/fs.h), used to create a reflink of a file
+FICLONE = 0x40049409
+# Errors meaning that a copy method is not supported for the given files
+_UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTTY, errno.EBADF, errno.EPERM}
+
+
+def remove_tree(path, on_progress=None):
+    """
+    Remove a file or a dir with all its content.
+    Returns the number of deleted files and dirs.
+
+    Entries are removed relatively to the file descriptor of their directory (like the fd based implementation of
+    `shutil.rmtree`): there is no path resolution per entry and symbolic links are removed, never followed.
+    `on_progress` is called with the number of deleted files and dirs every `PROGRESS_INTERVAL` entries
+(it can raise an exception to stop the removal, even in the middle of a large directory).
+    """
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode):
+        os.unlink(path)
+        return 1, 0
+
+    files_deleted = 0
+    dirs_deleted = 0
+    next_report = PROGRESS_INTERVAL
+
+    def report():
+        nonlocal next_report
+        if on_progress and files_deleted + dirs_deleted >= next_report:
+            on_progress(files_deleted, dirs_deleted)
+            next_report = files_deleted + dirs_deleted + PROGRESS_INTERVAL
+
+    for root, dirs, files, root_fd in os.fwalk(path, topdown=False):
+        for name in files:
+            os.unlink(name, dir_fd=root_fd)
+            files_deleted += 1
+            report()
+        for name in dirs:
+            try:
+                os.rmdir(name, dir_fd=root_fd)
+                dirs_deleted += 1
+            except NotADirectoryError:
+                # Symbolic link to a directory
+                os.unlink(name, dir_fd=root_fd)
+                files_deleted += 1
+            report()
+    os.rmdir(path)
+    dirs_deleted += 1
+    return files_deleted, dirs_deleted
+
+
+def _copy_fds(src_fd, dst_fd, size, on_progress=None):
+    """
+    Copy the content of a file to another one without passing it through user space buffers if possible:
+    with a reflink (copy on write clone), then with `copy_file_range`, then with `sendfile`.
+    """
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+    except OSError as err:
+        if err.errno not in _UNSUPPORTED_ERRNOS:
+            raise
+    else:
+        if on_progress:
+            on_progress(size)
+        return 'reflink'
+
+    for method in ('copy_file_range', 'sendfile'):
+        copied = 0
+        try:
+            while True:
+                if method == 'copy_file_range':
+                    count = os.copy_file_range(src_fd, dst_fd, COPY_CHUNK_SIZE)
+                else:
+                    count = os.sendfile(dst_fd, src_fd, None, COPY_CHUNK_SIZE)
+                if not count:
+                    break
+                copied += count
+                if on_progress:
+                    on_progress(count)
+        except OSError as err:
+            if copied or err.errno not in _UNSUPPORTED_ERRNOS:
+                raise
+        else:
+            return method
+
+    while True:
+        data = os.read(src_fd, COPY_CHUNK_SIZE)
+        if not data:
+            break
+        os.write(dst_fd, data)
+        if on_progress:
+            on_progress(len(data))
+    return 'read'
+
+
+def copy_file(src, dst, on_progress=None):
+    """
+    Copy a file with its permissions and modification time.
+    `on_progress` is called with the number of bytes copied since its last call.
+    The destination file is removed if the copy fails.
+    """
+    with open(src, 'rb') as src_fo:
+        size = os.fstat(src_fo.fileno()).st_size
+        with open(dst, 'wb') as dst_fo:
+            try:
+                _copy_fds(src_fo.fileno(), dst_fo.fileno(), size, on_progress)
+            except BaseException:
+                dst_fo.close()
+                os.unlink(dst)
+                raise
+    shutil.copystat(src, dst)
+
+
+def get_tree_size(path):
+    """
+    Get the size of the data to copy for a file or for a dir with all its content (only regular files are counted).
+    """
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode):
+        return st.st_size if stat.S_ISREG(st.st_mode) else 0
+    size = 0
+    for root, dirs, files, root_fd in os.fwalk(path):
+        for name in files:
+            try:
+                st = os.stat(name, dir_fd=root_fd, follow_symlinks=False)
+            except OSError:
+                continue
+            if stat.S_ISREG(st.st_mode):
+                size += st.st_size
+    return size
+
+
+def copy_tree(src, dst, on_progress=None):
+    """
+    Copy a file or a dir with all its content. Symbolic links are copied as links.
+    `on_progress` is called with the number of bytes copied since its last call.
+    Returns the number of copied files and dirs.
+    """
+    st = os.lstat(src)
+    if stat.S_ISLNK(st.st_mode):
+        os.symlink(os.readlink(src), dst)
+        return 1, 0
+    if not stat.S_ISDIR(st.st_mode):
+        copy_file(src, dst, on_progress)
+        return 1, 0
+
+    files_copied = 0
+    dirs_copied = 0
+    for root, dirs, files in os.walk(src):
+        rel_root = os.path.relpath(root, src)
+        dst_root = os.path.normpath(os.path.join(dst, rel_root))
+        os.mkdir(dst_root)
+        dirs_copied += 1
+        for name in files + [name for name in dirs if os.path.islink(os.path.join(root, name))]:
+            src_path = os.path.join(root, name)
+            dst_path = os.path.join(dst_root, name)
+            mode = os.lstat(src_path).st_mode
+            if stat.S_ISLNK(mode):
+                os.symlink(os.readlink(src_path), dst_path)
+            elif stat.S_ISREG(mode):
+                copy_file(src_path, dst_path, on_progress)
+            else:
+                # Sockets, pipes and devices are not copied
+                continue
+            files_copied += 1
+    for root, dirs, files in os.walk(src, topdown=False):
+        # Copy dirs metadata after their content, which changes their modification time
+        shutil.copystat(root, os.path.normpath(os.path.join(dst, os.path.relpath(root, src))))
+    return files_copied, dirs_copied
+
+
+def move_tree(src, dst, on_progress=None):
+    """
+    Move a file or a dir. The entry is renamed if the destination is on the same file system,
+    otherwise it is copied and the source is removed once the copy is complete.
+    `on_progress` is called with the number of bytes copied since its last call.
+    Returns True if the entry has been copied.
+    """
+    try:
+        os.rename(src, dst)
+        return False
+    except OSError as err:
+        if err.errno != errno.EXDEV:
+            raise
+    try:
+        copy_tree(src, dst, on_progress)
+    except BaseException:
+        # Do not keep an incomplete copy
+        if os.path.lexists(dst):
+            remove_tree(dst)
+        raise
+    remove_tree(src)
+    return True
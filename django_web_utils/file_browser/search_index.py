@@ -0,0 +1,261 @@
+"""
+Files names search index
+SQLite index of the files and dirs names of a file browser storage, used by the search action.
+
+Names are searched with a FTS5 trigram index when SQLite supports it (queries shorter than 3 characters are not
+supported by this index, a scan of the names table is done for them).
+The index is kept up to date with the modification time of directories: only directories in which a file or a dir
+has been added, removed or renamed are scanned again. Changes done with the file browser actions are applied directly.
+"""
+import contextlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from django_web_utils.file_browser import background, config
+
+logger = logging.getLogger('djwutils.file_browser.search_index')
+
+
+class FileNameIndex:
+    """
+    Index of files and dirs names.
+    Paths are relative to the base path ("" is the base path itself).
+    """
+
+    def __init__(self, db_path, base_path, ttl=60):
+        self.db_path = Path(db_path)
+        self.base_path = Path(base_path)
+        self.ttl = ttl
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS files ('
+                'id INTEGER PRIMARY KEY, path TEXT UNIQUE, parent TEXT, name TEXT, name_lower TEXT, is_dir INTEGER)')
+            conn.execute('CREATE INDEX IF NOT EXISTS files_parent ON files (parent)')
+            conn.execute('CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, parent TEXT, mtime_ns INTEGER)')
+            conn.execute('CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent)')
+            conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)')
+            try:
+                conn.execute(
+                    'CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5('
+                    'name, content=\'files\', content_rowid=\'id\', tokenize=\'trigram\')')
+            except sqlite3.OperationalError as err:
+                logger.info('Full text search is not available in SQLite, names will be scanned: %s', err)
+                self.fts = False
+            else:
+                conn.execute(
+                    'CREATE TRIGGER IF NOT EXISTS files_ai AFTER INSERT ON files BEGIN '
+                    'INSERT INTO files_fts (rowid, name) VALUES (new.id, new.name); END')
+                conn.execute(
+                    'CREATE TRIGGER IF NOT EXISTS files_ad AFTER DELETE ON files BEGIN '
+                    'INSERT INTO files_fts (files_fts, rowid, name) VALUES (\'delete\', old.id, old.name); END')
+                self.fts = True
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(str(self.db_path), timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _get_parent(rel_path):
+        return rel_path.rsplit('/', 1)[0] if '/' in rel_path else ''
+
+    def get_refresh_date(self):
+        """
+        Returns the timestamp of the last complete refresh or None if the index has never been built.
+        """
+        with self._connect() as conn:
+            row = conn.execute('SELECT value FROM meta WHERE key = \'refreshed_at\'').fetchone()
+        return row['value'] if row else None
+
+    def is_stale(self):
+        refreshed_at = self.get_refresh_date()
+        return refreshed_at is None or refreshed_at < time.time() - self.ttl
+
+    def refresh(self, rel_path=''):
+        """
+        Update the index of a directory and of all its sub directories.
+        Returns the number of scanned directories.
+        """
+        rel_path = rel_path.strip('/')
+        start = time.monotonic()
+        scanned = checked = 0
+        stack = [rel_path]
+        with self._connect() as conn:
+            while stack:
+                current = stack.pop()
+                path = self.base_path / current if current else self.base_path
+                try:
+                    mtime_ns = path.stat().st_mtime_ns
+                    row = conn.execute('SELECT mtime_ns FROM dirs WHERE path = ?', [current]).fetchone()
+                    if row is not None and row['mtime_ns'] == mtime_ns:
+                        sub_dirs = [r['path'] for r in conn.execute('SELECT path FROM dirs WHERE parent = ?', [current])]
+                    else:
+                        scanned += 1
+                        sub_dirs = self._update_dir(conn, current, path, mtime_ns)
+                except OSError:
+                    # The directory has been removed (or cannot be read)
+                    self._delete_tree(conn, current)
+                    continue
+                stack.extend(sub_dirs)
+                checked += 1
+                if checked % 1000 == 0:
+                    # Do not lock the database during the whole refresh
+                    conn.commit()
+            if not rel_path:
+                conn.execute('INSERT OR REPLACE INTO meta VALUES (\'refreshed_at\', ?)', [time.time()])
+        logger.debug('Search index of "%s" refreshed in %.3fs (%s directories scanned).', rel_path or '/', time.monotonic() - start, scanned)
+        return scanned
+
+    def _update_dir(self, conn, rel_path, path, mtime_ns):
+        entries = {}
+        sub_dirs = []
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    continue
+                entries[entry.name] = is_dir
+                # Symbolic links to directories are indexed but not followed
+                if is_dir and not entry.is_symlink():
+                    sub_dirs.append(f'{rel_path}/{entry.name}' if rel_path else entry.name)
+        indexed = {r['name']: bool(r['is_dir']) for r in conn.execute('SELECT name, is_dir FROM files WHERE parent = ?', [rel_path])}
+        for name, is_dir in indexed.items():
+            if entries.get(name) != is_dir:
+                self._delete_tree(conn, f'{rel_path}/{name}' if rel_path else name)
+        for name, is_dir in entries.items():
+            if indexed.get(name) != is_dir:
+                self._insert(conn, f'{rel_path}/{name}' if rel_path else name, is_dir)
+        indexed_dirs = {r['path'] for r in conn.execute('SELECT path FROM dirs WHERE parent = ?', [rel_path])}
+        for sub_dir in indexed_dirs - set(sub_dirs):
+            self._delete_tree(conn, sub_dir)
+        conn.execute('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)', [rel_path, self._get_parent(rel_path) if rel_path else None, mtime_ns])
+        return sub_dirs
+
+    def _insert(self, conn, rel_path, is_dir):
+        name = rel_path.rsplit('/', 1)[-1]
+        # No "INSERT OR REPLACE" because the implicit delete does not run the full text index trigger
+        conn.execute('DELETE FROM files WHERE path = ?', [rel_path])
+        conn.execute(
+            'INSERT INTO files (path, parent, name, name_lower, is_dir) VALUES (?, ?, ?, ?, ?)',
+            [rel_path, self._get_parent(rel_path), name, name.lower(), int(is_dir)])
+
+    def _delete_tree(self, conn, rel_path):
+        if not rel_path:
+            conn.execute('DELETE FROM files')
+            conn.execute('DELETE FROM dirs')
+            return
+        prefix = rel_path + '/'
+        conn.execute('DELETE FROM files WHERE path = ? OR substr(path, 1, ?) = ?', [rel_path, len(prefix), prefix])
+        conn.execute('DELETE FROM dirs WHERE path = ? OR substr(path, 1, ?) = ?', [rel_path, len(prefix), prefix])
+
+    def add(self, rel_path):
+        """
+        Add a file or a dir (with its content) to the index.
+        """
+        rel_path = rel_path.strip('/')
+        path = self.base_path / rel_path
+        if not os.path.lexists(path):
+            return
+        is_dir = path.is_dir()
+        with self._connect() as conn:
+            self._insert(conn, rel_path, is_dir)
+        if is_dir and not path.is_symlink():
+            self.refresh(rel_path)
+
+    def remove(self, rel_path):
+        """
+        Remove a file or a dir (with its content) from the index.
+        """
+        with self._connect() as conn:
+            self._delete_tree(conn, rel_path.strip('/'))
+
+    def rename(self, old_rel_path, new_rel_path):
+        self.remove(old_rel_path)
+        self.add(new_rel_path)
+
+    def search(self, query, rel_path='', offset=0, limit=None):
+        """
+        Search files and dirs with a name containing the query (case insensitive) in a directory.
+        Returns the total number of results and the list of results (dicts with "path", "parent", "name" and "is_dir").
+        Results are ordered by path.
+        """
+        rel_path = rel_path.strip('/')
+        where = []
+        params = []
+        if rel_path:
+            prefix = rel_path + '/'
+            where.append('(parent = ? OR substr(parent, 1, ?) = ?)')
+            params.extend([rel_path, len(prefix), prefix])
+        if self.fts and len(query) >= 3:
+            where.append('id IN (SELECT rowid FROM files_fts WHERE files_fts MATCH ?)')
+            params.append('"%s"' % query.replace('"', '""'))
+        elif query:
+            where.append('instr(name_lower, ?) > 0')
+            params.append(query.lower())
+        where_sql = (' WHERE ' + ' AND '.join(where)) if where else ''
+        with self._connect() as conn:
+            count = conn.execute(f'SELECT count(*) FROM files{where_sql}', params).fetchone()[0]
+            rows = conn.execute(
+                f'SELECT path, parent, name, is_dir FROM files{where_sql} ORDER BY path LIMIT ? OFFSET ?',
+                [*params, limit if limit else -1, offset]).fetchall()
+        return count, [dict(path=row['path'], parent=row['parent'], name=row['name'], is_dir=bool(row['is_dir'])) for row in rows]
+
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+def get_search_index(namespace):
+    """
+    Get the search index of a namespace or None if indexes are disabled (see `FILE_BROWSER_INDEX_DIR` setting).
+    """
+    index_dir = config.get_index_dir()
+    if not index_dir:
+        return None
+    namespace = config.clean_namespace(namespace)
+    key = (index_dir, namespace)
+    with _lock:
+        if key not in _indexes:
+            _indexes[key] = FileNameIndex(
+                Path(index_dir) / f'{namespace}.search.sqlite3',
+                config.get_base_path(namespace),
+                ttl=config.get_search_index_ttl(),
+            )
+        return _indexes[key]
+
+
+def schedule_refresh(index):
+    """
+    Refresh the whole index in a background thread.
+    Returns the future of the refresh or None if a refresh is already pending.
+    """
+    return background.submit(('search_refresh', str(index.db_path)), index.refresh)
+
+
+def update_search_index(namespace, removed=None, added=None):
+    """
+    Apply changes done in the storage to the search index (if enabled).
+    Errors are only logged, the index is fixed by the next refresh.
+    """
+    index = get_search_index(namespace)
+    if not index:
+        return
+    try:
+        for rel_path in removed or []:
+            index.remove(rel_path)
+        for rel_path in added or []:
+            index.add(rel_path)
+    except Exception as err:
+        logger.error('Failed to update search index: %s', err, exc_info=True)
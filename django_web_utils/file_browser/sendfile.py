@@ -0,0 +1,126 @@
+"""
+Files downloads
+Responses to download a file of a file browser storage after the permissions check of the view.
+The transfer is delegated to the front web server if configured (see `FILE_BROWSER_SENDFILE` setting),
+otherwise the file is sent by Django with support of "Range" requests.
+"""
+import mimetypes
+import os
+import re
+import urllib.parse
+# Django
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date
+# Django web utils
+from django_web_utils.file_browser import config
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeFile:
+    """
+    File like object giving access to a part of a file.
+    """
+
+    def __init__(self, path, start, length):
+        self.file = open(path, 'rb')
+        self.file.seek(start)
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(value, size):
+    """
+    Parse a "Range" header value and return the start and the end (included) of the requested range.
+    Returns None if the header is missing or not supported (several ranges for example),
+    raises `ValueError` if the range cannot be satisfied.
+    """
+    match = RANGE_RE.match(value or '')
+    if not match or not any(match.groups()):
+        return None
+    start, end = match.groups()
+    if not start:
+        # Suffix range ("bytes=-500" for the last 500 bytes)
+        length = int(end)
+        if length == 0:
+            raise ValueError('Empty suffix range.')
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start > end:
+        raise ValueError('Range not satisfiable.')
+    return start, end
+
+
+def get_file_response(request, path, stat, as_attachment=False):
+    """
+    Get a response sending a file, or a part of it if requested with a "Range" header.
+    """
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    file_name = os.path.basename(path)
+    size = stat.st_size
+    try:
+        # "If-Range" is only supported with dates
+        if_range = request.META.get('HTTP_IF_RANGE')
+        requested = None if if_range and if_range != http_date(stat.st_mtime) else parse_range(request.META.get('HTTP_RANGE'), size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */%s' % size
+        return response
+    if requested:
+        start, end = requested
+        response = FileResponse(
+            RangeFile(path, start, end - start + 1), status=206, content_type=content_type,
+            as_attachment=as_attachment, filename=file_name)
+        response['Content-Length'] = end - start + 1
+        response['Content-Range'] = 'bytes %s-%s/%s' % (start, end, size)
+    else:
+        response = FileResponse(open(path, 'rb'), content_type=content_type, as_attachment=as_attachment, filename=file_name)
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def get_download_response(request, namespace, rel_path, as_attachment=False):
+    """
+    Get the response to download a file of a storage.
+    `rel_path` must be a path relative to the storage base path (checked by the caller).
+    Returns None if the file does not exist.
+    """
+    path = os.path.join(config.get_base_path(namespace), rel_path)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    if not os.path.isfile(path):
+        return None
+
+    response = get_conditional_response(request, last_modified=int(stat.st_mtime))
+    if response is not None:
+        return response
+
+    mode = config.get_sendfile_mode()
+    if mode == 'x-accel-redirect':
+        response = HttpResponse()
+        response['X-Accel-Redirect'] = config.get_sendfile_location(namespace) + urllib.parse.quote(rel_path)
+    elif mode == 'x-sendfile':
+        response = HttpResponse()
+        response['X-Sendfile'] = path
+    else:
+        response = get_file_response(request, path, stat, as_attachment)
+    if mode in ('x-accel-redirect', 'x-sendfile'):
+        # The content type is set by the web server
+        del response['Content-Type']
+        if as_attachment:
+            response['Content-Disposition'] = content_disposition_header(True, os.path.basename(path))
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    return response
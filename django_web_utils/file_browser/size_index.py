@@ -0,0 +1,236 @@
+"""
+Directories size index
+SQLite index of the size, files count and dirs count of each directory of a file browser storage.
+
+A directory is rescanned only if its modification time changed (a file or a dir has been added, removed or renamed in it),
+otherwise its stored values are reused and only its sub directories are checked. Refreshing a tree costs a `stat` call
+for each directory instead of a `stat` call for each file.
+Changing the content of an existing file does not change the modification time of its directory, so such changes are
+only detected when the file is added, removed or renamed, unless `measure_files` is enabled: the files of directories
+which have not been checked since `ttl` seconds are then measured again.
+"""
+import contextlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from django_web_utils.file_browser import background, config
+
+logger = logging.getLogger('djwutils.file_browser.size_index')
+
+
+class DirSizeIndex:
+    """
+    Index of directories aggregated sizes.
+    Paths are relative to the base path ("" is the base path itself).
+    """
+
+    def __init__(self, db_path, base_path, ttl=300, measure_files=False):
+        self.db_path = Path(db_path)
+        self.base_path = Path(base_path)
+        self.ttl = ttl
+        self.measure_files = measure_files
+        self._local = threading.local()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS dir_sizes ('
+                'path TEXT PRIMARY KEY, parent TEXT, mtime_ns INTEGER, '
+                'own_size INTEGER, own_files INTEGER, own_dirs INTEGER, '
+                'size INTEGER, nb_files INTEGER, nb_dirs INTEGER, checked_at REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS dir_sizes_parent ON dir_sizes (parent)')
+
+    def _open(self):
+        conn = sqlite3.connect(str(self.db_path), timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            # Connection of the current `batch` block
+            with conn:
+                yield conn
+            return
+        conn = self._open()
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Use a single database connection for all the calls made in the block by the current thread
+        (to get the information of all the dirs of a listing for example).
+        """
+        if getattr(self._local, 'conn', None) is not None:
+            yield self
+            return
+        self._local.conn = self._open()
+        try:
+            yield self
+        finally:
+            self._local.conn.close()
+            self._local.conn = None
+
+    def get(self, rel_path):
+        """
+        Get the indexed information of a directory.
+        Returns a dict with "size", "nb_files", "nb_dirs" and "stale" keys or None if the directory is not indexed.
+        The information is stale if the directory changed or if it has not been checked since `ttl` seconds.
+        """
+        rel_path = rel_path.strip('/')
+        with self._connect() as conn:
+            row = conn.execute('SELECT * FROM dir_sizes WHERE path = ?', [rel_path]).fetchone()
+        if row is None:
+            return None
+        try:
+            mtime_ns = (self.base_path / rel_path).stat().st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        return dict(
+            size=row['size'],
+            nb_files=row['nb_files'],
+            nb_dirs=row['nb_dirs'],
+            stale=mtime_ns != row['mtime_ns'] or row['checked_at'] < time.time() - self.ttl,
+        )
+
+    def get_generation(self, rel_path):
+        """
+        Get a value which changes when the indexed information of a directory or of its sub directories is updated.
+        """
+        rel_path = rel_path.strip('/')
+        with self._connect() as conn:
+            row = conn.execute('SELECT max(checked_at) FROM dir_sizes WHERE path = ? OR parent = ?', [rel_path, rel_path]).fetchone()
+        return row[0]
+
+    def _scan(self, path):
+        own_size = own_files = own_dirs = 0
+        sub_dirs = []
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    continue
+                if is_dir:
+                    own_dirs += 1
+                    # Symbolic links to directories are counted but not followed
+                    if not entry.is_symlink():
+                        sub_dirs.append(entry.name)
+                else:
+                    own_files += 1
+                    try:
+                        own_size += entry.stat().st_size
+                    except OSError:
+                        pass
+        return own_size, own_files, own_dirs, sub_dirs
+
+    def refresh(self, rel_path=''):
+        """
+        Update the index of a directory and of all its sub directories.
+        Returns the aggregated size, files count and dirs count of the directory.
+        """
+        rel_path = rel_path.strip('/')
+        start = time.monotonic()
+        scanned = written = 0
+        expired = time.time() - self.ttl
+        totals = {}
+        # Iterative post-order traversal (trees can be deeper than the recursion limit)
+        stack = [(rel_path, None)]
+        with self._connect() as conn:
+            while stack:
+                current, info = stack.pop()
+                path = self.base_path / current if current else self.base_path
+                if info is None:
+                    try:
+                        mtime_ns = path.stat().st_mtime_ns
+                        row = conn.execute('SELECT * FROM dir_sizes WHERE path = ?', [current]).fetchone()
+                        if row is not None and row['mtime_ns'] == mtime_ns and not (self.measure_files and row['checked_at'] < expired):
+                            # Unchanged directory, only its sub directories are checked
+                            own = [row['own_size'], row['own_files'], row['own_dirs']]
+                            sub_dirs = [r['path'] for r in conn.execute('SELECT path FROM dir_sizes WHERE parent = ?', [current])]
+                        else:
+                            scanned += 1
+                            *own, names = self._scan(path)
+                            sub_dirs = [f'{current}/{name}' if current else name for name in names]
+                            if row is None or row['mtime_ns'] != mtime_ns:
+                                self._delete_removed(conn, current, sub_dirs)
+                    except OSError:
+                        # The directory has been removed (or cannot be read)
+                        self._delete_tree(conn, current)
+                        totals[current] = (0, 0, 0)
+                        continue
+                    stack.append((current, (mtime_ns, own, sub_dirs)))
+                    stack.extend((sub_dir, None) for sub_dir in sub_dirs)
+                else:
+                    mtime_ns, own, sub_dirs = info
+                    size, nb_files, nb_dirs = own
+                    for sub_dir in sub_dirs:
+                        sub_size, sub_files, sub_dirs_count = totals.pop(sub_dir, (0, 0, 0))
+                        size += sub_size
+                        nb_files += sub_files
+                        nb_dirs += sub_dirs_count
+                    parent = current.rsplit('/', 1)[0] if '/' in current else ('' if current else None)
+                    conn.execute(
+                        'INSERT OR REPLACE INTO dir_sizes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        [current, parent, mtime_ns, *own, size, nb_files, nb_dirs, time.time()])
+                    totals[current] = (size, nb_files, nb_dirs)
+                    written += 1
+                    if written % 1000 == 0:
+                        # Do not lock the database during the whole refresh
+                        conn.commit()
+        logger.debug('Size index of "%s" refreshed in %.3fs (%s directories scanned).', rel_path or '/', time.monotonic() - start, scanned)
+        return totals[rel_path]
+
+    def _delete_removed(self, conn, rel_path, sub_dirs):
+        indexed = [r['path'] for r in conn.execute('SELECT path FROM dir_sizes WHERE parent = ?', [rel_path])]
+        for path in set(indexed) - set(sub_dirs):
+            self._delete_tree(conn, path)
+
+    def _delete_tree(self, conn, rel_path):
+        if not rel_path:
+            conn.execute('DELETE FROM dir_sizes')
+            return
+        prefix = rel_path + '/'
+        conn.execute('DELETE FROM dir_sizes WHERE path = ? OR substr(path, 1, ?) = ?', [rel_path, len(prefix), prefix])
+
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+def get_size_index(namespace):
+    """
+    Get the size index of a namespace or None if indexes are disabled (see `FILE_BROWSER_INDEX_DIR` setting).
+    """
+    index_dir = config.get_index_dir()
+    if not index_dir:
+        return None
+    namespace = config.clean_namespace(namespace)
+    key = (index_dir, namespace)
+    with _lock:
+        if key not in _indexes:
+            _indexes[key] = DirSizeIndex(
+                Path(index_dir) / f'{namespace}.sizes.sqlite3',
+                config.get_base_path(namespace),
+                ttl=config.get_size_index_ttl(),
+                measure_files=config.get_size_index_measure_files(),
+            )
+        return _indexes[key]
+
+
+def schedule_refresh(index, rel_path):
+    """
+    Refresh the index of a directory in a background thread.
+    Returns the future of the refresh or None if a refresh of this directory is already pending.
+    """
+    rel_path = rel_path.strip('/')
+    return background.submit(('refresh', str(index.db_path), rel_path), index.refresh, rel_path)
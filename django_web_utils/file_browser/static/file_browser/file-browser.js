@@ -13,6 +13,12 @@ function FileBrowser (options) {
     this.contentURL = '';
     this.previewURL = '';
     this.actionURL = '';
+    this.uploadURL = '';
+    // if set, files are downloaded with this URL instead of the base URL
+    this.downloadURL = '';
+    // files bigger than this size are uploaded in chunks (uploads can be resumed after errors)
+    this.chunkedUploadMinSize = 10 * 1024 * 1024;
+    this.chunkedUploadRetries = 5;
 
     // vars
     this.csrfToken = '';
@@ -24,12 +30,20 @@ function FileBrowser (options) {
     this.overlay = null;
     this.dragEntered = false;
     this.path = '';
-    this.flatTree = [];
+    this.treeDirs = {};
     this.ordering = 'name-asc';
     this.files = {};
     this.opened = [];
+    this.moveBanned = [];
     this.menuElements = {};
     this.imagesExtenstions = ['png', 'gif', 'bmp', 'tiff', 'jpg', 'jpeg'];
+    this.staleRefreshDelay = 5000;
+    this.jobRefreshDelay = 1000;
+    this.responsesCache = {};
+    this.responsesCacheSize = 50;
+    this.pageSize = 1000;
+    this.overlayList = [];
+    this.staleTimeout = null;
 
     jsu.setObjectAttributes(this, options, [
         // allowed options
@@ -37,7 +51,10 @@ function FileBrowser (options) {
         'dirsURL',
         'contentURL',
         'previewURL',
-        'actionURL'
+        'actionURL',
+        'uploadURL',
+        'downloadURL',
+        'chunkedUploadMinSize'
     ]);
     this.overlay = new OverlayDisplayManager();
 
@@ -116,85 +133,156 @@ FileBrowser.prototype.containsFiles = function (evt) {
     return false;
 };
 
+FileBrowser.prototype.conditionalGet = function (url, params, callback) {
+    // GET request sending the ETag of the last response for the same URL,
+    // the last response is used if the server answers that it did not change (304)
+    let fullURL = url;
+    const keys = Object.keys(params);
+    for (let i = 0; i < keys.length; i++) {
+        fullURL += (i == 0 ? '?' : '&') + encodeURIComponent(keys[i]) + '=' + encodeURIComponent(params[keys[i]]);
+    }
+    const cached = this.responsesCache[fullURL];
+    const obj = this;
+    const xhr = new XMLHttpRequest();
+    xhr.open('GET', fullURL, true);
+    if (cached) {
+        xhr.setRequestHeader('If-None-Match', cached.etag);
+    }
+    xhr.onreadystatechange = function () {
+        if (xhr.readyState !== 4) {
+            return;
+        }
+        if (xhr.status == 304 && cached) {
+            // the response text is parsed again because parsed responses are modified when displayed
+            return callback({ status: 200 }, JSON.parse(cached.text));
+        }
+        let response;
+        try {
+            response = JSON.parse(xhr.responseText);
+        } catch (e) {
+            response = xhr.responseText;
+        }
+        const etag = xhr.getResponseHeader('ETag');
+        if (xhr.status == 200 && etag) {
+            delete obj.responsesCache[fullURL];
+            obj.responsesCache[fullURL] = { etag: etag, text: xhr.responseText };
+            const cachedURLs = Object.keys(obj.responsesCache);
+            if (cachedURLs.length > obj.responsesCacheSize) {
+                delete obj.responsesCache[cachedURLs[0]];
+            }
+        }
+        callback(xhr, response);
+    };
+    xhr.send();
+};
+
 FileBrowser.prototype.loadDirs = function () {
-    jsu.httpRequest({
-        method: 'GET',
-        url: this.dirsURL,
-        json: true,
-        callback: this.parseDirsResponse.bind(this)
-    });
+    // the tree is loaded level by level, only opened dirs are loaded
+    const stored = jsu.getCookie('browser-tree');
+    if (stored) {
+        this.opened = stored.split('→');
+    }
+    this.treeDirs = {};
+    this.loadSubDirs('/');
 };
-FileBrowser.prototype.parseDirsResponse = function (xhr, response) {
+FileBrowser.prototype.loadSubDirs = function (path) {
+    if (this.treeDirs[path]) {
+        this.treeDirs[path].loading = true;
+    }
+    this.conditionalGet(this.dirsURL, { path: path }, this.parseDirsResponse.bind(this, path));
+};
+FileBrowser.prototype.parseDirsResponse = function (path, xhr, response) {
     if (xhr.status != 200) {
-        this.menuTreeElement.innerHTML = '<li class="message-error">' + jsu.escapeHTML(response.error || response) + '</li>';
+        if (path == '/') {
+            this.menuTreeElement.innerHTML = '<li class="message-error">' + jsu.escapeHTML(response.error || response) + '</li>';
+        } else {
+            console.log('Error: failed to load sub dirs of path: ' + path);
+        }
         return;
-    } else {
+    }
+    if (path == '/') {
         this.menuTreeElement.innerHTML = '';
+        this.menuElements = {};
+        this.treeDirs = {};
+        this.addTreeDir(this.menuTreeElement, '/', response.dir_name, response.dirs.length > 0, 1);
     }
-
-    const flatTree = [];
-    if (response.dirs) {
-        this.getTreeDirs(response.dirs, this.menuTreeElement, flatTree, '', 1);
+    const parent = this.treeDirs[path];
+    if (!parent) {
+        return;
     }
-    this.flatTree = flatTree; // used for move function
-    // open trees
-    const stored = jsu.getCookie('browser-tree');
-    if (stored) {
-        this.opened = stored.split('→');
+    parent.loading = false;
+    parent.loaded = true;
+    parent.children = [];
+    parent.subEle.innerHTML = '';
+    for (let i = 0; i < response.dirs.length; i++) {
+        const dirPath = path + response.dirs[i].dir_name + '/';
+        parent.children.push(dirPath);
+        this.addTreeDir(parent.subEle, dirPath, response.dirs[i].dir_name, response.dirs[i].has_children, parent.level + 1);
     }
-    for (let i = 0; i < this.opened.length; i++) {
-        if (this.opened[i] in this.menuElements) {
-            this.menuElements[this.opened[i]].classList.add('opened');
-        }
+    // refresh move targets if the move form is displayed
+    if (this.moveForm && this.moveForm.parentElement) {
+        this.renderMoveTargets();
     }
     // load dir content (only after init)
-    if (!this.contentLoaded) {
+    if (path == '/' && !this.contentLoaded) {
         this.loadContent();
         this.contentLoaded = true;
-    } else if (this.path && this.menuElements[this.path]) {
-        this.menuElements[this.path].classList.add('active');
-    }
-    // open all sub menu
-    const splitted = this.path.split('/');
-    let p = '';
-    for (let i = 0; i < splitted.length; i++) {
-        p += splitted[i] + '/';
-        if (splitted[i] && p != this.path) {
-            this.openTree(p);
-        }
     }
 };
-FileBrowser.prototype.getTreeDirs = function (dirs, parentEle, flatTree, relativePath, level) {
-    for (let i = 0; i < dirs.length; i++) {
-        let dirRelativePath;
-        if (level == 1) {
-            dirRelativePath = '/';
-        } else {
-            dirRelativePath = relativePath + dirs[i].dir_name + '/';
+FileBrowser.prototype.addTreeDir = function (parentEle, dirPath, name, hasChildren, level) {
+    const liEle = document.createElement('li');
+    let subEle = null;
+    if (hasChildren) {
+        const btnEle = document.createElement('button');
+        btnEle.setAttribute('type', 'button');
+        btnEle.setAttribute('class', 'list-entry');
+        btnEle.innerHTML = '<i class="fa fa-fw fa-chevron-right"></i>';
+        btnEle.addEventListener('click', this.toggle.bind(this, dirPath));
+        liEle.appendChild(btnEle);
+    }
+    const linkEle = document.createElement('a');
+    linkEle.setAttribute('href', '#' + dirPath);
+    linkEle.innerHTML = jsu.escapeHTML(name);
+    liEle.appendChild(linkEle);
+    if (hasChildren) {
+        subEle = document.createElement('ul');
+        subEle.setAttribute('class', 'sub-menu');
+        liEle.appendChild(subEle);
+    }
+    this.menuElements[dirPath] = liEle;
+    // keep the loading state of a dir which is being loaded to avoid requesting it twice
+    const previous = this.treeDirs[dirPath];
+    const loading = Boolean(previous && previous.loading);
+    this.treeDirs[dirPath] = { name: name, level: level, hasChildren: hasChildren, subEle: subEle, children: [], loaded: false, loading: loading };
+    parentEle.appendChild(liEle);
+    if (this.path == dirPath) {
+        liEle.classList.add('active');
+    }
+    // open dirs which were opened and parents of current dir
+    if (this.opened.indexOf(dirPath) != -1 || (this.path && this.path != dirPath && this.path.indexOf(dirPath) == 0)) {
+        liEle.classList.add('opened');
+        // the root dir sub dirs are added by the response which created it
+        if (hasChildren && dirPath != '/' && !loading) {
+            this.loadSubDirs(dirPath);
         }
-        flatTree.push({ path: dirRelativePath, name: dirs[i].dir_name, level: level });
-        const liEle = document.createElement('li');
-        if (dirs[i].sub_dirs.length > 0) {
-            const btnEle = document.createElement('button');
-            btnEle.setAttribute('type', 'button');
-            btnEle.setAttribute('class', 'list-entry');
-            btnEle.innerHTML = '<i class="fa fa-fw fa-chevron-right"></i>';
-            btnEle.addEventListener('click', this.toggle.bind(this, dirRelativePath));
-            liEle.appendChild(btnEle);
+    }
+};
+FileBrowser.prototype.getFlatTree = function () {
+    // list of loaded dirs, used for move function
+    const flatTree = [];
+    const obj = this;
+    const addDir = function (path) {
+        const tEntry = obj.treeDirs[path];
+        if (!tEntry) {
+            return;
         }
-        const linkEle = document.createElement('a');
-        linkEle.setAttribute('href', '#' + dirRelativePath);
-        linkEle.innerHTML = jsu.escapeHTML(dirs[i].dir_name);
-        liEle.appendChild(linkEle);
-        if (dirs[i].sub_dirs.length > 0) {
-            const subEle = document.createElement('ul');
-            subEle.setAttribute('class', 'sub-menu');
-            this.getTreeDirs(dirs[i].sub_dirs, subEle, flatTree, dirRelativePath, level + 1);
-            liEle.appendChild(subEle);
+        flatTree.push({ path: path, name: tEntry.name, level: tEntry.level, expandable: tEntry.hasChildren && !tEntry.loaded });
+        for (let i = 0; i < tEntry.children.length; i++) {
+            addDir(tEntry.children[i]);
         }
-        this.menuElements[dirRelativePath] = liEle;
-        parentEle.appendChild(liEle);
-    }
+    };
+    addDir('/');
+    return flatTree;
 };
 
 FileBrowser.prototype.loadContent = function () {
@@ -221,13 +309,11 @@ FileBrowser.prototype.loadContent = function () {
         this.menuElements[path].classList.add('active');
     }
 
-    jsu.httpRequest({
-        method: 'GET',
-        url: this.contentURL,
-        params: { path: path, order: this.ordering },
-        json: true,
-        callback: this.parseContentResponse.bind(this)
-    });
+    this.conditionalGet(this.contentURL, { path: path, order: this.ordering, offset: 0, limit: this.pageSize }, this.parseContentResponse.bind(this));
+};
+FileBrowser.prototype.loadMoreContent = function () {
+    const loadedCount = this.files.filter(function (file) { return !file.isprevious; }).length;
+    this.conditionalGet(this.contentURL, { path: this.path, order: this.ordering, offset: loadedCount, limit: this.pageSize }, this.parseContentResponse.bind(this));
 };
 FileBrowser.prototype.parseContentResponse = function (xhr, response) {
     if (xhr.status != 200) {
@@ -235,15 +321,25 @@ FileBrowser.prototype.parseContentResponse = function (xhr, response) {
         return;
     }
 
-    if (response.files.length == 0) {
+    const append = response.offset > 0;
+    const moreBtn = this.placeElement.querySelector('.fm-load-more');
+    if (moreBtn) {
+        moreBtn.remove();
+    }
+    if (!append && response.files.length == 0) {
         this.placeElement.innerHTML = '<div class="message-info">' + jsu.escapeHTML(gettext('The folder is empty.')) + '</div>';
+        this.files = [];
     } else {
         // display files
-        this.files = response.files;
-        this.placeElement.innerHTML = '';
-        const ovls = [];
-        for (let i = 0; i < this.files.length; i++) {
-            const file = this.files[i];
+        if (!append) {
+            this.files = [];
+            this.overlayList = [];
+            this.placeElement.innerHTML = '';
+        }
+        const ovls = this.overlayList;
+        for (let i = 0; i < response.files.length; i++) {
+            const file = response.files[i];
+            this.files.push(file);
             let fclass;
             let target = '';
             if (file.isprevious) {
@@ -260,7 +356,11 @@ FileBrowser.prototype.parseContentResponse = function (xhr, response) {
                 file.url = '#' + this.path + file.name + '/';
             } else {
                 fclass = 'file-' + file.ext;
-                file.url = this.baseURL + this.path + file.name;
+                if (this.downloadURL) {
+                    file.url = this.downloadURL + '?path=' + encodeURIComponent(this.path + file.name);
+                } else {
+                    file.url = this.baseURL + this.path + file.name;
+                }
                 target = 'target="_blank" rel="noopener noreferrer"';
             }
             const entryEle = document.createElement('div');
@@ -273,13 +373,14 @@ FileBrowser.prototype.parseContentResponse = function (xhr, response) {
             html += '></span>';
             html += '<span class="file-name">' + jsu.escapeHTML(file.name) + '</span>';
             if (!file.isprevious) {
-                html += '<span class="file-info">';
+                html += '<span class="file-info' + (file.stale ? ' stale' : '') + '"' +
+                    (file.stale ? ' title="' + jsu.escapeAttribute(gettext('The size of this folder is being computed.')) + '"' : '') + '>';
                 html += '<span class="file-size">' + jsu.escapeHTML(gettext('Size:') + ' ' + file.size_h) + '</span>';
                 if (!file.is_dir) {
                     html += '<span class="file-mdate">' + jsu.escapeHTML(gettext('Last modification:') + '\n' + (file.mdate ? file.mdate : '?')) + '</span>';
                 } else {
-                    html += '<span class="file-nb-files">' + jsu.escapeHTML(gettext('Files:') + ' ' + file.nb_files) + '</span>';
-                    html += '<span class="file-nb-dirs">' + jsu.escapeHTML(gettext('Folders:') + ' ' + file.nb_dirs) + '</span>';
+                    html += '<span class="file-nb-files">' + jsu.escapeHTML(gettext('Files:') + ' ' + (file.nb_files !== null ? file.nb_files : '?')) + '</span>';
+                    html += '<span class="file-nb-dirs">' + jsu.escapeHTML(gettext('Folders:') + ' ' + (file.nb_dirs !== null ? file.nb_dirs : '?')) + '</span>';
                 }
                 html += '</span>';
             }
@@ -288,6 +389,7 @@ FileBrowser.prototype.parseContentResponse = function (xhr, response) {
                 html += '<button type="button" class="file-delete" title="' + jsu.escapeAttribute(gettext('Delete')) + '"><i class="fa fa-fw fa-trash"></i></button>';
                 html += '<button type="button" class="file-rename" title="' + jsu.escapeAttribute(gettext('Rename')) + '"><i class="fa fa-fw fa-pencil"></i></button>';
                 html += '<button type="button" class="file-move" title="' + jsu.escapeAttribute(gettext('Move')) + '"><i class="fa fa-fw fa-arrow-right"></i></button>';
+                html += '<button type="button" class="file-download" title="' + jsu.escapeAttribute(gettext('Download as zip')) + '"><i class="fa fa-fw fa-download"></i></button>';
             }
             entryEle.innerHTML = html;
             file.entryEle = entryEle;
@@ -296,6 +398,7 @@ FileBrowser.prototype.parseContentResponse = function (xhr, response) {
                 entryEle.querySelector('.file-delete').addEventListener('click', this.deleteFiles.bind(this, file));
                 entryEle.querySelector('.file-rename').addEventListener('click', this.renameFiles.bind(this, file));
                 entryEle.querySelector('.file-move').addEventListener('click', this.moveFiles.bind(this, file));
+                entryEle.querySelector('.file-download').addEventListener('click', this.downloadFiles.bind(this, file));
             }
             this.placeElement.appendChild(entryEle);
             if (this.imagesExtenstions.indexOf(file.ext) != -1) {
@@ -305,6 +408,15 @@ FileBrowser.prototype.parseContentResponse = function (xhr, response) {
             }
         }
     }
+    const loadedCount = this.files.filter(function (file) { return !file.isprevious; }).length;
+    if (response.count > loadedCount) {
+        const btn = document.createElement('button');
+        btn.setAttribute('type', 'button');
+        btn.className = 'fm-load-more';
+        btn.textContent = gettext('Show more files') + ' (' + loadedCount + ' / ' + response.count + ')';
+        btn.addEventListener('click', this.loadMoreContent.bind(this));
+        this.placeElement.appendChild(btn);
+    }
     // create path tree
     let fullPath = '#/';
     let htmlPath = '<a href="' + fullPath + '">' + jsu.escapeHTML(gettext('root')) + '</a> <span>/</span> ';
@@ -321,6 +433,14 @@ FileBrowser.prototype.parseContentResponse = function (xhr, response) {
     this.sizeElement.textContent = response.total_size;
     this.dirsCountElement.textContent = response.total_nb_dirs;
     this.filesCountElement.textContent = response.total_nb_files;
+    // Load content again when sizes being computed are available
+    if (this.staleTimeout) {
+        clearTimeout(this.staleTimeout);
+        this.staleTimeout = null;
+    }
+    if (response.stale && !append) {
+        this.staleTimeout = setTimeout(this.loadContent.bind(this), this.staleRefreshDelay);
+    }
 };
 
 FileBrowser.prototype.refresh = function () {
@@ -410,6 +530,10 @@ FileBrowser.prototype.executeAction = function (method, params, data) {
     });
 };
 FileBrowser.prototype.onActionExecuted = function (xhr, response) {
+    if (xhr.status == 200 && response.job_url) {
+        // the action is running in background
+        return this.followJob(response.job_url, response.job);
+    }
     let msg;
     if (xhr.status != 200) {
         msg = '<div class="file-browser-overlay message-error">' + jsu.escapeHTML(response.error || response) + '</div>';
@@ -436,6 +560,47 @@ FileBrowser.prototype.onActionExecuted = function (xhr, response) {
     }
 };
 
+FileBrowser.prototype.followJob = function (url, job) {
+    if (job.status == 'done') {
+        return this.onActionExecuted({ status: 200 }, { message: job.message });
+    } else if (job.status == 'failed' || job.status == 'canceled') {
+        return this.onActionExecuted({ status: 400 }, { error: job.error });
+    }
+    let text = gettext('Operation in progress') + '...';
+    if (job.progress.total_bytes) {
+        text += ' ' + parseInt(100 * job.progress.bytes / job.progress.total_bytes, 10) + ' %';
+    } else if (job.progress.dirs !== undefined) {
+        text += ' ' + gettext('Files:') + ' ' + job.progress.files + ', ' + gettext('Folders:') + ' ' + job.progress.dirs;
+    }
+    const obj = this;
+    this.overlay.show({
+        title: ' ',
+        html: '<div class="file-browser-overlay message-loading">' + jsu.escapeHTML(text) + '</div>',
+        buttons: [
+            { label: gettext('Cancel'), callback: function () {
+                const xhr = new XMLHttpRequest();
+                xhr.open('DELETE', url, true);
+                xhr.setRequestHeader('X-CSRFToken', obj.csrfToken);
+                xhr.send();
+            } }
+        ]
+    });
+    setTimeout(function () {
+        jsu.httpRequest({
+            method: 'GET',
+            url: url,
+            json: true,
+            callback: function (xhr, response) {
+                if (xhr.status != 200) {
+                    obj.onActionExecuted(xhr, response);
+                } else {
+                    obj.followJob(url, response);
+                }
+            }
+        });
+    }, this.jobRefreshDelay);
+};
+
 FileBrowser.prototype.getSelectedFiles = function () {
     const selected = [];
     for (let i = 0; i < this.files.length; i++) {
@@ -448,6 +613,13 @@ FileBrowser.prototype.getSelectedFiles = function () {
 
 FileBrowser.prototype.onFilesDrop = function (evt) {
     const files = evt.dataTransfer.files;
+    if (this.uploadURL) {
+        for (let i = 0; i < files.length; i++) {
+            if (files[i].size >= this.chunkedUploadMinSize) {
+                return this.uploadFilesInChunks(files);
+            }
+        }
+    }
     const formData = new FormData();
     formData.append('csrfmiddlewaretoken', this.csrfToken);
     formData.append('action', 'upload');
@@ -480,6 +652,126 @@ FileBrowser.prototype.onFilesDrop = function (evt) {
         }
     });
 };
+FileBrowser.prototype.uploadFilesInChunks = function (files) {
+    const progressEle = this.dropZoneElement.querySelector('progress');
+    progressEle.setAttribute('value', 0);
+    progressEle.textContent = '0 %';
+    let total = 0;
+    for (let i = 0; i < files.length; i++) {
+        total += files[i].size;
+    }
+    const obj = this;
+    const urls = [];
+    let done = 0;
+    const uploadNext = function (index) {
+        if (index >= files.length) {
+            obj.dropZoneElement.setAttribute('class', '');
+            obj.onActionExecuted({ status: 200 }, {
+                message: files.length > 1 ? gettext('The files have been uploaded and are available at the locations:') : gettext('The file has been uploaded and is available at the location:'),
+                urls: urls
+            });
+            return;
+        }
+        const file = files[index];
+        obj.uploadFileInChunks(file, function (sent) {
+            const progress = total ? parseInt(100 * (done + sent) / total, 10) : 100;
+            progressEle.setAttribute('value', progress);
+            progressEle.textContent = progress + ' %';
+        }, function (xhr, response) {
+            if (xhr.status != 200) {
+                obj.dropZoneElement.setAttribute('class', '');
+                obj.onActionExecuted(xhr, response);
+                return;
+            }
+            done += file.size;
+            for (const url of response.urls) {
+                urls.push(url);
+            }
+            uploadNext(index + 1);
+        });
+    };
+    uploadNext(0);
+};
+FileBrowser.prototype.uploadFileInChunks = function (file, onProgress, callback) {
+    const obj = this;
+    jsu.httpRequest({
+        method: 'POST',
+        url: this.uploadURL,
+        data: { csrfmiddlewaretoken: this.csrfToken, path: this.path, name: file.name, size: file.size },
+        json: true,
+        callback: function (xhr, response) {
+            if (xhr.status != 200) {
+                return callback(xhr, response);
+            }
+            const session = response;
+            let retries = 0;
+            const finalize = function () {
+                jsu.httpRequest({
+                    method: 'POST',
+                    url: session.url,
+                    data: { csrfmiddlewaretoken: obj.csrfToken },
+                    json: true,
+                    callback: callback
+                });
+            };
+            const resume = function () {
+                // Get the offset received by the server before sending again
+                retries++;
+                setTimeout(function () {
+                    jsu.httpRequest({
+                        method: 'GET',
+                        url: session.url,
+                        json: true,
+                        callback: function (xhr, response) {
+                            if (xhr.status == 200) {
+                                sendChunk(response.offset);
+                            } else if (xhr.status != 404 && retries < obj.chunkedUploadRetries) {
+                                resume();
+                            } else {
+                                callback(xhr, response);
+                            }
+                        }
+                    });
+                }, 2000 * retries);
+            };
+            const sendChunk = function (offset) {
+                if (offset >= file.size) {
+                    return finalize();
+                }
+                const end = Math.min(offset + session.chunk_size, file.size);
+                const xhr = new XMLHttpRequest();
+                xhr.open('PUT', session.url, true);
+                xhr.setRequestHeader('Content-Range', 'bytes ' + offset + '-' + (end - 1) + '/' + file.size);
+                xhr.setRequestHeader('X-CSRFToken', obj.csrfToken);
+                xhr.upload.addEventListener('progress', function (evt) {
+                    onProgress(offset + evt.loaded);
+                });
+                xhr.onreadystatechange = function () {
+                    if (xhr.readyState !== 4) {
+                        return;
+                    }
+                    if (xhr.status == 200) {
+                        retries = 0;
+                        sendChunk(JSON.parse(xhr.responseText).offset);
+                    } else if (xhr.status != 404 && retries < obj.chunkedUploadRetries) {
+                        // The upload cannot be resumed if it has been canceled or has expired
+                        resume();
+                    } else {
+                        let response;
+                        try {
+                            response = JSON.parse(xhr.responseText);
+                        } catch (e) {
+                            response = xhr.responseText;
+                        }
+                        callback(xhr, response);
+                    }
+                };
+                xhr.send(file.slice(offset, end));
+            };
+            sendChunk(session.offset);
+        }
+    });
+};
 FileBrowser.prototype.addFolder = function () {
     if (!this.folderForm) {
         this.folderForm = document.createElement('form');
@@ -630,14 +922,22 @@ FileBrowser.prototype.moveFiles = function (file, evt) {
         this.moveForm.setAttribute('method', 'post');
         this.moveForm.setAttribute('enctype', 'multipart/form-data');
         this.moveForm.innerHTML = '<input type="hidden" name="csrfmiddlewaretoken" value="' + jsu.escapeAttribute(this.csrfToken) + '"/>' +
-            '<input type="hidden" name="action" value="move"/>' +
+            '<input type="hidden" id="id_move_action" name="action" value="move"/>' +
             '<input type="hidden" id="id_move_path" name="path" value=""/>' +
             '<label for="id_new_path">' + jsu.escapeHTML(gettext('Move to:')) + '</label>' +
             ' <select id="id_new_path" name="new_path"></select>' +
+            '<p class="help">' + jsu.escapeHTML(gettext('Select a folder marked with "▸" to display its sub folders.')) + '</p>' +
             '<p>' + jsu.escapeHTML(gettext('Selected file(s):')) + '</p>' +
             '<ul></ul>' +
             '<button type="submit" style="display: none;"></button>';
         const obj = this;
+        // sub dirs of the selected dir are loaded on demand
+        this.moveForm.querySelector('select').addEventListener('change', function () {
+            const tEntry = obj.treeDirs[this.value];
+            if (tEntry && tEntry.hasChildren && !tEntry.loaded && !tEntry.loading) {
+                obj.loadSubDirs(this.value);
+            }
+        });
         this.moveForm.addEventListener('submit', function (evt) {
             evt.preventDefault();
             const formData = new FormData(this);
@@ -648,41 +948,20 @@ FileBrowser.prototype.moveFiles = function (file, evt) {
     }
 
     // prepare form data
-    const banned = [];
+    this.moveBanned = [];
     for (let i = 0; i < selected.length; i++) {
         const s = selected[i];
         if (s.is_dir) {
-            banned.push(this.path + s.name + '/');
+            this.moveBanned.push(this.path + s.name + '/');
         }
     }
 
     this.moveForm.setAttribute('action', this.actionURL + '#' + this.path);
     this.moveForm.querySelector('#id_move_path').value = this.path;
+    this.moveForm.querySelector('select').value = '';
+    this.renderMoveTargets();
 
     let html = '';
-    for (let i = 0; i < this.flatTree.length; i++) {
-        const tEntry = this.flatTree[i];
-        let disabled = '';
-        if (this.path == tEntry.path) {
-            disabled = 'disabled="disabled"';
-        } else {
-            // disallow a dir to be move in himself
-            for (let j = 0; j < banned.length; j++) {
-                if (tEntry.path.indexOf(banned[j]) == 0) {
-                    disabled = 'disabled="disabled"';
-                    break;
-                }
-            }
-        }
-        let spacing = '';
-        for (let j = 1; j < tEntry.level; j++) {
-            spacing += '&nbsp;&nbsp;';
-        }
-        html += '<option value="' + jsu.escapeAttribute(tEntry.path) + '" ' + disabled + '>' + spacing + jsu.escapeHTML(tEntry.name) + '</option>';
-    }
-    this.moveForm.querySelector('select').innerHTML = html;
-
-    html = '';
     for (let i = 0; i < selected.length; i++) {
         html += '<li>' + jsu.escapeHTML(selected[i].name) + '<input type="hidden" name="name_' + i + '" value="' + jsu.escapeAttribute(selected[i].name) + '"/></li>';
     }
@@ -701,6 +980,11 @@ FileBrowser.prototype.moveFiles = function (file, evt) {
         html: this.moveForm,
         buttons: [
             { label: gettext('Move'), callback: function () {
+                obj.moveForm.querySelector('#id_move_action').value = 'move';
+                obj.moveForm.querySelector('button').click();
+            } },
+            { label: gettext('Copy'), callback: function () {
+                obj.moveForm.querySelector('#id_move_action').value = 'copy';
                 obj.moveForm.querySelector('button').click();
             } },
             { label: gettext('Cancel'), close: true }
@@ -710,6 +994,52 @@ FileBrowser.prototype.moveFiles = function (file, evt) {
         obj.moveForm.querySelector('#id_new_path').focus();
     }, 20);
 };
+FileBrowser.prototype.renderMoveTargets = function () {
+    // dirs which are not loaded yet are marked and can be expanded by selecting them
+    const select = this.moveForm.querySelector('select');
+    const selectedValue = select.value;
+    let html = '';
+    const flatTree = this.getFlatTree();
+    for (let i = 0; i < flatTree.length; i++) {
+        const tEntry = flatTree[i];
+        let disabled = '';
+        if (this.path == tEntry.path) {
+            disabled = 'disabled="disabled"';
+        } else {
+            // disallow a dir to be move in himself
+            for (let j = 0; j < this.moveBanned.length; j++) {
+                if (tEntry.path.indexOf(this.moveBanned[j]) == 0) {
+                    disabled = 'disabled="disabled"';
+                    break;
+                }
+            }
+        }
+        let spacing = '';
+        for (let j = 1; j < tEntry.level; j++) {
+            spacing += '&nbsp;&nbsp;';
+        }
+        html += '<option value="' + jsu.escapeAttribute(tEntry.path) + '" ' + disabled + '>' + spacing + jsu.escapeHTML(tEntry.name) + (tEntry.expandable ? ' ▸' : '') + '</option>';
+    }
+    select.innerHTML = html;
+    if (selectedValue) {
+        select.value = selectedValue;
+    }
+};
+FileBrowser.prototype.downloadFiles = function (file, evt) {
+    if (file && !file.selected) {
+        this.onFileClick(file, evt);
+    }
+    const selected = this.getSelectedFiles();
+    if (selected.length < 1) {
+        return;
+    }
+    // the zip is streamed by the server, so the download starts immediately
+    let url = this.actionURL + '?action=download&path=' + encodeURIComponent(this.path);
+    for (let i = 0; i < selected.length; i++) {
+        url += '&name_' + i + '=' + encodeURIComponent(selected[i].name);
+    }
+    window.location.href = url;
+};
 FileBrowser.prototype.deleteFiles = function (file, evt) {
     if (file && !file.selected) {
         this.onFileClick(file, evt);
@@ -873,14 +1203,17 @@ FileBrowser.prototype.openTree = function (path) {
     let current = '';
     for (let i = 0; i < toOpen.length; i++) {
         current += toOpen[i] + '/';
-        if (current in this.menuElements) {
-            if (!this.menuElements[current].classList.contains('opened')) {
-                this.menuElements[current].classList.add('opened');
-                this.opened.push(current);
-                jsu.setCookie('browser-tree', this.opened.join('→'));
+        if (this.opened.indexOf(current) == -1) {
+            // dirs which are not loaded yet are opened when loaded
+            this.opened.push(current);
+            jsu.setCookie('browser-tree', this.opened.join('→'));
+        }
+        if (current in this.menuElements && !this.menuElements[current].classList.contains('opened')) {
+            this.menuElements[current].classList.add('opened');
+            const tEntry = this.treeDirs[current];
+            if (tEntry && tEntry.hasChildren && !tEntry.loaded && !tEntry.loading) {
+                this.loadSubDirs(current);
             }
-        } else {
-            console.log('Error: no menu element for path: ' + current);
         }
     }
 };
@@ -0,0 +1,118 @@
+"""
+Images thumbnails
+Thumbnails of the images of a file browser storage, stored in a cache directory (see `FILE_BROWSER_THUMBNAILS_DIR` setting).
+Cached thumbnails are identified by the image path, size and modification time, so they are never outdated.
+"""
+import hashlib
+import io
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+from PIL import Image
+
+from django_web_utils.file_browser import background, config
+
+logger = logging.getLogger('djwutils.file_browser.thumbnails')
+
+THUMBNAIL_SIZE = (200, 64)
+IMAGES_EXTENSION = ['png', 'gif', 'bmp', 'tiff', 'jpg', 'jpeg']
+# Images bigger than this size are not previewed
+MAX_IMAGE_SIZE = 10000000
+
+
+def get_thumbnail_key(path, stat, size=THUMBNAIL_SIZE):
+    """
+    Get the cache key of a thumbnail (also used as ETag).
+    """
+    data = f'{path}:{stat.st_size}:{stat.st_mtime_ns}:{size[0]}x{size[1]}'
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def is_jpeg(path):
+    return str(path).lower().endswith(('jpg', 'jpeg'))
+
+
+def make_thumbnail(path, size=THUMBNAIL_SIZE):
+    """
+    Create a thumbnail of an image and return its content (JPEG for JPEG images, PNG otherwise).
+    """
+    with Image.open(path) as image:
+        if image.format == 'JPEG':
+            # Decode the image directly at a reduced scale (much faster than a full decoding)
+            image.draft('RGB', size)
+        image.load()
+        image.thumbnail(size, Image.Resampling.LANCZOS)
+        buf = io.BytesIO()
+        if is_jpeg(path):
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            image.save(buf, 'JPEG', quality=85)
+        else:
+            image.save(buf, 'PNG')
+    return buf.getvalue()
+
+
+def get_thumbnail(path, stat=None, cache_dir=None, size=THUMBNAIL_SIZE):
+    """
+    Get the content of the thumbnail of an image, from the cache directory if possible.
+    """
+    if not cache_dir:
+        return make_thumbnail(path, size)
+    stat = stat or os.stat(path)
+    key = get_thumbnail_key(path, stat, size)
+    cache_path = Path(cache_dir) / key[:2] / (key + ('.jpg' if is_jpeg(path) else '.png'))
+    try:
+        return cache_path.read_bytes()
+    except FileNotFoundError:
+        pass
+    data = make_thumbnail(path, size)
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        # Write in a temporary file first so that an incomplete thumbnail is never read
+        with tempfile.NamedTemporaryFile(dir=cache_path.parent, delete=False) as fo:
+            fo.write(data)
+        os.replace(fo.name, cache_path)
+    except OSError as err:
+        logger.warning('Failed to write thumbnail in cache: %s', err)
+    return data
+
+
+def generate_thumbnails(dir_path, cache_dir, size=THUMBNAIL_SIZE):
+    """
+    Generate missing thumbnails of the images of a directory.
+    Returns the number of images processed.
+    """
+    count = 0
+    with os.scandir(dir_path) as it:
+        for entry in it:
+            if entry.name.rsplit('.', 1)[-1].lower() not in IMAGES_EXTENSION:
+                continue
+            try:
+                stat = entry.stat()
+                if not entry.is_file() or stat.st_size >= MAX_IMAGE_SIZE:
+                    continue
+                get_thumbnail(entry.path, stat, cache_dir, size)
+            except Exception as err:
+                logger.debug('Failed to generate thumbnail of "%s": %s', entry.path, err)
+            else:
+                count += 1
+    return count
+
+
+def get_cache_dir(namespace):
+    thumbnails_dir = config.get_thumbnails_dir()
+    if not thumbnails_dir:
+        return None
+    return Path(thumbnails_dir) / config.clean_namespace(namespace)
+
+
+def schedule_generation(namespace, dir_path):
+    """
+    Generate missing thumbnails of a directory in a background thread (if the thumbnails cache is enabled).
+    """
+    cache_dir = get_cache_dir(namespace)
+    if not cache_dir:
+        return None
+    return background.submit(('thumbnails', str(dir_path)), generate_thumbnails, dir_path, cache_dir)
@@ -0,0 +1,177 @@
+"""
+Resumable uploads
+Upload sessions used to upload a file in several chunks (byte ranges), possibly in parallel and after a connection loss.
+Chunks are written directly at their position in a temporary file, which is moved to its destination once complete.
+The uploads directory should be on the same file system as the storage to avoid a copy of the file at the end.
+"""
+import fcntl
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from pathlib import Path
+
+logger = logging.getLogger('djwutils.file_browser.uploads')
+
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+READ_SIZE = 1024 * 1024
+
+
+class UploadError(Exception):
+    pass
+
+
+class UploadNotFound(UploadError):
+    pass
+
+
+def parse_content_range(value):
+    """
+    Parse a "Content-Range" header value and return the start, the end (excluded) and the total size.
+    """
+    match = CONTENT_RANGE_RE.match(value or '')
+    if not match:
+        raise UploadError('Invalid or missing "Content-Range" header.')
+    start, end, total = (int(val) for val in match.groups())
+    if start > end or end >= total:
+        raise UploadError('Invalid "Content-Range" header.')
+    return start, end + 1, total
+
+
+def merge_ranges(ranges, start, end):
+    """
+    Add a range to a sorted list of non overlapping ranges (end excluded).
+    """
+    merged = []
+    for r_start, r_end in sorted([*ranges, [start, end]]):
+        if merged and r_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], r_end)
+        else:
+            merged.append([r_start, r_end])
+    return merged
+
+
+class UploadSession:
+    """
+    Upload session stored in two files: "<id>.json" for information and "<id>.part" for data.
+    """
+
+    def __init__(self, uploads_dir, upload_id):
+        self.uploads_dir = Path(uploads_dir)
+        self.id = upload_id
+        self.meta_path = self.uploads_dir / f'{upload_id}.json'
+        self.data_path = self.uploads_dir / f'{upload_id}.part'
+        self.info = {}
+
+    @classmethod
+    def create(cls, uploads_dir, path, name, size, user_id=None):
+        uploads_dir = Path(uploads_dir)
+        uploads_dir.mkdir(parents=True, exist_ok=True)
+        session = cls(uploads_dir, uuid.uuid4().hex)
+        session.info = dict(path=path, name=name, size=size, user=user_id, created_at=time.time(), ranges=[])
+        with open(session.data_path, 'wb') as fo:
+            # Sparse file, chunks are written at their position
+            fo.truncate(size)
+        session.meta_path.write_text(json.dumps(session.info))
+        return session
+
+    @classmethod
+    def load(cls, uploads_dir, upload_id):
+        session = cls(uploads_dir, upload_id)
+        try:
+            session.info = json.loads(session.meta_path.read_text())
+        except (OSError, ValueError):
+            return None
+        return session
+
+    @property
+    def size(self):
+        return self.info['size']
+
+    @property
+    def offset(self):
+        """
+        Number of bytes received from the start of the file (upload should be resumed from this offset).
+        """
+        ranges = self.info['ranges']
+        return ranges[0][1] if ranges and ranges[0][0] == 0 else 0
+
+    @property
+    def received(self):
+        return sum(end - start for start, end in self.info['ranges'])
+
+    @property
+    def complete(self):
+        return self.offset == self.size
+
+    def get_status(self):
+        return dict(id=self.id, size=self.size, offset=self.offset, received=self.received, ranges=self.info['ranges'])
+
+    def write(self, start, end, stream):
+        """
+        Write the bytes of a range read from a stream (file like object) at its position.
+        """
+        if end > self.size:
+            raise UploadError('The range exceeds the file size.')
+        position = start
+        try:
+            fd = os.open(self.data_path, os.O_WRONLY)
+        except FileNotFoundError:
+            raise UploadNotFound('The upload has been canceled or has expired.')
+        try:
+            while position < end:
+                data = stream.read(min(READ_SIZE, end - position))
+                if not data:
+                    break
+                os.pwrite(fd, data, position)
+                position += len(data)
+        finally:
+            os.close(fd)
+        if position < end:
+            # Keep the part which has been received
+            self._add_range(start, position)
+            raise UploadError('The request content is shorter than the range.')
+        self._add_range(start, end)
+
+    def _add_range(self, start, end):
+        if end <= start:
+            return
+        # Chunks can be sent in parallel, the information file is locked during its update
+        try:
+            fo = open(self.meta_path, 'r+')
+        except FileNotFoundError:
+            # Session deleted while the chunk was written
+            raise UploadNotFound('The upload has been canceled or has expired.')
+        with fo:
+            fcntl.flock(fo, fcntl.LOCK_EX)
+            self.info = json.loads(fo.read())
+            self.info['ranges'] = merge_ranges(self.info['ranges'], start, end)
+            fo.seek(0)
+            fo.truncate()
+            fo.write(json.dumps(self.info))
+
+    def delete(self):
+        self.data_path.unlink(missing_ok=True)
+        self.meta_path.unlink(missing_ok=True)
+
+
+def clean_expired_sessions(uploads_dir, max_age):
+    """
+    Remove upload sessions created more than `max_age` seconds ago.
+    """
+    limit = time.time() - max_age
+    try:
+        entries = list(os.scandir(uploads_dir))
+    except FileNotFoundError:
+        return 0
+    removed = 0
+    for entry in entries:
+        if entry.name.endswith('.json'):
+            session = UploadSession.load(uploads_dir, entry.name[:-5])
+            if session and session.info.get('created_at', 0) < limit:
+                logger.info('Removing expired upload session %s.', session.id)
+                session.delete()
+                removed += 1
+    return removed
@@ -3,14 +3,18 @@ from django.urls import re_path
 from django.views.decorators.cache import cache_page
 from django.views.i18n import JavaScriptCatalog
 # Django web utils
-from django_web_utils.file_browser import views, views_action
+from django_web_utils.file_browser import views, views_action, views_job, views_upload
 
 
 urlpatterns = [
     re_path(r'^$', views.storage_manager, name='file_browser_base'),
     re_path(r'^dirs/$', views.storage_dirs, name='file_browser_dirs'),
     re_path(r'^content/$', views.storage_content, name='file_browser_content'),
+    re_path(r'^download/$', views.storage_download, name='file_browser_download'),
     re_path(r'^preview/$', views.storage_img_preview, name='file_browser_img_preview'),
     re_path(r'^action/$', views_action.storage_action, name='file_browser_action'),
+    re_path(r'^upload/$', views_upload.storage_upload, name='file_browser_upload'),
+    re_path(r'^upload/(?P<upload_id>[0-9a-f]{32})/$', views_upload.storage_upload_session, name='file_browser_upload_session'),
+    re_path(r'^jobs/(?P<job_id>[0-9a-f]{32})/$', views_job.storage_job, name='file_browser_job'),
     re_path(r'^jsi18n/$', cache_page(3600)(JavaScriptCatalog.as_view(packages=['django_web_utils.file_browser'])), name='file_browser_jsi18n'),
 ]
@@ -1,20 +1,27 @@
-from PIL import Image
+import contextlib
 import datetime
+import hashlib
+import json
 import logging
 import os
+import time
 # Django
-from django.http import JsonResponse, HttpResponse, HttpResponseRedirect
+from django.http import JsonResponse, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
 from django.shortcuts import render
 from django.templatetags.static import static
-from django.utils.translation import gettext as _
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from django.utils.translation import get_language, gettext as _
 # Django web utils
-from django_web_utils.file_browser import config
+from django_web_utils.file_browser import config, thumbnails
+from django_web_utils.file_browser.dirs_tree import get_dirs_tree, get_tree_signature, has_sub_dirs
+from django_web_utils.file_browser.sendfile import get_download_response
+from django_web_utils.file_browser.size_index import get_size_index, schedule_refresh
+from django_web_utils.file_browser.thumbnails import IMAGES_EXTENSION, MAX_IMAGE_SIZE
 from django_web_utils.files_utils import get_size_display
 
 logger = logging.getLogger('djwutils.file_browser.views')
 
-IMAGES_EXTENSION = ['png', 'gif', 'bmp', 'tiff', 'jpg', 'jpeg']
-
 
 @config.view_decorator
 def storage_manager(request, namespace=None):
@@ -26,41 +33,73 @@ def storage_manager(request, namespace=None):
     return render(request, tplt, {
         'base_url': base_url,
         'namespace': config.clean_namespace(namespace),
+        # Files are downloaded through the download view if the transfer can be delegated to the web server
+        'protected_downloads': bool(config.get_sendfile_mode()),
     })
 
 
-def recursive_dirs(path):
+def get_dirs_etag(request, path, depth):
     """
-    Function to get all sub dirs from a dir recursively.
+    Function to get the ETag of a dirs tree without building it.
+    The ETag changes when the request parameters change or when a dir of the tree is modified.
     """
-    dirs = list()
-    try:
-        files_names = os.listdir(path)
-    except OSError as e:
-        logger.error(e)
-    else:
-        files_names.sort(key=lambda f: f.lower())
-        for file_name in files_names:
-            if '\'' in file_name or '"' in file_name:
-                continue
-            current_path = os.path.join(path, file_name)
-            if os.path.isdir(current_path):
-                dirs.append(dict(dir_name=file_name, sub_dirs=recursive_dirs(current_path)))
-    return dirs
+    parts = [get_tree_signature(path, depth), sorted(request.GET.items()), get_language()]
+    return '"%s"' % hashlib.sha1(json.dumps(parts).encode('utf-8')).hexdigest()
 
 
 @config.view_decorator
 def storage_dirs(request, namespace=None):
     """
     Storage dirs view.
+    Without "path" parameter, the tree of the root folder is returned, on "depth" levels
+    (`FILE_BROWSER_DIRS_TREE_DEPTH` by default, 0 for the complete tree).
+    With a "path" parameter, only the sub dirs of this path are returned, on "depth" levels (1 by default).
     """
     base_path = config.get_base_path(namespace)
 
     if not os.path.exists(base_path):
         return JsonResponse(dict(error=_('Folder "%s" does not exist.') % base_path), status=400)
 
-    dirs = [dict(dir_name=_('Root folder'), sub_dirs=recursive_dirs(base_path))]
-    return JsonResponse(dict(dirs=dirs))
+    if 'path' not in request.GET:
+        try:
+            depth = int(request.GET['depth']) if request.GET.get('depth') else config.get_dirs_tree_depth()
+            if depth is not None and depth < 0:
+                raise ValueError()
+        except ValueError:
+            return JsonResponse(dict(error=_('Invalid depth.')), status=400)
+        etag = get_dirs_etag(request, base_path, depth or None)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            dirs = [dict(dir_name=_('Root folder'), sub_dirs=get_dirs_tree(base_path, depth or None), has_children=has_sub_dirs(base_path))]
+            response = JsonResponse(dict(dirs=dirs))
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    path = request.GET['path'].strip('/')
+    if '..' in path:
+        return JsonResponse(dict(error=_('Invalid base path.')), status=400)
+    dir_path = os.path.join(base_path, path) if path else base_path
+    if not os.path.isdir(dir_path):
+        return JsonResponse(dict(error=_('Folder "%s" does not exist') % path), status=400)
+    try:
+        depth = int(request.GET.get('depth') or 1)
+        if depth < 1:
+            raise ValueError()
+    except ValueError:
+        return JsonResponse(dict(error=_('Invalid depth.')), status=400)
+    # The ETag is checked before building the tree to avoid building and sending it again if it did not change
+    etag = get_dirs_etag(request, dir_path, depth)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = JsonResponse(dict(
+            path=path + '/' if path else '/',
+            dir_name=os.path.basename(path) if path else _('Root folder'),
+            dirs=get_dirs_tree(dir_path, depth),
+        ))
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
 
 
 def get_info(path):
@@ -84,101 +123,289 @@ def get_info(path):
     return size, nb_files, nb_dirs
 
 
+def get_indexed_info(size_index, rel_path):
+    """
+    Function to get information on a dir from the size index.
+    A refresh of the index is scheduled if the information is missing or outdated.
+    """
+    info = size_index.get(rel_path)
+    if info is None or info['stale']:
+        schedule_refresh(size_index, rel_path)
+    if info is None:
+        return None, None, None, True
+    return info['size'], info['nb_files'], info['nb_dirs'], info['stale']
+
+
+def get_entry_info(entry, size_index=None, rel_path=None):
+    """
+    Function to get information on a directory entry (`os.DirEntry`).
+    Returns None for entries which are neither files nor dirs (sockets for example).
+    """
+    try:
+        is_dir = entry.is_dir()
+        is_file = not is_dir and entry.is_file()
+    except OSError:
+        return None
+    if not is_dir and not is_file:
+        return None
+    file_properties = {
+        'name': entry.name,
+        'is_dir': is_dir,
+    }
+    if is_dir:
+        if size_index:
+            # Use indexed sizes, missing or outdated ones are computed in background
+            size, nb_files, nb_dirs, stale = get_indexed_info(size_index, os.path.join(rel_path, entry.name))
+            file_properties['stale'] = stale
+        else:
+            size, nb_files, nb_dirs = get_info(entry.path)
+    else:
+        nb_files = nb_dirs = 0
+        try:
+            stat = entry.stat()
+        except OSError:
+            size = 0
+            mdate = None
+        else:
+            size = stat.st_size
+            mdate = datetime.datetime.fromtimestamp(stat.st_mtime).strftime('%Y-%m-%d %H:%M')
+    file_properties.update({
+        'size': size,
+        'size_h': get_size_display(size) if size is not None else '?',
+        'nb_files': nb_files,
+        'nb_dirs': nb_dirs,
+    })
+    if is_file:
+        splitted = entry.name.split('.')
+        file_properties['ext'] = splitted[-1].lower() if len(splitted) > 0 else ''
+        if file_properties['ext'] in IMAGES_EXTENSION and size < MAX_IMAGE_SIZE:
+            # Allow previes for images < 10MB
+            file_properties['preview'] = True
+        # Get modification time
+        file_properties['mdate'] = mdate
+    return file_properties
+
+
+def get_newest_mtime_ns(stat, entries):
+    """
+    Function to get the newest modification time of a dir and of its entries (`os.DirEntry`).
+    The stats of the entries are cached in the entries objects so they are not requested again by the listing.
+    """
+    newest = stat.st_mtime_ns
+    for entry in entries:
+        try:
+            newest = max(newest, entry.stat().st_mtime_ns)
+        except OSError:
+            pass
+    return newest
+
+
+def get_content_etag(request, stat, newest_mtime_ns, size_index, rel_path):
+    """
+    Function to get the ETag of a dir content without getting the information of its entries.
+    The ETag changes when an entry is added, removed or renamed in the dir (modification time of the dir),
+    when an entry is modified (newest modification time of the entries), when the request parameters change
+    and when indexed sizes are updated (changes deeper in sub dirs are detected by the size index).
+    """
+    parts = [stat.st_dev, stat.st_ino, stat.st_mtime_ns, newest_mtime_ns, sorted(request.GET.items())]
+    # The stale state of indexed sizes also depends on the time
+    parts += [size_index.get_generation(rel_path), int(time.time() // size_index.ttl)]
+    return '"%s"' % hashlib.sha1(json.dumps(parts).encode('utf-8')).hexdigest()
+
+
+def add_to_totals(totals, file_properties):
+    """
+    Function to add the size and counts of a file or a dir to the totals of a listing.
+    """
+    totals['size'] += file_properties['size'] or 0
+    totals['nb_files'] += (file_properties['nb_files'] or 0) + (0 if file_properties['is_dir'] else 1)
+    totals['nb_dirs'] += (file_properties['nb_dirs'] or 0) + (1 if file_properties['is_dir'] else 0)
+
+
+def get_parent_entry():
+    """
+    Function to get the entry used to go to the parent dir (first entry of the listing of a sub dir).
+    """
+    return {
+        'name': 'parent',
+        'formated_name': '← %s' % _('Parent folder'),
+        'is_dir': True,
+        'isprevious': True,
+    }
+
+
+def iter_content_lines(iterator, folder_path, path, size_index=None, namespace=None):
+    """
+    Generate the JSON lines of a dir content while its entries are produced by `iterator` (from `os.scandir`).
+    The first line is the dir path, the last line contains the totals and the other lines are files
+    (in the order of the file system).
+    """
+    yield json.dumps(dict(path='/' + path)) + '\n'
+    if path:
+        yield json.dumps(get_parent_entry()) + '\n'
+    totals = dict(size=0, nb_files=0, nb_dirs=0)
+    stale = preview = False
+    # A single index connection is used for all the dirs
+    with iterator, size_index.batch() if size_index else contextlib.nullcontext():
+        for entry in iterator:
+            if entry.name == '.htaccess':
+                continue
+            file_properties = get_entry_info(entry, size_index, path)
+            if file_properties:
+                add_to_totals(totals, file_properties)
+                stale = stale or file_properties.get('stale', False)
+                preview = preview or file_properties.get('preview', False)
+                yield json.dumps(file_properties) + '\n'
+    data = dict(
+        total_size=get_size_display(totals['size']),
+        total_nb_dirs=totals['nb_dirs'],
+        total_nb_files=totals['nb_files'],
+    )
+    if size_index:
+        data['stale'] = stale
+    yield json.dumps(data) + '\n'
+    if preview and config.get_thumbnails_pregeneration():
+        thumbnails.schedule_generation(namespace, folder_path)
+
+
+def sort_files(files, order):
+    """
+    Function to sort a list of files properties, folders are always listed first.
+    """
+    reverse = not order.endswith('asc')
+    if order.startswith('size'):
+        field = 'size'
+    elif order.startswith('mdate'):
+        field = 'mdate'
+    else:
+        field = 'name'
+
+    def get_key(f):
+        if field == 'name':
+            value = f['name'].lower()
+        elif field == 'size':
+            value = f['size'] or 0
+        else:
+            value = f.get('mdate') or ''
+        return (f['is_dir'] if reverse else not f['is_dir'], value)
+
+    files.sort(key=get_key, reverse=reverse)
+
+
 @config.view_decorator
 def storage_content(request, namespace=None):
     """
     Storage content view.
+    Use "offset" and "limit" parameters to get only a part of the content,
+    and "format=ndjson" to get a stream of JSON lines sent while the folder is listed (see `iter_content_lines`,
+    the files are not sorted so this format cannot be used with "order", "offset" and "limit").
     """
     base_path = config.get_base_path(namespace)
     path = request.GET.get('path', '').strip('/')
     folder_path = base_path if not path else os.path.join(base_path, path)
 
-    if not os.path.exists(folder_path):
+    try:
+        folder_stat = os.stat(folder_path)
+    except OSError:
         return JsonResponse(dict(error=_('Folder "%s" does not exist') % path), status=400)
 
     try:
-        files_names = os.listdir(folder_path)
+        offset = int(request.GET.get('offset') or 0)
+        limit = int(request.GET['limit']) if request.GET.get('limit') else None
+        if offset < 0 or (limit is not None and limit < 1):
+            raise ValueError()
+    except ValueError:
+        return JsonResponse(dict(error=_('Invalid offset or limit.')), status=400)
+
+    streamed = request.GET.get('format') == 'ndjson'
+    if streamed and ('order' in request.GET or offset or limit):
+        return JsonResponse(dict(error=_('The "ndjson" format cannot be used with the order, offset and limit parameters.')), status=400)
+
+    try:
+        if streamed:
+            # Files are sent while they are listed (no conditional request because the content is not known yet)
+            iterator = os.scandir(folder_path)
+        else:
+            with os.scandir(folder_path) as it:
+                entries = [entry for entry in it if entry.name != '.htaccess']
     except OSError as e:
         logger.error(e)
         return JsonResponse(dict(error=str(e)), status=400)
-    if '.htaccess' in files_names:
-        files_names.remove('.htaccess')
+    size_index = get_size_index(namespace)
+    if streamed:
+        response = StreamingHttpResponse(
+            iter_content_lines(iterator, folder_path, path, size_index, namespace), content_type='application/x-ndjson')
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
 
-    # Content list
-    total_size = 0
-    total_nb_dirs = 0
-    total_nb_files = 0
+    # Conditional request (the content information is not retrieved if the client copy is up to date)
+    # Without size index, the sizes of sub dirs depend on their whole content so the content is always sent
+    if size_index:
+        newest_mtime_ns = get_newest_mtime_ns(folder_stat, entries)
+        etag = get_content_etag(request, folder_stat, newest_mtime_ns, size_index, path)
+        response = get_conditional_response(request, etag=etag, last_modified=newest_mtime_ns // 10 ** 9)
+        if response is not None:
+            return response
+
+    # Content list (the entries stats are cached by the ETag computation)
     files = list()
-    folder_index = 0
-    for file_name in files_names:
-        current_path = os.path.join(folder_path, file_name)
-        size, nb_files, nb_dirs = get_info(current_path)
-        total_size += size
-        total_nb_files += nb_files
-        total_nb_dirs += nb_dirs
-        file_properties = {
-            'name': file_name,
-            'size': size,
-            'size_h': get_size_display(size),
-            'is_dir': False,
-            'nb_files': nb_files,
-            'nb_dirs': nb_dirs,
-        }
-        if os.path.isdir(current_path):
-            total_nb_dirs += 1
-            file_properties['is_dir'] = True
-            files.insert(folder_index, file_properties)
-            folder_index += 1
-        elif os.path.isfile(current_path):
-            total_nb_files += 1
-            splitted = file_name.split('.')
-            file_properties['ext'] = splitted[-1].lower() if len(splitted) > 0 else ''
-            if file_properties['ext'] in IMAGES_EXTENSION and size < 10000000:
-                # Allow previes for images < 10MB
-                file_properties['preview'] = True
-            # Get modification time
-            mdate = datetime.datetime.fromtimestamp(os.path.getmtime(current_path)).strftime('%Y-%m-%d %H:%M')
-            file_properties['mdate'] = mdate
-            files.append(file_properties)
-        # Else: socket or other, ignored
-    total_size = get_size_display(total_size)
+    # A single index connection is used for all the dirs
+    with size_index.batch() if size_index else contextlib.nullcontext():
+        for entry in entries:
+            file_properties = get_entry_info(entry, size_index, path)
+            if file_properties:
+                files.append(file_properties)
+    totals = dict(size=0, nb_files=0, nb_dirs=0)
+    for file_properties in files:
+        add_to_totals(totals, file_properties)
+
+    if config.get_thumbnails_pregeneration() and any(f.get('preview') for f in files):
+        # Generate missing thumbnails before the browser requests them
+        thumbnails.schedule_generation(namespace, folder_path)
 
     # Ordering
-    order = request.GET.get('order', 'name-asc')
-    if order.startswith('size'):
-        if order.endswith('asc'):
-            files.sort(key=lambda f: (not f['is_dir'], f['size']))
-        else:
-            files.sort(key=lambda f: (f['is_dir'], f['size']))
-            files.reverse()
-    elif order.startswith('mdate'):
-        if order.endswith('asc'):
-            files.sort(key=lambda f: (not f['is_dir'], f.get('mdate')))
-        else:
-            files.sort(key=lambda f: (f['is_dir'], f.get('mdate')))
-            files.reverse()
-    else:
-        if order.endswith('asc'):
-            files.sort(key=lambda f: (not f['is_dir'], f['name'].lower()))
-        else:
-            files.sort(key=lambda f: (f['is_dir'], f['name'].lower()))
-            files.reverse()
+    sort_files(files, request.GET.get('order', 'name-asc'))
+    count = len(files)
+    if offset or limit:
+        files = files[offset:offset + limit if limit else None]
 
-    if path:
-        files.insert(0, {
-            'name': 'parent',
-            'formated_name': '← %s' % _('Parent folder'),
-            'is_dir': True,
-            'isprevious': True,
-        })
-
-    return JsonResponse(dict(
-        files=files,
+    if path and offset == 0:
+        files.insert(0, get_parent_entry())
+
+    data = dict(
         path='/' + path,
-        total_size=total_size,
-        total_nb_dirs=total_nb_dirs,
-        total_nb_files=total_nb_files,
-    ))
+        total_size=get_size_display(totals['size']),
+        total_nb_dirs=totals['nb_dirs'],
+        total_nb_files=totals['nb_files'],
+    )
+    if limit:
+        data.update(count=count, offset=offset, limit=limit)
+    if size_index:
+        # Indicates that the content should be loaded again to get up to date sizes
+        data['stale'] = any(f.get('stale') for f in files)
+
+    response = JsonResponse(dict(files=files, **data))
+    if size_index:
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(newest_mtime_ns / 10 ** 9)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@config.view_decorator
+def storage_download(request, namespace=None):
+    """
+    Storage file download view.
+    The transfer is delegated to the web server if configured (see `FILE_BROWSER_SENDFILE` setting).
+    Use "attachment=1" to force the download of the file instead of its display.
+    """
+    path = request.GET.get('path', '').strip('/')
+    if not path or '..' in path:
+        return JsonResponse(dict(error=_('Invalid path.')), status=400)
+    response = get_download_response(request, namespace, path, as_attachment=request.GET.get('attachment') == '1')
+    if response is None:
+        return JsonResponse(dict(error=_('The file "%s" does not exist.') % path), status=404)
+    return response
 
 
 @config.view_decorator
@@ -191,20 +418,22 @@ def storage_img_preview(request, namespace=None):
     if not path:
         return HttpResponseRedirect(static('file_browser/img/img.png'))
     file_path = os.path.join(base_path, path)
-    if not os.path.exists(file_path):
-        return HttpResponseRedirect(static('file_browser/img/img.png'))
-
     try:
-        image = Image.open(file_path)
-        image.load()
-        image.thumbnail((200, 64), Image.Resampling.LANCZOS)
-    except Exception:
+        stat = os.stat(file_path)
+    except OSError:
         return HttpResponseRedirect(static('file_browser/img/img.png'))
 
-    if file_path.lower().endswith('jpg') or file_path.lower().endswith('jpeg'):
-        response = HttpResponse(content_type='image/jpeg; charset=utf-8')
-        image.save(response, 'JPEG', quality=85)
-    else:
-        response = HttpResponse(content_type='image/png; charset=utf-8')
-        image.save(response, 'PNG')
+    # The thumbnail only changes if the image changes
+    etag = '"%s"' % thumbnails.get_thumbnail_key(file_path, stat)
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is None:
+        try:
+            data = thumbnails.get_thumbnail(file_path, stat, thumbnails.get_cache_dir(namespace))
+        except Exception:
+            return HttpResponseRedirect(static('file_browser/img/img.png'))
+        content_type = 'image/jpeg' if thumbnails.is_jpeg(file_path) else 'image/png'
+        response = HttpResponse(data, content_type=content_type + '; charset=utf-8')
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    patch_cache_control(response, private=True, no_cache=True)
     return response
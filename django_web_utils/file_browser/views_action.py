@@ -1,38 +1,104 @@
 import os
 import re
-import shutil
 import unicodedata
 # Django
 from django.contrib import messages
 from django.core.exceptions import ValidationError
-from django.http import JsonResponse, HttpResponseRedirect
+from django.http import JsonResponse, HttpResponseRedirect, StreamingHttpResponse
 from django.urls import reverse
+from django.utils.http import content_disposition_header
 from django.utils.translation import gettext as _
 # Django web utils
 from django_web_utils.antivirus_utils import antivirus_file_validator
-from django_web_utils.file_browser import config
+from django_web_utils.zip_utils import stream_zip
+from django_web_utils.file_browser import config, operations
+from django_web_utils.file_browser.jobs import JobCanceled
+from django_web_utils.file_browser.search_index import get_search_index, schedule_refresh, update_search_index
+from django_web_utils.file_browser.views_job import run_job
 
 
-def recursive_remove(path):
+def delete_files(job, dir_path, path, names, namespace):
     """
-    Function to remove a dir and all its file.
-    Returns the number of deleted files and dirs.
+    Job function to delete files and dirs.
     """
     files_deleted = 0
     dir_deleted = 0
-    if not os.path.exists(path):
-        return files_deleted, dir_deleted
-    if os.path.isdir(path):
-        for f in os.listdir(path):
-            fd, dd = recursive_remove(os.path.join(path, f))
-            files_deleted += fd
-            dir_deleted += dd
-        os.rmdir(path)
-        dir_deleted += 1
-    elif os.path.isfile(path):
-        os.remove(path)
-        files_deleted += 1
-    return files_deleted, dir_deleted
+    for name in names:
+        src = os.path.join(dir_path, name)
+        job.set_progress(force=True, current=name, files=files_deleted, dirs=dir_deleted)
+
+        def on_progress(fd, dd):
+            job.set_progress(files=files_deleted + fd, dirs=dir_deleted + dd)
+
+        try:
+            if os.path.lexists(src):
+                fd, dd = operations.remove_tree(src, on_progress)
+                files_deleted += fd
+                dir_deleted += dd
+        except JobCanceled:
+            raise
+        except Exception as e:
+            raise Exception('%s %s' % (_('Unable to delete file %s:') % name, e)) from e
+        update_search_index(namespace, removed=[os.path.join(path, name)])
+    job.set_progress(force=True, current=None, files=files_deleted, dirs=dir_deleted)
+    return _('%(f)s file(s) and %(d)s directory(ies) successfully deleted.') % dict(f=files_deleted, d=dir_deleted)
+
+
+def transfer_files(job, action, dir_path, path, names, dest_dir, base_path, namespace):
+    """
+    Job function to move or copy files and dirs in a directory.
+    """
+    error_msg = _('Unable to move file %s:') if action == 'move' else _('Unable to copy file %s:')
+    dir_path = os.path.normpath(dir_path)
+    dest_dir = os.path.normpath(dest_dir)
+    sources = []
+    for name in names:
+        if '/' in name or name in ('.', '..'):
+            raise Exception('%s %s' % (error_msg % name, _('Invalid name.')))
+        src = os.path.join(dir_path, name)
+        if action == 'move' and (src == dest_dir or os.path.dirname(src) == dest_dir):
+            continue
+        dest = os.path.join(dest_dir, name)
+        if os.path.lexists(dest):
+            raise Exception('%s %s' % (error_msg % name, _('The file "%s" already exists.') % name))
+        if os.path.isdir(src) and (dest_dir + '/').startswith(src + '/'):
+            raise Exception('%s %s' % (error_msg % name, _('A folder cannot be moved or copied in itself.')))
+        sources.append((name, src, dest))
+
+    # Compute the size to copy only if data is copied
+    progress = dict(files=0, bytes=0, total_bytes=None)
+    if action == 'copy' or os.stat(dir_path).st_dev != os.stat(dest_dir).st_dev:
+        progress['total_bytes'] = sum(operations.get_tree_size(src) for name, src, dest in sources)
+    job.set_progress(force=True, **progress)
+
+    def on_progress(count):
+        progress['bytes'] += count
+        job.set_progress(**progress)
+
+    for name, src, dest in sources:
+        job.set_progress(current=name)
+        try:
+            if action == 'move':
+                operations.move_tree(src, dest, on_progress)
+            else:
+                try:
+                    operations.copy_tree(src, dest, on_progress)
+                except BaseException:
+                    # Do not keep an incomplete copy
+                    if os.path.lexists(dest):
+                        operations.remove_tree(dest)
+                    raise
+        except JobCanceled:
+            raise
+        except Exception as e:
+            raise Exception('%s %s' % (error_msg % name, e)) from e
+        progress['files'] += 1
+        job.set_progress(**progress)
+        update_search_index(namespace, removed=[os.path.join(path, name)] if action == 'move' else None, added=[os.path.relpath(dest, base_path)])
+    job.set_progress(force=True, current=None, **progress)
+    if action == 'move':
+        return _('%s file(s) successfully moved.') % progress['files']
+    return _('%s file(s) successfully copied.') % progress['files']
 
 
 def clean_file_name(name):
@@ -46,6 +112,42 @@ def clean_file_name(name):
     return name
 
 
+def get_search_message(results, search, path):
+    if results:
+        if path:
+            return _('%(count)s results for "%(search)s" in "%(path)s".') % dict(count=results, search=search, path=path)
+        else:
+            return _('%(count)s results for "%(search)s".') % dict(count=results, search=search)
+    else:
+        return _('No results for "%(search)s".') % dict(search=search)
+
+
+def search_with_index(request, search_index, path, search):
+    """
+    Search files using the search index.
+    Use "offset" and "limit" parameters to get only a part of the results (results are ordered by path).
+    """
+    try:
+        offset = int(request.GET.get('offset') or 0)
+        limit = int(request.GET['limit']) if request.GET.get('limit') else None
+        if offset < 0 or (limit is not None and limit < 1):
+            raise ValueError()
+    except ValueError:
+        return JsonResponse(dict(error=_('Invalid offset or limit.')), status=400)
+    results, entries = search_index.search(search, path, offset=offset, limit=limit)
+    dirs = dict()
+    for entry in entries:
+        if entry['is_dir']:
+            dirs.setdefault(entry['path'] + '/', list())
+        else:
+            dirs.setdefault(entry['parent'] + '/' if entry['parent'] else '', list()).append(entry['name'])
+    dirs = [dict(url=url, files=dirs[url]) for url in sorted(dirs.keys())]
+    data = dict(search_in=path, msg=get_search_message(results, search, path), results=results, dirs=dirs)
+    if limit:
+        data.update(offset=offset, limit=limit)
+    return JsonResponse(data)
+
+
 @config.view_decorator
 def storage_action(request, namespace=None):
     """
@@ -119,6 +221,7 @@ def storage_action(request, namespace=None):
                     antivirus_file_validator(file_path)
                 except ValidationError as e:
                     return JsonResponse(dict(error=str(e)), status=400)
+                update_search_index(namespace, added=[os.path.join(path, file_name)])
                 # Get url
                 if path:
                     url = base_url + '/' + path + '/' + file_name
@@ -154,10 +257,11 @@ def storage_action(request, namespace=None):
                 os.makedirs(target, exist_ok=True)
             except Exception as e:
                 return JsonResponse(dict(error='%s %s' % (_('Failed to create folder:'), e)), status=400)
+            update_search_index(namespace, added=[os.path.join(path, name)])
             return JsonResponse(dict(message=_('Folder created.')))
 
         # Actions on several files form
-        elif action in ('rename', 'move', 'delete'):
+        elif action in ('rename', 'move', 'copy', 'delete'):
             # Check data
             path = request.POST.get('path', '').strip('/')
             if '..' in path:
@@ -169,7 +273,10 @@ def storage_action(request, namespace=None):
             names = list()
             for key in request.POST:
                 if key.startswith('name_') and request.POST[key]:
-                    names.append(request.POST[key])
+                    name = request.POST[key]
+                    if '/' in name or name in ('.', '..'):
+                        return JsonResponse(dict(error=_('Invalid name.')), status=400)
+                    names.append(name)
             if not names:
                 return JsonResponse(dict(error=_('No files selected.')), status=400)
 
@@ -200,47 +307,31 @@ def storage_action(request, namespace=None):
                         if os.path.exists(dest):
                             return JsonResponse(dict(error=_('The file "%s" already exists.') % new), status=400)
                         os.rename(src, dest)
+                        update_search_index(namespace, removed=[os.path.join(path, name)], added=[os.path.join(path, new)])
                 if len(names) == 1:
                     return JsonResponse(dict(message=_('File renamed.')))
                 else:
                     return JsonResponse(dict(message=_('Files renamed.')))
 
-            elif action == 'move':
+            elif action in ('move', 'copy'):
                 new_path = request.POST.get('new_path', '').strip('/')
                 if not new_path:
                     return JsonResponse(dict(error=_('No path specfied to move files in.')), status=400)
+                if '..' in new_path:
+                    return JsonResponse(dict(error=_('Invalid base path.')), status=400)
                 if new_path == '#':
                     new_path = base_path
                 else:
                     new_path = os.path.join(base_path, new_path)
-                new_path = new_path
                 if not os.path.exists(new_path):
                     return JsonResponse(dict(error=_('Destination path does not exists.')), status=400)
-                moved = 0
-                for name in names:
-                    src = os.path.join(dir_path, name)
-                    if src != new_path and not (os.path.isfile(src) and os.path.dirname(src) == new_path):
-                        try:
-                            shutil.move(src, new_path)
-                            moved += 1
-                        except Exception as e:
-                            return JsonResponse(dict(error='%s %s' % (_('Unable to move file %s:') % name, e)), status=400)
-                return JsonResponse(dict(message=_('%s file(s) successfully moved.') % moved))
+                # Data is copied if the destination is on another file system, so the operation runs in a background job
+                return run_job(request, namespace, action, transfer_files, action, dir_path, path, names, new_path, base_path, namespace)
 
             elif action == 'delete':
-                files_deleted = 0
-                dir_deleted = 0
-                for name in names:
-                    if not name:
-                        continue
-                    src = os.path.join(dir_path, name)
-                    try:
-                        fd, dd = recursive_remove(src)
-                        files_deleted += fd
-                        dir_deleted += dd
-                    except Exception as e:
-                        return JsonResponse(dict(error='%s %s' % (_('Unable to delete file %s:') % name, e)), status=400)
-                return JsonResponse(dict(message=_('%(f)s file(s) and %(d)s directory(ies) successfully deleted.') % dict(f=files_deleted, d=dir_deleted)))
+                # Big trees take a long time to delete, so the deletion runs in a background job
+                names = [name for name in names if name]
+                return run_job(request, namespace, 'delete', delete_files, dir_path, path, names, namespace)
     else:
         # Actions using get method
         action = request.GET.get('action')
@@ -260,6 +351,14 @@ def storage_action(request, namespace=None):
             search = request.GET.get('search', '')
             search = search.replace('\'', '"').lower()
 
+            search_index = get_search_index(namespace)
+            if search_index:
+                if search_index.is_stale():
+                    schedule_refresh(search_index)
+                if search_index.get_refresh_date() is not None:
+                    # Use the index if it has been built (even if it is outdated)
+                    return search_with_index(request, search_index, path, search)
+
             dirs = dict()
             results = 0
             for bpath, subdirs, files in os.walk(dir_path):
@@ -293,14 +392,40 @@ def storage_action(request, namespace=None):
             urls.sort()
             dirs = [dict(url=url, files=dirs[url]) for url in urls]
 
-            if dirs:
-                if path:
-                    msg = _('%(count)s results for "%(search)s" in "%(path)s".') % dict(count=results, search=search, path=path)
-                else:
-                    msg = _('%(count)s results for "%(search)s".') % dict(count=results, search=search)
-            else:
-                msg = _('No results for "%(search)s".') % dict(search=search)
-
+            msg = get_search_message(results, search, path)
             return JsonResponse(dict(search_in=path, msg=msg, results=results, dirs=dirs))
 
+        # Download of several files
+        elif action == 'download':
+            path = request.GET.get('path', '').strip('/')
+            if '..' in path:
+                return JsonResponse(dict(error=_('Invalid base path.')), status=400)
+            if path:
+                dir_path = os.path.join(base_path, path)
+            else:
+                dir_path = base_path
+            names = list()
+            for key in request.GET:
+                if key.startswith('name_') and request.GET[key]:
+                    name = request.GET[key]
+                    if '/' in name or name in ('.', '..'):
+                        return JsonResponse(dict(error=_('Invalid name.')), status=400)
+                    if not os.path.exists(os.path.join(dir_path, name)):
+                        return JsonResponse(dict(error=_('The file "%s" does not exist.') % name), status=400)
+                    names.append(name)
+            if not names:
+                return JsonResponse(dict(error=_('No files selected.')), status=400)
+            # The archive is generated while it is sent (download starts immediately and memory usage is constant)
+            store = request.GET.get('store') in ('1', 'true', 'yes')
+            paths = [(os.path.join(dir_path, name), name) for name in names]
+            if len(names) == 1:
+                zip_name = names[0]
+            else:
+                zip_name = os.path.basename(path) if path else 'files'
+            response = StreamingHttpResponse(stream_zip(paths, store=store), content_type='application/zip')
+            response['Content-Disposition'] = content_disposition_header(True, zip_name + '.zip')
+            # Avoid buffering of the response by Nginx
+            response['X-Accel-Buffering'] = 'no'
+            return response
+
     return JsonResponse(dict(error=_('Invalid action requested.')), status=400)
@@ -0,0 +1,49 @@
+import concurrent.futures
+import logging
+# Django
+from django.http import JsonResponse
+from django.urls import reverse
+from django.utils.translation import gettext as _
+from django.views.decorators.http import require_http_methods
+# Django web utils
+from django_web_utils.file_browser import config, jobs
+
+logger = logging.getLogger('djwutils.file_browser.views_job')
+
+
+def run_job(request, namespace, kind, function, *args):
+    """
+    Start a job and wait for its end during `FILE_BROWSER_JOBS_WAIT` seconds.
+    If the job is finished, its result is returned like the one of a synchronous action,
+    otherwise the response contains the job status and the "job_url" to use to follow its progress.
+    """
+    jobs_dir = config.get_jobs_dir(namespace)
+    jobs.clean_expired_jobs(jobs_dir)
+    job = jobs.Job.create(jobs_dir, kind, user_id=request.user.pk)
+    future = jobs.start(job, function, *args)
+    concurrent.futures.wait([future], timeout=config.get_jobs_wait())
+    job = jobs.Job.load(jobs_dir, job.id)
+    if job.status == jobs.DONE:
+        return JsonResponse(dict(message=job.info['message']))
+    if job.status in (jobs.FAILED, jobs.CANCELED):
+        return JsonResponse(dict(error=job.info['error']), status=400)
+    if namespace:
+        url = reverse('%s:file_browser_job' % namespace, args=[job.id])
+    else:
+        url = reverse('file_browser_job', args=[job.id])
+    return JsonResponse(dict(message=_('The operation is running in background.'), job=job.get_status(), job_url=url))
+
+
+@config.view_decorator
+@require_http_methods(['GET', 'DELETE'])
+def storage_job(request, job_id, namespace=None):
+    """
+    Job status view.
+    A DELETE request cancels the job.
+    """
+    job = jobs.Job.load(config.get_jobs_dir(namespace), job_id)
+    if not job or job.info['user'] != request.user.pk:
+        return JsonResponse(dict(error=_('Job not found.')), status=404)
+    if request.method == 'DELETE':
+        job.cancel()
+    return JsonResponse(job.get_status())
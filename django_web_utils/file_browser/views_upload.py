@@ -0,0 +1,120 @@
+import logging
+import os
+import shutil
+# Django
+from django.core.exceptions import ValidationError
+from django.http import JsonResponse
+from django.urls import reverse
+from django.utils.translation import gettext as _
+from django.views.decorators.http import require_http_methods
+# Django web utils
+from django_web_utils.antivirus_utils import antivirus_file_validator
+from django_web_utils.file_browser import config
+from django_web_utils.file_browser.search_index import update_search_index
+from django_web_utils.file_browser.uploads import UploadError, UploadNotFound, UploadSession, clean_expired_sessions, parse_content_range
+from django_web_utils.file_browser.views_action import clean_file_name
+from django_web_utils.files_utils import get_size_display
+
+logger = logging.getLogger('djwutils.file_browser.views_upload')
+
+
+@config.view_decorator
+@require_http_methods(['POST'])
+def storage_upload(request, namespace=None):
+    """
+    Resumable upload creation view.
+    Required parameters: "path" (destination folder), "name" (file name) and "size" (file size in bytes).
+    The returned "url" must be used to send chunks (PUT with a "Content-Range" header),
+    to get the upload status (GET), to finalize the upload (POST) or to cancel it (DELETE).
+    """
+    path = request.POST.get('path', '').strip('/')
+    if '..' in path:
+        return JsonResponse(dict(error=_('Invalid base path.')), status=400)
+    name = clean_file_name(request.POST.get('name', ''))
+    if not name:
+        return JsonResponse(dict(error=_('Invalid name.')), status=400)
+    if name == '.htaccess':
+        name += '_'
+    try:
+        size = int(request.POST.get('size', ''))
+        if size < 0:
+            raise ValueError()
+    except ValueError:
+        return JsonResponse(dict(error=_('Invalid size.')), status=400)
+    max_size = config.get_uploads_max_size()
+    if max_size is not None and size > max_size:
+        return JsonResponse(dict(error=_('The file is too large (maximum size: %s).') % get_size_display(max_size)), status=400)
+
+    uploads_dir = config.get_uploads_dir(namespace)
+    clean_expired_sessions(uploads_dir, config.get_uploads_expiration())
+    session = UploadSession.create(uploads_dir, path, name, size, user_id=request.user.pk)
+    if namespace:
+        url = reverse('%s:file_browser_upload_session' % namespace, args=[session.id])
+    else:
+        url = reverse('file_browser_upload_session', args=[session.id])
+    return JsonResponse(dict(url=url, chunk_size=config.get_uploads_chunk_size(), **session.get_status()))
+
+
+@config.view_decorator
+@require_http_methods(['GET', 'PUT', 'POST', 'DELETE'])
+def storage_upload_session(request, upload_id, namespace=None):
+    """
+    Resumable upload session view.
+    """
+    session = UploadSession.load(config.get_uploads_dir(namespace), upload_id)
+    if not session or session.info['user'] != request.user.pk:
+        return JsonResponse(dict(error=_('Upload not found.')), status=404)
+
+    if request.method == 'PUT':
+        try:
+            start, end, total = parse_content_range(request.META.get('HTTP_CONTENT_RANGE'))
+            if total != session.size:
+                raise UploadError('The size in "Content-Range" header does not match the upload size.')
+            session.write(start, end, request)
+        except UploadNotFound as e:
+            return JsonResponse(dict(error=str(e)), status=404)
+        except UploadError as e:
+            return JsonResponse(dict(error=str(e), **session.get_status()), status=400)
+        return JsonResponse(session.get_status())
+
+    elif request.method == 'DELETE':
+        session.delete()
+        return JsonResponse(dict(message=_('Upload canceled.')))
+
+    elif request.method == 'POST':
+        return finalize_upload(session, namespace)
+
+    return JsonResponse(session.get_status())
+
+
+def finalize_upload(session, namespace):
+    if not session.complete:
+        return JsonResponse(dict(error=_('The upload is not complete.'), **session.get_status()), status=400)
+    # Antivirus check (the file is removed if infected)
+    try:
+        antivirus_file_validator(session.data_path)
+    except ValidationError as e:
+        session.delete()
+        return JsonResponse(dict(error=str(e)), status=400)
+
+    base_path = config.get_base_path(namespace)
+    path = session.info['path']
+    name = session.info['name']
+    dir_path = os.path.join(base_path, path) if path else base_path
+    try:
+        os.makedirs(dir_path, exist_ok=True)
+        file_path = os.path.join(dir_path, name)
+        try:
+            # No copy if the uploads dir is on the same file system
+            os.replace(session.data_path, file_path)
+        except OSError:
+            shutil.move(session.data_path, file_path)
+    except Exception as e:
+        return JsonResponse(dict(error='%s %s' % (_('Failed to move uploaded file:'), e)), status=400)
+    session.delete()
+    update_search_index(namespace, added=[os.path.join(path, name)])
+
+    base_url = config.get_base_url(namespace)
+    url = base_url + '/' + (path + '/' if path else '') + name
+    msg = _('The file has been uploaded and is available at the location:')
+    return JsonResponse(dict(message=msg, urls=[url]))
@@ -115,6 +115,46 @@ def reverse_read(path: str | Path, buf_size: int = 8192) -> Iterator:
         yield None
 
 
+def tail_lines(
+    path: str | Path, n: int = 10, max_bytes: int | None = 10485760, end: int | None = None, buf_size: int = 65536
+) -> tuple[bytes, int, int]:
+    """
+    Function to read the last lines of a file without reading it completely.
+    The `end` argument can be used to get the lines before an offset of the file (to read older lines for example).
+    At most `max_bytes` bytes are read, so the first line returned can be incomplete if lines are very long.
+    Returns the data read (not decoded), the offset of its start and the offset of its end in the file.
+    """
+    with open(path, 'rb') as fh:
+        size = os.fstat(fh.fileno()).st_size
+        end = size if end is None else min(max(end, 0), size)
+        limit = max(end - max_bytes, 0) if max_bytes else 0
+        if n <= 0 or end == limit:
+            return b'', end, end
+        segments = []
+        position = end
+        # The line break at the end of the last line is not a lines separator
+        fh.seek(end - 1)
+        needed = n + 1 if fh.read(1) == b'\n' else n
+        start = limit
+        while position > limit:
+            read_size = min(buf_size, position - limit)
+            position -= read_size
+            fh.seek(position)
+            segment = fh.read(read_size)
+            segments.append(segment)
+            count = segment.count(b'\n')
+            if count >= needed:
+                index = len(segment)
+                for _i in range(needed):
+                    index = segment.rfind(b'\n', 0, index)
+                start = position + index + 1
+                break
+            needed -= count
+    segments.reverse()
+    data = b''.join(segments)
+    return data[start - position:], start, end
+
+
 def backup_file(file_path: Path, max_backups: int = 10) -> Optional[Path]:
     """
     Make a backup copy of a file.
@@ -1,6 +1,11 @@
+import datetime
+import gzip
 import logging
+import logging.handlers
 import os
 import re
+import shutil
+import time
 import traceback
 
 try:
@@ -80,6 +85,56 @@ def get_generic_logging_config(logs_dir, debug):
     return logging_config
 
 
+class RotatingCompressedFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    File handler with size and time based rotation and compression of rotated files.
+    The "interval" argument can be a number of seconds or "midnight".
+    Rotated files are named `<file>.1.gz`, `<file>.2.gz`, etc (without ".gz" if compression is disabled).
+    If "redirect_std" is enabled, standard outputs are redirected to the new file after each rotation
+    (useful when standard outputs were redirected to the log file at daemonization).
+    """
+
+    def __init__(self, filename, max_bytes=0, interval=None, backup_count=5, compress=True, redirect_std=False, **kwargs):
+        super().__init__(filename, maxBytes=max_bytes or 0, backupCount=backup_count, **kwargs)
+        self.interval = interval
+        self.redirect_std = redirect_std
+        if compress:
+            self.namer = self._get_compressed_name
+            self.rotator = self._compress
+        self.rollover_at = self._compute_rollover(time.time())
+
+    @staticmethod
+    def _get_compressed_name(name):
+        return name + '.gz'
+
+    @staticmethod
+    def _compress(source, dest):
+        with open(source, 'rb') as src, gzip.open(dest, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(source)
+
+    def _compute_rollover(self, now):
+        if not self.interval:
+            return None
+        if self.interval == 'midnight':
+            tomorrow = datetime.date.fromtimestamp(now) + datetime.timedelta(days=1)
+            return datetime.datetime.combine(tomorrow, datetime.time()).timestamp()
+        return now + self.interval
+
+    def shouldRollover(self, record):
+        if self.rollover_at is not None and time.time() >= self.rollover_at:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self.rollover_at = self._compute_rollover(time.time())
+        if self.redirect_std and self.stream:
+            self.stream.flush()
+            os.dup2(self.stream.fileno(), 1)
+            os.dup2(self.stream.fileno(), 2)
+
+
 class IgnoreTimeoutErrors(logging.Filter):
 
     def filter(self, record):
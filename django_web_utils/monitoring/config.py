@@ -19,6 +19,18 @@ TEMPLATE_DATA = getattr(settings, 'MONITORING_TEMPLATE_DATA', None)
 DATE_ADJUST_FCT = getattr(settings, 'MONITORING_DATE_ADJUST_FCT', None)
 
 
+def get_status_cache_ttl():
+    return getattr(settings, 'MONITORING_STATUS_CACHE_TTL', 2)
+
+
+def get_events_enabled():
+    return getattr(settings, 'MONITORING_EVENTS_ENABLED', False)
+
+
+def get_events_timeout():
+    return getattr(settings, 'MONITORING_EVENTS_TIMEOUT', 300)
+
+
 def get_daemons_info():
     if '_daemons_info' not in globals():
         cleaned_info = _Info()
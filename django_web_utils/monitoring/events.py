@@ -0,0 +1,121 @@
+"""
+Daemons status events
+A single collector thread checks the daemons states and the events views only send the changes to the panels.
+The collector is started by the first connected panel and stops when no panel is connected anymore.
+"""
+import contextlib
+import json
+import logging
+import threading
+import time
+# Django
+from django.core.serializers.json import DjangoJSONEncoder
+# Django web utils
+from django_web_utils.monitoring import config, utils
+
+logger = logging.getLogger('djwutils.monitoring.events')
+
+# Minimum number of seconds between two collections
+MIN_INTERVAL = 0.5
+# Maximum number of seconds without data sent to the client
+KEEPALIVE_INTERVAL = 15
+# Delay before the reconnection of the browser when a stream ends (in milliseconds)
+RETRY_DELAY = 1000
+
+
+def get_state_signature(state):
+    """
+    Get the part of a daemon state which is displayed in the panel
+    (changes in the heartbeat age or in the counters are not considered).
+    The status of a daemon with a pid file which cannot be read is checked again when its pid file is modified.
+    """
+    metrics = state['metrics']
+    return (
+        state['running'],
+        state['unreadable'],
+        state['pid_stat'],
+        state['log_stat'],
+        (metrics['pid'], metrics['stale']) if metrics else None,
+    )
+
+
+class StatusCollector:
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.version = 0
+        self.signatures = {}
+        self.subscribers = 0
+        self.thread = None
+
+    @contextlib.contextmanager
+    def subscribe(self):
+        with self.condition:
+            self.subscribers += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='djwutils-monitoring-collector', daemon=True)
+                self.thread.start()
+        try:
+            yield self
+        finally:
+            with self.condition:
+                self.subscribers -= 1
+
+    def _run(self):
+        while True:
+            with self.condition:
+                if not self.subscribers:
+                    self.thread = None
+                    return
+            info = config.get_daemons_info()
+            try:
+                states = utils.collect_daemons_states([info.DAEMONS[name] for name in info.DAEMONS_NAMES])
+            except Exception as err:
+                logger.error('Failed to collect daemons states: %s', err, exc_info=True)
+            else:
+                signatures = {name: get_state_signature(state) for name, state in states.items()}
+                with self.condition:
+                    if signatures != self.signatures:
+                        self.signatures = signatures
+                        self.version += 1
+                        self.condition.notify_all()
+            time.sleep(max(config.get_status_cache_ttl(), MIN_INTERVAL))
+
+    def wait(self, version, timeout):
+        """
+        Wait until the states are different from the given version.
+        Returns the current version and the signatures of the daemons states.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.version != version, timeout)
+            return self.version, self.signatures
+
+
+collector = StatusCollector()
+
+
+def iter_status_events(request, daemons, date_adjust_fct=None):
+    """
+    Generate the server-sent events of the daemons statuses.
+    The statuses of all daemons are sent in the first event, the next events only contain the changed statuses.
+    The stream ends after `MONITORING_EVENTS_TIMEOUT` seconds (the browser then reconnects).
+    """
+    deadline = time.monotonic() + config.get_events_timeout()
+    sent = {}
+    version = -1
+    yield 'retry: %s\n\n' % RETRY_DELAY
+    with collector.subscribe():
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            new_version, signatures = collector.wait(version, timeout=min(remaining, KEEPALIVE_INTERVAL))
+            if new_version == version:
+                yield ': keepalive\n\n'
+                continue
+            version = new_version
+            changed = [daemon for daemon in daemons if daemon['name'] in signatures and signatures[daemon['name']] != sent.get(daemon['name'])]
+            if changed:
+                data = utils.get_daemons_status(request, changed, date_adjust_fct=date_adjust_fct)
+                for daemon in changed:
+                    sent[daemon['name']] = signatures[daemon['name']]
+                yield 'event: status\ndata: %s\n\n' % json.dumps(data, cls=DjangoJSONEncoder)
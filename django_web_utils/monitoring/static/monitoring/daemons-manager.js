@@ -12,6 +12,7 @@ function DaemonsManager (options) {
     this.daemons = []; // list of dict with at least a name attr
     this.commandsURL = '';
     this.statusURL = '';
+    this.eventsURL = '';
     this.pwdURL = '';
     // vars
     this.daemons = {};
@@ -22,6 +23,7 @@ function DaemonsManager (options) {
         'daemons',
         'commandsURL',
         'statusURL',
+        'eventsURL',
         'pwdURL'
     ]);
 
@@ -48,9 +50,17 @@ DaemonsManager.prototype.init = function () {
         if (restartBtn) {
             restartBtn.addEventListener('click', this.sendDaemonCommand.bind(this, daemon, 'restart'));
         }
+        const reloadBtn = document.querySelector('.daemon-' + daemon.name + ' .daemon-reload');
+        if (reloadBtn) {
+            reloadBtn.addEventListener('click', this.sendDaemonCommand.bind(this, daemon, 'reload'));
+        }
     }
 
-    new PollingManager(this.refreshDaemons.bind(this), this.refreshDelay);
+    if (this.eventsURL && window.EventSource) {
+        this.listenDaemons();
+    } else {
+        new PollingManager(this.refreshDaemons.bind(this), this.refreshDelay);
+    }
 };
 
 DaemonsManager.prototype.sendDaemonCommand = function (daemon, cmd) {
@@ -99,6 +109,8 @@ DaemonsManager.prototype._sendDaemonCommand = function (daemon, cmd) {
                     { label: gettext('Close'), close: true }
                 ]
             });
+            // Display the new state without waiting for the next refresh
+            obj.refreshDaemons(function () {});
         }
     });
 };
@@ -122,16 +134,38 @@ DaemonsManager.prototype.refreshDaemons = function (notifyEnd) {
     });
 };
 
+DaemonsManager.prototype.listenDaemons = function () {
+    const obj = this;
+    const source = new EventSource(this.eventsURL);
+    source.addEventListener('status', function (event) {
+        const response = JSON.parse(event.data);
+        for (const name in response) {
+            obj.updateDaemonData(name, response[name]);
+        }
+    });
+    source.addEventListener('error', function () {
+        // The browser reconnects automatically unless the stream could not be opened
+        if (source.readyState === EventSource.CLOSED) {
+            console.error('Failed to open daemons status stream, polling status instead.');
+            new PollingManager(obj.refreshDaemons.bind(obj), obj.refreshDelay);
+        }
+    });
+};
+
 DaemonsManager.prototype.updateDaemonData = function (name, data) {
     if (!(name in this.daemons)) {
         this.daemons[name] = {};
     }
     const stored = this.daemons[name];
     const running = data.running;
-    if (running !== stored.running) {
+    const stalled = Boolean(data.metrics && data.metrics.stale);
+    if (running !== stored.running || stalled !== stored.stalled) {
         stored.running = running;
+        stored.stalled = stalled;
         const statusEle = document.querySelector('.daemon-' + name + ' .daemon-status');
-        if (running === true) {
+        if (running === true && stalled) {
+            statusEle.innerHTML = '<span class="yellow">' + jsu.escapeHTML(gettext('stalled')) + '</span>';
+        } else if (running === true) {
             statusEle.innerHTML = '<span class="green">' + jsu.escapeHTML(gettext('running')) + '</span>';
         } else if (running === false) {
             statusEle.innerHTML = '<span class="red">' + jsu.escapeHTML(gettext('not running')) + '</span>';
@@ -141,6 +175,14 @@ DaemonsManager.prototype.updateDaemonData = function (name, data) {
                 jsu.escapeHTML(gettext('unknown')) + '</span>';
         }
     }
+    const metricsText = data.metrics ? this.getMetricsText(data.metrics) : '';
+    if (metricsText !== stored.metricsText) {
+        stored.metricsText = metricsText;
+        const statusEle = document.querySelector('.daemon-' + name + ' .daemon-status');
+        if (statusEle) {
+            statusEle.title = metricsText;
+        }
+    }
     const logMTime = data.log_mtime;
     if (logMTime !== stored.logMTime) {
         stored.logMTime = logMTime;
@@ -158,3 +200,18 @@ DaemonsManager.prototype.updateDaemonData = function (name, data) {
         }
     }
 };
+
+DaemonsManager.prototype.getMetricsText = function (metrics) {
+    const lines = [
+        gettext('Last heartbeat:') + ' ' + (metrics.heartbeat || '-') + ' (' + metrics.heartbeat_age + ' s)',
+        gettext('Iterations:') + ' ' + metrics.iterations,
+        gettext('Processed items:') + ' ' + metrics.items
+    ];
+    for (const counter in metrics.counters) {
+        lines.push(counter + ': ' + metrics.counters[counter]);
+    }
+    if (metrics.last_error) {
+        lines.push(gettext('Last error:') + ' ' + metrics.last_error_at + ' ' + metrics.last_error);
+    }
+    return lines.join('\n');
+};
@@ -0,0 +1,90 @@
+/*******************************************
+* Log follower                             *
+*******************************************/
+/* global gettext */
+/* global jsu */
+
+function LogFollower (options) {
+    // params
+    this.url = '';
+    this.offset = 0;
+    this.inode = null;
+    this.refreshDelay = 2000;
+    // vars
+    this.following = false;
+    this.timeout = null;
+
+    jsu.setObjectAttributes(this, options, [
+        // allowed options
+        'url',
+        'offset',
+        'inode',
+        'refreshDelay'
+    ]);
+
+    jsu.onDOMLoad(this.init.bind(this));
+}
+
+LogFollower.prototype.init = function () {
+    this.contentEle = document.querySelector('.log-block');
+    const followEle = document.getElementById('log_follow');
+    if (!this.contentEle || !followEle) {
+        return;
+    }
+    followEle.addEventListener('change', this.setFollowing.bind(this, followEle));
+    this.setFollowing(followEle);
+};
+
+LogFollower.prototype.setFollowing = function (followEle) {
+    this.following = followEle.checked;
+    if (this.timeout) {
+        clearTimeout(this.timeout);
+        this.timeout = null;
+    }
+    if (this.following) {
+        this.refresh();
+    }
+};
+
+LogFollower.prototype.refresh = function () {
+    const obj = this;
+    const params = { offset: this.offset };
+    if (this.inode) {
+        params.inode = this.inode;
+    }
+    jsu.httpRequest({
+        method: 'GET',
+        url: this.url,
+        params: params,
+        json: true,
+        callback: function (req, response) {
+            if (req.status != 200) {
+                console.error('Failed to get log file updates.', req);
+            } else {
+                obj.addContent(response);
+            }
+            if (obj.following) {
+                obj.timeout = setTimeout(obj.refresh.bind(obj), obj.refreshDelay);
+            }
+        }
+    });
+};
+
+LogFollower.prototype.addContent = function (response) {
+    // Scroll to the end only if the end of the page is displayed
+    const atBottom = window.innerHeight + window.scrollY >= document.body.scrollHeight - 10;
+    if (response.reset) {
+        this.contentEle.textContent = '';
+    }
+    if (response.skipped) {
+        this.contentEle.appendChild(document.createTextNode('\n[' + gettext('Some content has been skipped.') + ']\n'));
+    }
+    if (response.content) {
+        this.contentEle.appendChild(document.createTextNode(response.content));
+    }
+    this.offset = response.offset;
+    this.inode = response.inode;
+    if (atBottom && (response.reset || response.content)) {
+        window.scrollTo(0, document.body.scrollHeight);
+    }
+};
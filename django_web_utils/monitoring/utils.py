@@ -1,21 +1,36 @@
+import codecs
 import datetime
 import logging
+import os
 import stat
 import sys
+import threading
+import time
 from pathlib import Path
 
 from django.contrib import messages
-from django.http import FileResponse, HttpResponseRedirect
+from django.http import FileResponse, HttpResponseRedirect, JsonResponse
 from django.utils.http import http_date
 from django.utils.translation import gettext as _
 
 from django_web_utils import files_utils
 from django_web_utils import system_utils
 from django_web_utils.daemon.base import BaseDaemon
+from django_web_utils.daemon.metrics import read_metrics
+from django_web_utils.monitoring import config
 
 logger = logging.getLogger('djwutils.monitoring.utils')
 
 FILE_SIZE_LIMIT = 524288000  # 500 MB
+# Numbers of lines which can be displayed in the log file tail
+LOG_TAIL_LINES = (250, 1000, 10000)
+# Maximum size of the data read to display the log file tail
+LOG_TAIL_MAX_SIZE = 10485760  # 10 MB
+# Maximum size of the data returned when following a log file
+LOG_UPDATE_MAX_SIZE = 262144  # 256 KB
+
+_status_cache = {}
+_status_lock = threading.Lock()
 
 
 def clear_log(path):
@@ -29,7 +44,7 @@ def clear_log(path):
 
 
 def execute_daemon_command(request, daemon, command):
-    if command not in ('start', 'restart', 'stop', 'clear_log'):
+    if command not in ('start', 'restart', 'reload', 'stop', 'clear_log'):
         return False, _('Invalid command.')
     cls = daemon.get('cls')
     if cls and not issubclass(cls, BaseDaemon):
@@ -42,7 +57,9 @@ def execute_daemon_command(request, daemon, command):
             log_path = cls.get_log_path()
         if not log_path:
             return False, _('No valid target for command.')
-        return clear_log(log_path)
+        result = clear_log(log_path)
+        clear_status_cache(daemon['name'])
+        return result
     elif not cls:
         return False, _('No valid target for command.')
 
@@ -56,52 +73,185 @@ def execute_daemon_command(request, daemon, command):
 
     cmd = f'python3 "{path}" {command}'
     success, output = system_utils.execute_command(cmd, user='root' if is_root else 'self', request=request)
+    # The state of the daemon changed, it should not be read from the cache
+    clear_status_cache(daemon['name'])
     if not output:
         output = 'No output from command.'
     return success, output
 
 
-def get_daemon_status(request, daemon, date_adjust_fct=None):
+def _get_date_display(timestamp, date_adjust_fct=None):
+    date = datetime.datetime.fromtimestamp(timestamp)
+    if date_adjust_fct:
+        date = date_adjust_fct(date)
+    return date.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _format_metrics(metrics, date_adjust_fct=None):
+    metrics = dict(metrics)
+    for key in ('started_at', 'heartbeat', 'last_error_at'):
+        if metrics[key]:
+            metrics[key] = _get_date_display(metrics[key], date_adjust_fct)
+    metrics['heartbeat_age'] = round(metrics['heartbeat_age'], 1)
+    return metrics
+
+
+def get_daemon_metrics(path, date_adjust_fct=None):
+    metrics = read_metrics(path)
+    if not metrics:
+        return None
+    return _format_metrics(metrics, date_adjust_fct)
+
+
+def _get_daemon_paths(daemon):
+    metrics_path = None
     if daemon.get('cls'):
         pid_path = daemon['cls'].get_pid_path()
         log_path = daemon['cls'].get_log_path()
+        metrics_path = daemon['cls'].get_metrics_path()
     else:
         pid_path = daemon.get('pid_path')
         log_path = daemon.get('log_path')
     if not log_path and daemon.get('only_conf'):
         log_path = daemon.get('conf_path')
-    is_root = daemon.get('is_root')
-    # Check if daemon is launched
-    need_password = False
+    return pid_path, log_path, metrics_path
+
+
+def _collect_daemon_state(daemon):
+    """
+    Get the state of a daemon without running any command.
+    The "running" value is None if the daemon has no pid file or if its pid file cannot be read by the current user.
+    The modification time of a pid file which cannot be read is in "pid_stat" (it changes when the daemon restarts).
+    """
+    pid_path, log_path, metrics_path = _get_daemon_paths(daemon)
+    state = dict(pid_path=pid_path, unreadable=False, running=None, pid_stat=None, log_stat=None, metrics=None)
     if pid_path:
-        if system_utils.is_pid_running(pid_path, user='self', request=request):
-            running = True
-        elif not is_root:
-            running = False
+        try:
+            pid = system_utils.read_pid_file(pid_path)
+        except PermissionError:
+            state['unreadable'] = True
+            try:
+                state['pid_stat'] = Path(pid_path).stat().st_mtime_ns
+            except OSError:
+                pass
         else:
-            if not request.session.get('pwd'):
-                running = None
-                need_password = True
-            elif system_utils.is_pid_running(pid_path, user='root', request=request):
-                running = True
+            state['running'] = bool(pid) and system_utils.is_process_alive(pid)
+    if log_path:
+        try:
+            statobj = Path(log_path).stat()
+        except OSError:
+            pass
+        else:
+            state['log_stat'] = (statobj.st_size, statobj.st_mtime)
+    # Get heartbeat and counters (only for daemons based on BaseDaemon which are not stopped)
+    if metrics_path and state['running'] is not False:
+        state['metrics'] = read_metrics(metrics_path)
+    return state
+
+
+def collect_daemons_states(daemons):
+    """
+    Get the states of several daemons in a single pass.
+    States are shared by all requests during `MONITORING_STATUS_CACHE_TTL` seconds,
+    so the cost of the status polling does not depend on the number of viewers.
+    """
+    ttl = config.get_status_cache_ttl()
+    now = time.monotonic()
+    states = {}
+    with _status_lock:
+        for daemon in daemons:
+            cached = _status_cache.get(daemon['name'])
+            if cached and now - cached[0] < ttl:
+                state = cached[1]
             else:
+                state = _collect_daemon_state(daemon)
+                _status_cache[daemon['name']] = (now, state)
+            states[daemon['name']] = state
+    return states
+
+
+def clear_status_cache(name=None):
+    """
+    Remove the cached state of a daemon (or of all daemons if no name is given).
+    """
+    with _status_lock:
+        if name is None:
+            _status_cache.clear()
+        else:
+            _status_cache.pop(name, None)
+
+
+def get_daemons_status(request, daemons, date_adjust_fct=None):
+    """
+    Get the statuses of several daemons.
+    A command is only run (with sudo) for daemons running as root which have a pid file
+    that cannot be read by the current user. The result of this command depends on the password of the request session,
+    so it is not stored in the shared states.
+    """
+    states = collect_daemons_states(daemons)
+    statuses = {}
+    for daemon in daemons:
+        state = states[daemon['name']]
+        running = state['running']
+        need_password = False
+        if state['unreadable']:
+            if not daemon.get('is_root'):
                 running = False
-    else:
-        running = None
-    # Get log file properties
-    size = mtime = ''
-    if log_path and log_path.exists():
-        statobj = log_path.stat()
-        size = files_utils.get_size_display(statobj.st_size)
-        mtime = datetime.datetime.fromtimestamp(statobj.st_mtime)
-        if date_adjust_fct:
-            mtime = date_adjust_fct(mtime)
-        mtime = mtime.strftime('%Y-%m-%d %H:%M:%S')
+            elif not request.session.get('pwd'):
+                need_password = True
+            else:
+                running = system_utils.is_pid_running(state['pid_path'], user='root', request=request)
+        # Get log file properties
+        size = mtime = ''
+        if state['log_stat']:
+            size = files_utils.get_size_display(state['log_stat'][0])
+            mtime = _get_date_display(state['log_stat'][1], date_adjust_fct)
+        status = dict(
+            running=running,
+            need_password=need_password,
+            log_size=size,
+            log_mtime=mtime,
+        )
+        if state['metrics'] and running is not False:
+            status['metrics'] = _format_metrics(state['metrics'], date_adjust_fct)
+        statuses[daemon['name']] = status
+    return statuses
+
+
+def get_daemon_status(request, daemon, date_adjust_fct=None):
+    return get_daemons_status(request, [daemon], date_adjust_fct=date_adjust_fct)[daemon['name']]
+
+
+def read_log_updates(path, offset, inode=None, max_size=LOG_UPDATE_MAX_SIZE):
+    """
+    Read the data appended to a log file since the given offset (like "tail -f").
+    The file is read from its start if it has been truncated or replaced (rotation is detected with the inode).
+    Only the last `max_size` bytes are read if more data has been appended.
+    Returns a dict with the appended text, the offset and the inode to use for the next call,
+    "reset" if the previously read content is obsolete and "skipped" if some data has not been read.
+    """
+    try:
+        fo = open(path, 'rb')
+    except FileNotFoundError:
+        return dict(content='', offset=0, inode=None, reset=offset > 0, skipped=False)
+    with fo:
+        statobj = os.fstat(fo.fileno())
+        reset = bool(inode and statobj.st_ino != inode) or statobj.st_size < offset
+        if reset:
+            offset = 0
+        start = max(offset, statobj.st_size - max_size)
+        fo.seek(start)
+        data = fo.read(statobj.st_size - start)
+    # Incomplete characters at the end are read in the next call
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    content = decoder.decode(data)
+    pending = decoder.getstate()[0]
     return dict(
-        running=running,
-        need_password=need_password,
-        log_size=size,
-        log_mtime=mtime,
+        content=content,
+        offset=start + len(data) - len(pending),
+        inode=statobj.st_ino,
+        reset=reset,
+        skipped=start > offset,
     )
 
 
@@ -115,10 +265,39 @@ def log_view(request, path=None, tail=None, owner='user', date_adjust_fct=None):
             messages.error(request, message)
         return HttpResponseRedirect(request.get_full_path())
 
+    # Get data appended since the given offset
+    if 'offset' in request.GET:
+        try:
+            offset = int(request.GET['offset'])
+            inode = int(request.GET.get('inode') or 0) or None
+        except ValueError:
+            offset = -1
+        if offset < 0:
+            return JsonResponse(dict(error=_('Invalid offset.')), status=400)
+        if not path:
+            return JsonResponse(dict(error=_('This daemon has no log file.')), status=400)
+        try:
+            return JsonResponse(read_log_updates(path, offset, inode))
+        except OSError as err:
+            return JsonResponse(dict(error='%s %s' % (_('Unable to read log file.'), err)), status=400)
+
     # Prepare display
     content = size = mtime = ''
     lines = 0
+    offset = 0
+    inode = None
     tail_only = 'tail' in request.GET if tail is None else tail
+    try:
+        tail_lines = int(request.GET.get('lines', LOG_TAIL_LINES[0]))
+    except ValueError:
+        tail_lines = LOG_TAIL_LINES[0]
+    if tail_lines not in LOG_TAIL_LINES:
+        tail_lines = LOG_TAIL_LINES[0]
+    try:
+        before = int(request.GET['before']) if tail_only and request.GET.get('before') else None
+    except ValueError:
+        before = None
+    older_offset = None
     if path and path.exists():
         try:
             statobj = path.stat()
@@ -130,18 +309,17 @@ def log_view(request, path=None, tail=None, owner='user', date_adjust_fct=None):
                     response['Content-Length'] = statobj.st_size
                 return response
             size = files_utils.get_size_display(statobj.st_size)
+            offset = statobj.st_size
+            inode = statobj.st_ino
             if tail_only:
-                # Read only file end
-                content = b''
-                for segment in files_utils.reverse_read(path):
-                    if segment is None:
-                        break
-                    content = segment + content
-                    lines += segment.count(b'\n')
-                    if lines > 250:
-                        content = b'...%s' % content[content.index(b'\n'):]
-                        break
-                content = content.decode('utf-8')
+                # Read only file end (or the lines before the given offset)
+                data, start, end = files_utils.tail_lines(path, tail_lines, max_bytes=LOG_TAIL_MAX_SIZE, end=before)
+                content = data.decode('utf-8', 'replace')
+                lines = content.count('\n')
+                if start > 0:
+                    content = '...\n%s' % content
+                    older_offset = start
+                offset = end
             else:
                 if statobj.st_size > FILE_SIZE_LIMIT:
                     content = _('File too large: %s.\nOnly file tail and raw file are accessible.\nWarning: getting the raw file can saturate system memory.') % size
@@ -159,6 +337,19 @@ def log_view(request, path=None, tail=None, owner='user', date_adjust_fct=None):
     query_string = request.META.get('QUERY_STRING')
     if query_string and 'tail' in query_string:
         query_string = query_string.replace('&tail', '').replace('tail', '')
+    # Links to change the number of lines and to see older lines
+    params = request.GET.copy()
+    for key in ('tail', 'lines', 'before', 'offset', 'inode', 'raw'):
+        params.pop(key, None)
+    tail_links = []
+    for count in LOG_TAIL_LINES:
+        params['lines'] = count
+        tail_links.append(dict(lines=count, url='?%s&tail' % params.urlencode(), selected=count == tail_lines))
+    older_url = None
+    if older_offset:
+        params['lines'] = tail_lines
+        params['before'] = older_offset
+        older_url = '?%s&tail' % params.urlencode()
     return {
         'content': content,
         'size': size,
@@ -167,6 +358,12 @@ def log_view(request, path=None, tail=None, owner='user', date_adjust_fct=None):
         'owner': owner,
         'bottom_bar': bottom_bar,
         'tail': tail_only,
+        'tail_links': tail_links,
+        'older_url': older_url,
+        # New lines can only be followed if the end of the file is displayed
+        'can_follow': before is None,
+        'offset': offset,
+        'inode': inode,
         'query_string': query_string,
     }
 
@@ -4,13 +4,14 @@ import socket
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import PermissionDenied
 from django.urls import reverse
-from django.http import JsonResponse, Http404
+from django.http import JsonResponse, Http404, StreamingHttpResponse
 from django.shortcuts import render
 from django.utils.translation import gettext as _
+from django.views.decorators.http import require_GET
 
 from django_web_utils import json_utils
 from django_web_utils import system_utils
-from django_web_utils.monitoring import config, utils
+from django_web_utils.monitoring import config, events, utils
 
 logger = logging.getLogger('djwutils.monitoring.views')
 
@@ -50,6 +51,8 @@ def monitoring_panel(request):
             if config.can_access_daemon(member, request):
                 daemon = dict(member)
                 daemon['show_controls'] = config.can_control_daemon(member, request)
+                # Only daemons based on BaseDaemon handle configuration reload
+                daemon['can_reload'] = bool(member.get('cls'))
                 if daemon['show_controls']:
                     show_top_controls = True
                 group['daemons'].append(daemon)
@@ -65,6 +68,7 @@ def monitoring_panel(request):
         monitoring_namespace=config.NAMESPACE,
         daemons_groups=groups,
         show_top_controls=show_top_controls,
+        events_enabled=config.get_events_enabled(),
         hostname=socket.gethostname(),
     ))
     return render(request, tplt, tplt_data)
@@ -80,15 +84,38 @@ def monitoring_status(request):
     else:
         targets = info.DAEMONS_NAMES
     date_adjust_fct = config.DATE_ADJUST_FCT(request) if config.DATE_ADJUST_FCT else None
-    data = {}
+    daemons = []
     for name in targets:
         daemon = info.DAEMONS[name]
         if not config.can_access_daemon(daemon, request):
             raise PermissionDenied()
-        data[name] = utils.get_daemon_status(request, daemon, date_adjust_fct=date_adjust_fct)
+        daemons.append(daemon)
+    data = utils.get_daemons_status(request, daemons, date_adjust_fct=date_adjust_fct)
     return JsonResponse(data)
 
 
+@login_required
+@require_GET
+def monitoring_events(request):
+    """
+    Stream of the daemons statuses changes (server-sent events).
+    The stream is only available if `MONITORING_EVENTS_ENABLED` is set.
+    """
+    if not config.get_events_enabled():
+        raise Http404()
+    info = config.get_daemons_info()
+    daemons = [info.DAEMONS[name] for name in info.DAEMONS_NAMES if config.can_access_daemon(info.DAEMONS[name], request)]
+    if not daemons:
+        raise PermissionDenied()
+    date_adjust_fct = config.DATE_ADJUST_FCT(request) if config.DATE_ADJUST_FCT else None
+    response = StreamingHttpResponse(
+        events.iter_status_events(request, daemons, date_adjust_fct=date_adjust_fct), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Disable the buffering of nginx
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 @json_utils.json_view(methods='POST')
 @login_required
 def monitoring_command(request):
@@ -111,11 +111,53 @@ def execute_command(cmd, user='self', pwd=None, request=None, is_root=False):
 # is_pid_running
 # ----------------------------------------------------------------------------
 def is_pid_running(pid_file_path, user='self', request=None):
-    success, output = execute_command(f'cat "{pid_file_path}"', user=user, request=request)
-    if success:
-        cmd = f'ps -p {output.strip()}'
-        success, output = execute_command(cmd, user=user, request=request)
-    return success
+    try:
+        pid = read_pid_file(pid_file_path)
+    except PermissionError:
+        if user == 'self':
+            return False
+        # The pid file can only be read by the given user
+        success, output = execute_command(f'cat "{pid_file_path}"', user=user, request=request)
+        output = output.strip()
+        pid = int(output) if success and output.isdigit() else None
+    return bool(pid) and is_process_alive(pid)
+
+
+# read_pid_file
+# ----------------------------------------------------------------------------
+def read_pid_file(pid_file_path):
+    """
+    Get the pid written in a pid file.
+    Returns None if the file does not exist or does not contain a valid pid.
+    Raises `PermissionError` if the file cannot be read by the current user.
+    """
+    try:
+        content = Path(pid_file_path).read_text().strip()
+    except PermissionError:
+        raise
+    except (OSError, ValueError):
+        return None
+    if not content.isdigit() or int(content) <= 0:
+        return None
+    return int(content)
+
+
+# is_process_alive
+# ----------------------------------------------------------------------------
+def is_process_alive(pid):
+    """
+    Check if a process exists without running any command (signal 0 is only a check).
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # The process exists but belongs to another user
+        return True
+    except (OSError, OverflowError):
+        return False
+    return True
 
 
 # is_process_running
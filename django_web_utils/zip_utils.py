@@ -1,9 +1,20 @@
 """
 Zip utility functions
 """
+import io
+import logging
 import os
 import zipfile
 
+logger = logging.getLogger('djwutils.zip_utils')
+
+STREAM_READ_SIZE = 1024 * 1024
+# Files with these extensions are already compressed, they are stored as is in streamed zips
+COMPRESSED_EXTENSIONS = {
+    '7z', 'aac', 'avi', 'bz2', 'docx', 'flac', 'gif', 'gz', 'jpeg', 'jpg', 'm4a', 'm4v', 'mkv', 'mov', 'mp3', 'mp4',
+    'odp', 'ods', 'odt', 'ogg', 'ogv', 'png', 'pptx', 'rar', 'tgz', 'webm', 'webp', 'xlsx', 'xz', 'zip', 'zst',
+}
+
 
 def _add_to_zip(zip_file, path, ignored=None, path_in_zip=None):
     for name in os.listdir(path):
@@ -74,3 +85,90 @@ def unzip(path, zip_path=None, zip_file=None):
     finally:
         if not zip_file:
             used_zip_file.close()
+
+
+class _StreamSink(io.RawIOBase):
+    """
+    Unseekable file object collecting the data written in it.
+    Because it is not seekable, `zipfile` writes data descriptors after each member instead of seeking back to
+    update the local headers.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _iter_zip_members(paths, ignored=None):
+    for path, path_in_zip in paths:
+        if os.path.isdir(path):
+            yield path, path_in_zip + '/'
+            for dir_path, dir_names, file_names in os.walk(path):
+                if ignored:
+                    dir_names[:] = [name for name in dir_names if name not in ignored]
+                rel_dir = os.path.relpath(dir_path, path)
+                prefix = path_in_zip if rel_dir == '.' else path_in_zip + '/' + rel_dir.replace(os.sep, '/')
+                for name in sorted(dir_names):
+                    yield os.path.join(dir_path, name), prefix + '/' + name + '/'
+                for name in sorted(file_names):
+                    if not ignored or name not in ignored:
+                        yield os.path.join(dir_path, name), prefix + '/' + name
+        else:
+            yield path, path_in_zip
+
+
+def stream_zip(paths, store=False, ignored=None, read_size=STREAM_READ_SIZE):
+    """
+    Generate the content of a zip archive of files and dirs without writing it on disk.
+    `paths` is an iterable of tuples (path, path in zip), dirs are added with their content.
+    Members are read by chunks of `read_size` bytes and never fully loaded in memory, ZIP64 extensions are used
+    for big files. If `store` is true, files are not compressed (already compressed files are never compressed).
+    Files which cannot be opened are skipped. If a file cannot be read once its member has been started,
+    the member cannot be removed from the data already sent, so the error is raised to abort the stream
+    (the download fails instead of giving a truncated file in an archive which looks valid).
+    """
+    sink = _StreamSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as zip_file:
+        for path, path_in_zip in _iter_zip_members(paths, ignored):
+            try:
+                zinfo = zipfile.ZipInfo.from_file(path, path_in_zip)
+                src = None if zinfo.is_dir() else open(path, 'rb')
+            except OSError as err:
+                logger.warning('Failed to add "%s" to streamed zip: %s', path, err)
+                continue
+            if src is None:
+                zip_file.writestr(zinfo, b'')
+            else:
+                ext = path_in_zip.rsplit('.', 1)[-1].lower() if '.' in path_in_zip else ''
+                if store or ext in COMPRESSED_EXTENSIONS:
+                    zinfo.compress_type = zipfile.ZIP_STORED
+                else:
+                    zinfo.compress_type = zipfile.ZIP_DEFLATED
+                try:
+                    with src, zip_file.open(zinfo, 'w', force_zip64=zinfo.file_size > zipfile.ZIP64_LIMIT / 2) as dst:
+                        while True:
+                            data = src.read(read_size)
+                            if not data:
+                                break
+                            dst.write(data)
+                            if sink.chunks:
+                                yield sink.pop()
+                except OSError as err:
+                    logger.error('Failed to read "%s" for streamed zip, the archive is aborted: %s', path, err)
+                    raise
+            if sink.chunks:
+                yield sink.pop()
+    # Central directory
+    yield sink.pop()
@@ -1,3 +1,4 @@
+from django_web_utils.daemon.models import AbstractLockModel, AbstractQueueJob
 from django_web_utils.settings_store.models import AbstractSettingsModel
 from django_web_utils.settings_store.store import SettingsStoreBase
 
@@ -6,6 +7,14 @@ class SettingsModel(AbstractSettingsModel):
     pass
 
 
+class LockModel(AbstractLockModel):
+    pass
+
+
+class QueueJob(AbstractQueueJob):
+    pass
+
+
 class SettingsStore(SettingsStoreBase, model=SettingsModel):
     STR_VAL: str = 'foo'
     FLOAT_VAL: float = 5.5
@@ -1,12 +1,18 @@
 import logging
+import logging.handlers
 import os
+import signal
 import socket
+import subprocess
+import sys
+import threading
 import time
 from datetime import timedelta
 
 import pytest
 from django_web_utils.daemon.base import BaseDaemon
 from django_web_utils.daemon import lock
+from django_web_utils.daemon.metrics import DaemonMetrics, read_metrics
 
 logger = logging.getLogger(__name__)
 
@@ -42,6 +48,107 @@ def test_daemon_start():
         daemon.start()
 
 
+def test_daemon_reload(tmp_dir):
+    reloads = []
+
+    class ReloadDaemon(BaseDaemon):
+        CONF_DIR = tmp_dir
+        LOG_DIR = tmp_dir
+        PID_DIR = tmp_dir
+
+        def on_config_reload(self, old_config, new_config):
+            reloads.append((old_config.get('VALUE'), new_config.get('VALUE')))
+
+    ReloadDaemon._file_name = 'reload_daemon'
+    ReloadDaemon.get_conf_path().write_text('VALUE = 1\n')
+    previous_handler = signal.getsignal(signal.SIGHUP)
+    previous_level = logging.getLogger().level
+    try:
+        daemon = ReloadDaemon(['-f', 'start'])
+        assert daemon.get_config('VALUE') == 1
+
+        ReloadDaemon.get_conf_path().write_text('VALUE = 2\nLOGGING_LEVEL = \'WARNING\'\n')
+        os.kill(os.getpid(), signal.SIGHUP)
+        assert daemon.get_config('VALUE') == 2
+        assert reloads == [(1, 2)]
+        assert logging.getLogger().level == logging.WARNING
+
+        # Invalid configuration is ignored
+        ReloadDaemon.get_conf_path().write_text('VALUE = \n')
+        os.kill(os.getpid(), signal.SIGHUP)
+        assert daemon.get_config('VALUE') == 2
+        assert reloads == [(1, 2)]
+    finally:
+        signal.signal(signal.SIGHUP, previous_handler)
+        logging.getLogger().setLevel(previous_level)
+
+
+def test_daemon_log_queue(tmp_dir):
+    class QueueDaemon(BaseDaemon):
+        LOG_DIR = tmp_dir
+        PID_DIR = tmp_dir
+        LOG_QUEUE = True
+        LOG_MAX_SIZE = 10000
+
+    QueueDaemon._file_name = 'queue_daemon'
+    root = logging.getLogger()
+    previous_handlers = list(root.handlers)
+    try:
+        daemon = QueueDaemon(['-f', '-l', 'start'])
+        assert isinstance(root.handlers[0], logging.handlers.QueueHandler)
+        logging.getLogger('djwutils.tests').info('Logged through queue.')
+        daemon._stop_logging_queue()
+        assert 'Logged through queue.' in QueueDaemon.get_log_path().read_text()
+    finally:
+        root.handlers = previous_handlers
+
+
+def test_metrics(tmp_dir):
+    path = tmp_dir / 'daemon.metrics'
+    assert read_metrics(path) is None
+
+    metrics = DaemonMetrics(path, counters=['videos', 'errors'], heartbeat_timeout=60)
+    data = read_metrics(path)
+    assert data['pid'] == os.getpid()
+    assert data['heartbeat'] is None
+    assert data['stale'] is False
+    assert data['iterations'] == 0
+    assert data['counters'] == {'videos': 0, 'errors': 0}
+    assert data['last_error'] is None
+
+    metrics.heartbeat()
+    metrics.heartbeat(items=3)
+    metrics.incr('videos')
+    metrics.incr('videos', 4)
+    metrics.set('errors', 2)
+    metrics.set_error('Something failed.')
+    data = read_metrics(path)
+    assert data['heartbeat'] <= time.time()
+    assert data['heartbeat_age'] < 60
+    assert data['iterations'] == 2
+    assert data['items'] == 3
+    assert data['counters'] == {'videos': 5, 'errors': 2}
+    assert data['last_error'] == 'Something failed.'
+    assert data['last_error_at'] is not None
+
+    with pytest.raises(KeyError):
+        metrics.incr('nope')
+    metrics.close()
+
+    # Invalid file
+    path.write_text('nope')
+    assert read_metrics(path) is None
+
+
+def test_metrics__stale(tmp_dir):
+    path = tmp_dir / 'daemon.metrics'
+    metrics = DaemonMetrics(path, heartbeat_timeout=0.001)
+    metrics.heartbeat()
+    time.sleep(0.01)
+    assert read_metrics(path)['stale'] is True
+    metrics.close()
+
+
 def test_lock_file__acquire(lock_path):
     acquired = lock.acquire_lock(lock_path)
     assert acquired is True
@@ -110,3 +217,176 @@ def test_lock_decorator(lock_path, lock_content, silent):
                 dummy_fct()
     else:
         assert dummy_fct() == 'dummy'
+
+
+@pytest.fixture()
+def another_connection():
+    from django.db import connections
+    from django.db.utils import load_backend
+
+    backend = load_backend(connections.databases['default']['ENGINE'])
+    conn = backend.DatabaseWrapper(connections.databases['default'])
+    yield conn
+    conn.close()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_lock_advisory__acquire(another_connection):
+    backend = lock.AdvisoryLockBackend()
+    assert lock.acquire_lock('test-lock', backend=backend) is True
+    # Acquire same lock (accepted for same session)
+    assert lock.acquire_lock('test-lock', backend=backend) is True
+
+    with another_connection.cursor() as cursor:
+        cursor.execute('SELECT pg_try_advisory_lock(%s)', [backend.get_key('test-lock')])
+        assert cursor.fetchone()[0] is False
+
+    # Nested acquisitions: the lock is held until the outermost holder releases it
+    assert lock.release_lock('test-lock', backend=backend) is True
+    with another_connection.cursor() as cursor:
+        cursor.execute('SELECT pg_try_advisory_lock(%s)', [backend.get_key('test-lock')])
+        assert cursor.fetchone()[0] is False
+    assert lock.release_lock('test-lock', backend=backend) is True
+    assert lock.release_lock('test-lock', backend=backend) is False
+    with another_connection.cursor() as cursor:
+        cursor.execute('SELECT pg_try_advisory_lock(%s)', [backend.get_key('test-lock')])
+        assert cursor.fetchone()[0] is True
+
+    # Lock held by another session
+    assert lock.acquire_lock('test-lock', backend=backend) is False
+
+
+@pytest.mark.django_db(transaction=True)
+def test_lock_advisory__threads():
+    from django.db import connection
+
+    backend = lock.AdvisoryLockBackend()
+    results = []
+
+    def other_thread():
+        # Each thread uses its own database connection
+        try:
+            results.append(lock.acquire_lock('test-lock', backend=backend))
+            results.append(lock.release_lock('test-lock', backend=backend))
+        finally:
+            connection.close()
+
+    assert lock.acquire_lock('test-lock', backend=backend) is True
+    thread = threading.Thread(target=other_thread)
+    thread.start()
+    thread.join()
+    assert results == [False, False]
+    assert lock.release_lock('test-lock', backend=backend) is True
+
+    thread = threading.Thread(target=other_thread)
+    thread.start()
+    thread.join()
+    assert results == [False, False, True, True]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_lock_advisory__decorator(another_connection):
+    backend = lock.AdvisoryLockBackend(scope='transaction')
+
+    @lock.require_lock('test-lock', silent=False, backend=backend)
+    def dummy_fct():
+        with another_connection.cursor() as cursor:
+            cursor.execute('SELECT pg_try_advisory_lock(%s)', [backend.get_key('test-lock')])
+            return cursor.fetchone()[0]
+
+    # The lock is held while the function runs
+    assert dummy_fct() is False
+
+    with pytest.raises(RuntimeError):
+        lock.acquire_lock('test-lock', backend=backend)
+
+
+@pytest.mark.django_db
+def test_lock_table__acquire():
+    from testapp.models import LockModel
+
+    backend = lock.TableLockBackend(LockModel, owner='host-a')
+    other_backend = lock.TableLockBackend(LockModel, owner='host-b')
+
+    assert lock.acquire_lock('test-lock', backend=backend) is True
+    # Acquire same lock (accepted for same owner)
+    assert lock.acquire_lock('test-lock', backend=backend) is True
+    assert lock.acquire_lock('test-lock', backend=other_backend) is False
+    assert LockModel.objects.get(name='test-lock').owner == 'host-a'
+
+    assert lock.release_lock('test-lock', backend=other_backend) is False
+    assert lock.release_lock('test-lock', backend=backend) is True
+    assert lock.release_lock('test-lock', backend=backend) is True
+    assert LockModel.objects.count() == 0
+
+    assert lock.acquire_lock('test-lock', backend=other_backend) is True
+    assert LockModel.objects.get(name='test-lock').owner == 'host-b'
+
+
+@pytest.mark.django_db
+def test_lock_table__lease():
+    from testapp.models import LockModel
+
+    backend = lock.TableLockBackend(LockModel, owner='host-a')
+    other_backend = lock.TableLockBackend(LockModel, owner='host-b')
+
+    assert lock.acquire_lock('test-lock', timeout=timedelta(seconds=60), backend=backend) is True
+    assert lock.acquire_lock('test-lock', backend=other_backend) is False
+
+    # Expire the lease
+    LockModel.objects.filter(name='test-lock').update(expires_at=LockModel.objects.get().acquired_at - timedelta(seconds=1))
+    assert lock.acquire_lock('test-lock', backend=other_backend) is True
+    assert LockModel.objects.get(name='test-lock').owner == 'host-b'
+    assert LockModel.objects.get(name='test-lock').expires_at is None
+
+
+DAEMON_SCRIPT = '''
+import atexit
+import sys
+from pathlib import Path
+
+from django_web_utils.daemon.base import BaseDaemon
+
+
+class LazyDaemon(BaseDaemon):
+    LOG_DIR = PID_DIR = CONF_DIR = Path('{tmp_dir}')
+    SETTINGS_MODULE = 'settings'
+    DJANGO_LAZY_SETUP = True
+
+    def run(self, *args):
+        from django.apps import apps
+        print('ready:', apps.ready)
+        print('model:', apps.get_model('testapp', 'QueueJob').__name__)
+        print('ready:', apps.ready)
+
+
+atexit.register(lambda: print('django imported:', 'django' in sys.modules))
+LazyDaemon().start()
+'''
+
+
+def run_daemon_script(tmp_dir, *args):
+    # The script is not in the configuration directory (it would be loaded as configuration file)
+    script = tmp_dir / 'bin' / 'lazy_daemon.py'
+    script.parent.mkdir()
+    script.write_text(DAEMON_SCRIPT.format(tmp_dir=tmp_dir))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    env.pop('DJANGO_SETTINGS_MODULE', None)
+    p = subprocess.run(
+        [sys.executable, str(script), *args], env=env,
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, encoding='utf-8', timeout=60)
+    return p.stdout
+
+
+def test_daemon_lazy_django_setup(tmp_dir):
+    out = run_daemon_script(tmp_dir, '-f', '--profile-startup', 'start')
+    assert out.index('ready: False') < out.index('model: QueueJob') < out.index('ready: True')
+    assert 'Startup profile of daemon lazy_daemon' in out
+    assert '    setup_django: ' in out
+    assert '    setup_logging: ' in out
+
+
+@pytest.mark.parametrize('action', ['stop', 'clear_log'])
+def test_daemon_commands_without_django(tmp_dir, action):
+    out = run_daemon_script(tmp_dir, action)
+    assert 'django imported: False' in out
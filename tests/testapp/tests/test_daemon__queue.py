@@ -0,0 +1,154 @@
+import datetime
+import threading
+import time
+
+import pytest
+from django.db import connections
+from django.db.utils import load_backend
+from django.utils import timezone
+
+from django_web_utils.daemon.queue import QueueDaemon
+from testapp.models import QueueJob
+
+pytestmark = pytest.mark.django_db(transaction=True)
+
+
+@pytest.fixture()
+def daemon(tmp_dir):
+    processed = []
+
+    class TestQueueDaemon(QueueDaemon):
+        LOG_DIR = tmp_dir
+        PID_DIR = tmp_dir
+        MODEL = 'testapp.models.QueueJob'
+        POLL_INTERVAL = 0.5
+        RETRY_DELAY = 60
+
+        def process_job(self, job):
+            if job.payload.get('fail'):
+                raise ValueError('Job failure.')
+            processed.append(job.payload['value'])
+
+    TestQueueDaemon._file_name = 'queue_daemon'
+    daemon = TestQueueDaemon(['-f', 'start'])
+    daemon.processed = processed
+    return daemon
+
+
+def test_queue__claim(daemon):
+    QueueJob.enqueue({'value': 1})
+    QueueJob.enqueue({'value': 2}, priority=10)
+    QueueJob.enqueue({'value': 3}, delay=datetime.timedelta(hours=1))
+    QueueJob.enqueue({'value': 4}, queue='other')
+
+    jobs = daemon.claim_jobs()
+    assert [job.payload['value'] for job in jobs] == [2, 1]
+    assert all(job.status == QueueJob.RUNNING and job.attempts == 1 for job in jobs)
+    assert daemon.claim_jobs() == []
+
+
+def test_queue__skip_locked(daemon):
+    first = QueueJob.enqueue({'value': 1})
+    QueueJob.enqueue({'value': 2})
+
+    # Lock the first job in another connection
+    backend = load_backend(connections.databases['default']['ENGINE'])
+    conn = backend.DatabaseWrapper(connections.databases['default'])
+    try:
+        conn.set_autocommit(False)
+        with conn.cursor() as cursor:
+            cursor.execute(f'SELECT id FROM {QueueJob._meta.db_table} WHERE id = %s FOR UPDATE', [first.pk])
+        assert [job.payload['value'] for job in daemon.claim_jobs()] == [2]
+    finally:
+        conn.rollback()
+        conn.close()
+    assert [job.payload['value'] for job in daemon.claim_jobs()] == [1]
+
+
+def test_queue__visibility_timeout(daemon):
+    job = QueueJob.enqueue({'value': 1})
+    assert len(daemon.claim_jobs()) == 1
+    assert daemon.claim_jobs() == []
+
+    QueueJob.objects.filter(pk=job.pk).update(locked_until=timezone.now() - datetime.timedelta(seconds=1))
+    jobs = daemon.claim_jobs()
+    assert len(jobs) == 1
+    assert jobs[0].attempts == 2
+
+
+def test_queue__visibility_timeout__last_attempt(daemon):
+    job = QueueJob.enqueue({'value': 1}, max_attempts=1)
+    assert len(daemon.claim_jobs()) == 1
+
+    # The worker has crashed during the last attempt
+    QueueJob.objects.filter(pk=job.pk).update(locked_until=timezone.now() - datetime.timedelta(seconds=1))
+    assert daemon.claim_jobs() == []
+    job.refresh_from_db()
+    assert job.status == QueueJob.FAILED
+    assert job.locked_by == ''
+
+
+def test_queue__retries(daemon):
+    job = QueueJob.enqueue({'fail': True}, max_attempts=2)
+
+    job = daemon.claim_jobs()[0]
+    assert daemon.handle_job(job) is False
+    job.refresh_from_db()
+    assert job.status == QueueJob.PENDING
+    assert 'Job failure.' in job.last_error
+    assert job.available_at > timezone.now() + datetime.timedelta(seconds=50)
+    assert daemon.claim_jobs() == []
+
+    QueueJob.objects.filter(pk=job.pk).update(available_at=timezone.now())
+    job = daemon.claim_jobs()[0]
+    assert daemon.handle_job(job) is False
+    job.refresh_from_db()
+    assert job.status == QueueJob.FAILED
+    assert job.attempts == 2
+
+
+def test_queue__run(daemon):
+    thread = threading.Thread(target=daemon.run)
+    thread.start()
+    try:
+        time.sleep(0.1)
+        start = time.monotonic()
+        QueueJob.enqueue({'value': 1})
+        while not daemon.processed and time.monotonic() - start < 5:
+            time.sleep(0.01)
+        # Notified before the poll interval
+        assert daemon.processed == [1]
+        assert time.monotonic() - start < 0.4
+    finally:
+        daemon.stop()
+        thread.join(timeout=5)
+    assert QueueJob.objects.get().status == QueueJob.DONE
+
+
+def test_queue__run__reconnect(daemon):
+    from django.db import connection
+
+    thread = threading.Thread(target=daemon.run)
+    thread.start()
+    try:
+        time.sleep(0.1)
+        # Close the connection of the daemon thread
+        daemon._listen_connection.close()
+        start = time.monotonic()
+        while time.monotonic() - start < 5:
+            listen_connection = daemon._listen_connection
+            if not listen_connection.closed:
+                break
+            time.sleep(0.01)
+        time.sleep(0.1)
+        start = time.monotonic()
+        QueueJob.enqueue({'value': 1})
+        while not daemon.processed and time.monotonic() - start < 5:
+            time.sleep(0.01)
+        # Still notified after the reconnection
+        assert daemon.processed == [1]
+        assert time.monotonic() - start < 0.4
+    finally:
+        daemon.stop()
+        thread.join(timeout=5)
+    connection.close()
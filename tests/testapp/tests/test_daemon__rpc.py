@@ -0,0 +1,72 @@
+import signal
+
+import pytest
+
+from django_web_utils.daemon import rpc
+from django_web_utils.daemon.base import BaseDaemon
+
+
+def fail():
+    raise ValueError('Method failure.')
+
+
+@pytest.fixture()
+def rpc_server(tmp_dir):
+    server = rpc.RPCServer(tmp_dir / 'rpc.sock', {
+        'add': lambda a, b=0: a + b,
+        'fail': fail,
+        'object': lambda: object(),
+    })
+    server.start()
+
+    yield server
+
+    server.stop()
+
+
+def test_rpc__call(rpc_server):
+    assert rpc.call(rpc_server.path, 'add', 1, b=2) == 3
+
+    rpc_server.register('echo', lambda value: value)
+    assert rpc.call(rpc_server.path, 'echo', {'a': [1, 2]}) == {'a': [1, 2]}
+
+
+def test_rpc__errors(rpc_server):
+    with pytest.raises(rpc.RPCError, match='ValueError: Method failure.'):
+        rpc.call(rpc_server.path, 'fail')
+    with pytest.raises(rpc.RPCError, match='Unknown method'):
+        rpc.call(rpc_server.path, 'nope')
+    with pytest.raises(rpc.RPCError, match='cannot be serialized'):
+        rpc.call(rpc_server.path, 'object')
+    # The server still works after errors
+    assert rpc.call(rpc_server.path, 'add', 1) == 1
+
+
+def test_rpc__stopped(rpc_server):
+    rpc_server.stop()
+    assert not rpc_server.path.exists()
+    with pytest.raises(rpc.RPCError):
+        rpc.call(rpc_server.path, 'add', 1)
+
+
+def test_rpc__daemon(tmp_dir):
+    class RPCDaemon(BaseDaemon):
+        LOG_DIR = tmp_dir
+        PID_DIR = tmp_dir
+        RPC_METHODS = {'get_value': 'get_value'}
+
+        def get_value(self, key):
+            return self.values[key]
+
+    RPCDaemon._file_name = 'rpc_daemon'
+    previous_handler = signal.getsignal(signal.SIGHUP)
+    try:
+        daemon = RPCDaemon(['-f', 'start'])
+        daemon.values = {'a': 1}
+        assert RPCDaemon.get_rpc_path() == tmp_dir / 'rpc_daemon.rpc.sock'
+        assert RPCDaemon.call('get_value', 'a', timeout=5) == 1
+        with pytest.raises(rpc.RPCError, match='KeyError'):
+            RPCDaemon.call('get_value', 'b')
+    finally:
+        signal.signal(signal.SIGHUP, previous_handler)
+        daemon.rpc_server.stop()
@@ -0,0 +1,145 @@
+import datetime
+import heapq
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from django_web_utils.daemon import scheduler as sched
+
+
+def timestamp(*args):
+    return datetime.datetime(*args).timestamp()
+
+
+@pytest.mark.parametrize('expression, after, expected', [
+    pytest.param('* * * * *', (2024, 1, 1, 10, 0, 30), (2024, 1, 1, 10, 1), id='every minute'),
+    pytest.param('*/15 * * * *', (2024, 1, 1, 10, 16), (2024, 1, 1, 10, 30), id='step'),
+    pytest.param('0 3 * * *', (2024, 1, 1, 10, 0), (2024, 1, 2, 3, 0), id='daily'),
+    pytest.param('0 3 * * *', (2024, 1, 1, 3, 0), (2024, 1, 2, 3, 0), id='daily same minute'),
+    pytest.param('30 8-10 * * 1-5', (2024, 1, 5, 11, 0), (2024, 1, 8, 8, 30), id='weekdays'),
+    pytest.param('0 0 * * 0', (2024, 1, 1, 0, 0), (2024, 1, 7, 0, 0), id='sunday'),
+    pytest.param('0 0 * * 7', (2024, 1, 1, 0, 0), (2024, 1, 7, 0, 0), id='sunday as 7'),
+    pytest.param('0 0 13 * 5', (2024, 1, 1, 0, 0), (2024, 1, 5, 0, 0), id='day or weekday'),
+    pytest.param('0 12 29 2 *', (2024, 3, 1, 0, 0), (2028, 2, 29, 12, 0), id='leap day'),
+])
+def test_cron_trigger(expression, after, expected):
+    trigger = sched.CronTrigger(expression)
+    assert trigger.get_next(timestamp(*after)) == timestamp(*expected)
+
+
+@pytest.mark.parametrize('expression', [
+    pytest.param('* * * *', id='missing field'),
+    pytest.param('60 * * * *', id='out of range'),
+    pytest.param('0 0 31 2 *', id='never matches'),
+])
+def test_cron_trigger__invalid(expression):
+    with pytest.raises(ValueError):
+        sched.CronTrigger(expression).get_next(time.time())
+
+
+def run_scheduler(scheduler, duration):
+    thread = threading.Thread(target=scheduler.run)
+    thread.start()
+    time.sleep(duration)
+    scheduler.stop()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+
+
+def test_scheduler__interval():
+    calls = []
+    heartbeats = []
+    scheduler = sched.Scheduler(max_workers=2, heartbeat=lambda: heartbeats.append(1))
+    scheduler.add_job(calls.append, every=0.05, args=('fast',), run_at_start=True)
+    scheduler.add_job(calls.append, every=datetime.timedelta(seconds=10), args=('slow',))
+    run_scheduler(scheduler, 0.28)
+    assert 4 <= calls.count('fast') <= 7
+    assert 'slow' not in calls
+    assert heartbeats
+
+
+def test_scheduler__no_overlap():
+    running = []
+    max_running = []
+
+    def slow_job():
+        running.append(1)
+        max_running.append(len(running))
+        time.sleep(0.15)
+        running.pop()
+
+    scheduler = sched.Scheduler(max_workers=4)
+    job = scheduler.add_job(slow_job, every=0.02, run_at_start=True, misfire_policy=sched.MISFIRE_SKIP)
+    run_scheduler(scheduler, 0.4)
+    assert max(max_running) == 1
+    assert 2 <= job.runs <= 3
+
+
+def test_scheduler__lock(tmp_dir):
+    lock_path = tmp_dir / 'job.lock'
+    lock_path.write_text('another-host')
+    calls = []
+    scheduler = sched.Scheduler()
+    scheduler.add_job(calls.append, every=10, args=('locked',), run_at_start=True, lock=lock_path)
+    run_scheduler(scheduler, 0.05)
+    assert calls == []
+
+
+class ImmediateExecutor:
+    def submit(self, function):
+        future = Future()
+        future.set_result(function())
+        return future
+
+
+def process_due_jobs(scheduler, now):
+    executor = ImmediateExecutor()
+    while scheduler._heap and scheduler._heap[0][0] <= now:
+        _run_at, _count, job = heapq.heappop(scheduler._heap)
+        if scheduler._process_due_job(executor, job, now):
+            scheduler._push(job)
+
+
+@pytest.mark.parametrize('policy, expected_runs', [
+    pytest.param(sched.MISFIRE_SKIP, 0, id='skip'),
+    pytest.param(sched.MISFIRE_RUN_ONCE, 1, id='run_once'),
+    pytest.param(sched.MISFIRE_RUN_ALL, 6, id='run_all'),
+])
+def test_scheduler__misfire(policy, expected_runs):
+    calls = []
+    scheduler = sched.Scheduler()
+    job = scheduler.add_job(calls.append, every=1, args=('run',), misfire_policy=policy)
+    # The job has missed the runs of the last 6 seconds
+    now = time.time()
+    scheduler._heap.clear()
+    job.schedule(now - 5.5)
+    scheduler._push(job)
+    process_due_jobs(scheduler, now)
+    assert len(calls) == expected_runs
+    assert now < job.scheduled <= now + 1
+
+
+def test_scheduler__lock_error(caplog):
+    class BrokenLockBackend:
+        def acquire(self, name, timeout=None):
+            raise RuntimeError('Lock backend error.')
+
+    calls = []
+    job = sched.Job(calls.append, sched.IntervalTrigger(10), args=('locked',), lock='test-lock', lock_backend=BrokenLockBackend())
+    with caplog.at_level(logging.ERROR, logger='djwutils.daemon.scheduler'):
+        job.execute()
+    assert calls == []
+    assert 'Lock backend error.' in caplog.text
+
+
+def test_scheduler__invalid():
+    scheduler = sched.Scheduler()
+    with pytest.raises(ValueError):
+        scheduler.add_job(print)
+    with pytest.raises(ValueError):
+        scheduler.add_job(print, every=1, cron='* * * * *')
+    with pytest.raises(ValueError):
+        scheduler.add_job(print, every=1, misfire_policy='nope')
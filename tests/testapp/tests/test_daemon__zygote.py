@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+from django_web_utils.daemon import zygote
+
+
+def get_pid(offset=0):
+    return os.getpid() + offset
+
+
+def fail():
+    raise ValueError('Task failure.')
+
+
+def crash():
+    os._exit(3)
+
+
+@pytest.fixture()
+def fork_server(tmp_dir):
+    server = zygote.ForkServer(tmp_dir / 'fork.sock', {
+        'get_pid': get_pid,
+        'fail': fail,
+        'crash': crash,
+        'sizes': 'django_web_utils.files_utils.get_size_repr',
+    })
+    server.start()
+
+    yield server
+
+    server.stop()
+
+
+def test_fork_server__result(fork_server):
+    result = zygote.run_task(fork_server.path, 'get_pid', timeout=5)
+    assert result.exit_code == 0
+    assert result.error is None
+    # Task is run in a child of the fork server
+    assert result.result not in (os.getpid(), fork_server.pid)
+
+    other = zygote.run_task(fork_server.path, 'get_pid', kwargs={'offset': 0}, timeout=5)
+    assert other.result != result.result
+
+    result = zygote.run_task(fork_server.path, 'sizes', args=[1500], timeout=5)
+    assert result == (0, '1.5 kB', None)
+
+
+def test_fork_server__errors(fork_server):
+    result = zygote.run_task(fork_server.path, 'fail', timeout=5)
+    assert result.exit_code == 1
+    assert result.result is None
+    assert result.error == 'ValueError: Task failure.'
+
+    result = zygote.run_task(fork_server.path, 'crash', timeout=5)
+    assert result == (3, None, None)
+
+    with pytest.raises(zygote.ForkServerError):
+        zygote.run_task(fork_server.path, 'nope', timeout=5)
+
+
+def test_fork_server__stopped(tmp_dir):
+    with pytest.raises(zygote.ForkServerError):
+        zygote.run_task(tmp_dir / 'fork.sock', 'get_pid', timeout=5)
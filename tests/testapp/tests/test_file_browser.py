@@ -1,8 +1,14 @@
+import io
 import json
+import os
+import time
+import zipfile
 
 import pytest
 from django.urls import reverse
 
+from django_web_utils.file_browser import jobs, operations, search_index, size_index, thumbnails
+
 pytestmark = pytest.mark.django_db
 
 
@@ -27,6 +33,9 @@ def test_anonymous(client):
     response = client.get(reverse('storage:file_browser_content'), {'path': '/'})
     assert response.status_code == 302
 
+    response = client.get(reverse('storage:file_browser_download'), {'path': '/image.png'})
+    assert response.status_code == 302
+
 
 def test_logged(staff_client):
     response = staff_client.get(reverse('storage:file_browser_base'))
@@ -41,10 +50,11 @@ def test_logged(staff_client):
         'dirs': [
             {
                 'dir_name': 'Root folder',
+                'has_children': True,
                 'sub_dirs': [
                     {
                         'dir_name': 'a dir',
-                        'sub_dirs': []
+                        'has_children': False,
                     }
                 ]
             }
@@ -88,3 +98,713 @@ def test_logged(staff_client):
     assert response.status_code == 200
     assert response['Content-Type'] == 'image/png; charset=utf-8'
     assert len(response.content) > 0
+
+
+@pytest.fixture()
+def index_settings(settings, tmp_dir):
+    settings.FILE_BROWSER_INDEX_DIR = str(tmp_dir / 'index')
+    size_index._indexes.clear()
+    search_index._indexes.clear()
+    yield settings
+    size_index._indexes.clear()
+    search_index._indexes.clear()
+
+
+def test_size_index(tmp_dir):
+    storage = tmp_dir / 'storage'
+    (storage / 'a' / 'b').mkdir(parents=True)
+    (storage / 'a' / 'f1').write_bytes(b'x' * 10)
+    (storage / 'a' / 'b' / 'f2').write_bytes(b'x' * 5)
+    (storage / 'c').mkdir()
+    index = size_index.DirSizeIndex(tmp_dir / 'index.sqlite3', storage)
+
+    assert index.get('a') is None
+    assert index.refresh() == (15, 2, 3)
+    assert index.get('a') == {'size': 15, 'nb_files': 2, 'nb_dirs': 1, 'stale': False}
+    assert index.get('a/b') == {'size': 5, 'nb_files': 1, 'nb_dirs': 0, 'stale': False}
+
+    # Changes in a sub directory are detected
+    (storage / 'a' / 'b' / 'f3').write_bytes(b'x' * 7)
+    assert index.get('a/b')['stale'] is True
+    assert index.refresh('a') == (22, 3, 1)
+    assert index.get('a/b') == {'size': 12, 'nb_files': 2, 'nb_dirs': 0, 'stale': False}
+
+    # Unchanged directories are not scanned again (files changed in place are not measured)
+    with open(storage / 'a' / 'b' / 'f3', 'ab') as fo:
+        fo.write(b'x' * 3)
+    assert index.refresh('a') == (22, 3, 1)
+    # Unless files measurement is enabled (for directories checked more than `ttl` seconds ago)
+    index.measure_files = True
+    assert index.refresh('a') == (22, 3, 1)
+    index.ttl = 0
+    assert index.refresh('a') == (25, 3, 1)
+    with index.batch():
+        assert index.get('a/b')['size'] == 15
+        assert index.get('a')['size'] == 25
+    index.measure_files = False
+    index.ttl = 300
+
+    # Removed directories are removed from the index
+    for name in ('f2', 'f3'):
+        (storage / 'a' / 'b' / name).unlink()
+    (storage / 'a' / 'b').rmdir()
+    assert index.refresh() == (10, 1, 2)
+    assert index.get('a/b') is None
+
+
+def test_size_index__ttl(tmp_dir):
+    storage = tmp_dir / 'storage'
+    storage.mkdir()
+    index = size_index.DirSizeIndex(tmp_dir / 'index.sqlite3', storage, ttl=0)
+    index.refresh()
+    assert index.get('')['stale'] is True
+
+
+def test_content__size_index(staff_client, index_settings):
+    url = reverse('storage:file_browser_content')
+    response = staff_client.get(url, {'path': '/'})
+    assert response.status_code == 200
+    content = response.json()
+    assert content['stale'] is True
+    assert content['files'][0]['name'] == 'a dir'
+    assert content['files'][0]['stale'] is True
+    assert content['files'][0]['size_h'] == '?'
+
+    # Same update as the one done in background
+    index = size_index.get_size_index('storage')
+    index.refresh()
+
+    response = staff_client.get(url, {'path': '/'})
+    content = response.json()
+    assert content['stale'] is False
+    assert content['files'][0] == {
+        'name': 'a dir',
+        'size': 2069,
+        'size_h': '2.1 kB',
+        'is_dir': True,
+        'nb_files': 2,
+        'nb_dirs': 0,
+        'stale': False,
+    }
+    assert content['total_size'] == '2.2 kB'
+    assert os.path.exists(index.db_path)
+
+
+def test_content__pagination(staff_client):
+    url = reverse('storage:file_browser_content')
+    response = staff_client.get(url, {'path': '/a dir/', 'order': 'name-desc', 'limit': 1})
+    assert response.status_code == 200
+    content = response.json()
+    assert [f['name'] for f in content['files']] == ['parent', 'test file.txt']
+    assert (content['count'], content['offset'], content['limit']) == (2, 0, 1)
+    assert content['total_nb_files'] == 2
+
+    response = staff_client.get(url, {'path': '/a dir/', 'order': 'name-desc', 'offset': 1, 'limit': 1})
+    content = response.json()
+    assert [f['name'] for f in content['files']] == ['lorem.md']
+
+    response = staff_client.get(url, {'path': '/', 'limit': 0})
+    assert response.status_code == 400
+
+
+def test_content__ndjson(staff_client):
+    response = staff_client.get(reverse('storage:file_browser_content'), {'path': '/', 'format': 'ndjson'})
+    assert response.status_code == 200
+    assert response['Content-Type'] == 'application/x-ndjson'
+    lines = [json.loads(line) for line in b''.join(response.streaming_content).decode('utf-8').splitlines()]
+    # Files are sent in the order of the file system, totals are sent at the end
+    assert lines[0] == {'path': '/'}
+    assert sorted(line['name'] for line in lines[1:-1]) == ['a dir', 'image.png']
+    assert lines[-1] == {
+        'total_size': '2.2 kB',
+        'total_nb_dirs': 1,
+        'total_nb_files': 3,
+    }
+
+    response = staff_client.get(reverse('storage:file_browser_content'), {'path': '/a dir', 'format': 'ndjson'})
+    lines = [json.loads(line) for line in b''.join(response.streaming_content).decode('utf-8').splitlines()]
+    assert lines[0] == {'path': '/a dir'}
+    assert lines[1]['isprevious'] is True
+
+    # The files cannot be sorted or paginated
+    response = staff_client.get(reverse('storage:file_browser_content'), {'path': '/', 'format': 'ndjson', 'limit': 10})
+    assert response.status_code == 400
+
+
+def test_search_index(tmp_dir):
+    storage = tmp_dir / 'storage'
+    (storage / 'Photos' / 'holidays').mkdir(parents=True)
+    (storage / 'Photos' / 'holidays' / 'beach.JPG').write_bytes(b'')
+    (storage / 'Photos' / 'cat.png').write_bytes(b'')
+    (storage / 'notes.txt').write_bytes(b'')
+    index = search_index.FileNameIndex(tmp_dir / 'search.sqlite3', storage)
+    assert index.get_refresh_date() is None
+
+    assert index.refresh() == 3
+    assert index.get_refresh_date() is not None
+    assert index.search('beach') == (1, [{'path': 'Photos/holidays/beach.JPG', 'parent': 'Photos/holidays', 'name': 'beach.JPG', 'is_dir': False}])
+    # Case insensitive, short queries and sub directories
+    assert [r['path'] for r in index.search('jpg')[1]] == ['Photos/holidays/beach.JPG']
+    assert [r['path'] for r in index.search('o')[1]] == ['Photos', 'Photos/holidays', 'notes.txt']
+    assert [r['path'] for r in index.search('o', 'Photos')[1]] == ['Photos/holidays']
+    assert index.search('o', offset=1, limit=1) == (3, [{'path': 'Photos/holidays', 'parent': 'Photos', 'name': 'holidays', 'is_dir': True}])
+
+    # Only changed directories are scanned
+    (storage / 'Photos' / 'holidays' / 'sea.jpg').write_bytes(b'')
+    assert index.refresh() == 1
+    assert index.search('sea')[0] == 1
+    (storage / 'Photos' / 'holidays' / 'sea.jpg').rename(storage / 'Photos' / 'holidays' / 'ocean.jpg')
+    assert index.refresh() == 1
+    assert index.search('sea')[0] == 0
+    assert index.search('ocean')[0] == 1
+
+    # Direct updates
+    (storage / 'Photos').rename(storage / 'Pictures')
+    index.rename('Photos', 'Pictures')
+    assert [r['path'] for r in index.search('jpg')[1]] == ['Pictures/holidays/beach.JPG', 'Pictures/holidays/ocean.jpg']
+    index.remove('Pictures/holidays')
+    assert index.search('jpg')[0] == 0
+
+
+def test_search__index(staff_client, index_settings):
+    url = reverse('storage:file_browser_action')
+    # The index is built on first search, results are found without index meanwhile
+    response = staff_client.get(url, {'action': 'search', 'search': 'file'})
+    assert response.status_code == 200
+    expected = {
+        'search_in': '',
+        'msg': '1 results for "file".',
+        'results': 1,
+        'dirs': [{'url': 'a dir/', 'files': ['test file.txt']}],
+    }
+    assert response.json() == expected
+
+    search_index.get_search_index('storage').refresh()
+    response = staff_client.get(url, {'action': 'search', 'search': 'file'})
+    assert response.json() == expected
+
+    response = staff_client.get(url, {'action': 'search', 'search': 'DIR', 'limit': 10})
+    assert response.json() == {
+        'search_in': '',
+        'msg': '1 results for "dir".',
+        'results': 1,
+        'dirs': [{'url': 'a dir/', 'files': []}],
+        'offset': 0,
+        'limit': 10,
+    }
+
+
+def test_preview__cache(staff_client, settings, tmp_dir):
+    settings.FILE_BROWSER_THUMBNAILS_DIR = str(tmp_dir / 'thumbnails')
+    url = reverse('storage:file_browser_img_preview')
+    response = staff_client.get(url, {'path': '/image.png'})
+    assert response.status_code == 200
+    assert response['Content-Type'] == 'image/png; charset=utf-8'
+    assert response['ETag']
+    assert response['Last-Modified']
+    assert len(list((tmp_dir / 'thumbnails' / 'storage').glob('*/*.png'))) == 1
+
+    response = staff_client.get(url, {'path': '/image.png'}, HTTP_IF_NONE_MATCH=response['ETag'])
+    assert response.status_code == 304
+    assert response.content == b''
+
+
+def test_thumbnails__jpeg(tmp_dir):
+    from PIL import Image
+
+    for index in range(3):
+        Image.new('RGB', (2000, 1000), (index * 50, 0, 0)).save(tmp_dir / f'photo{index}.jpg', 'JPEG')
+    (tmp_dir / 'notes.txt').write_text('not an image')
+    cache_dir = tmp_dir / 'cache'
+
+    assert thumbnails.generate_thumbnails(tmp_dir, cache_dir) == 3
+    assert len(list(cache_dir.glob('*/*.jpg'))) == 3
+    data = thumbnails.get_thumbnail(tmp_dir / 'photo0.jpg', cache_dir=cache_dir)
+    with Image.open(io.BytesIO(data)) as image:
+        assert image.format == 'JPEG'
+        assert image.size == (128, 64)
+
+
+def test_upload__chunks(staff_client, settings, tmp_dir):
+    storage = tmp_dir / 'storage'
+    storage.mkdir()
+    settings.FILE_BROWSER_DIRS = {'storage': (str(storage), '/storage')}
+    settings.FILE_BROWSER_UPLOADS_DIR = str(tmp_dir / 'uploads')
+    response = staff_client.post(reverse('storage:file_browser_upload'), {'path': 'sub', 'name': 'data.bin', 'size': 10})
+    assert response.status_code == 200
+    session = response.json()
+    assert session['offset'] == 0
+    assert session['chunk_size'] > 0
+    url = session['url']
+
+    # Chunks can be sent in any order
+    response = staff_client.put(url, b'56789', content_type='application/octet-stream', HTTP_CONTENT_RANGE='bytes 5-9/10')
+    assert response.status_code == 200
+    assert response.json()['offset'] == 0
+    assert response.json()['received'] == 5
+
+    response = staff_client.post(url)
+    assert response.status_code == 400
+    assert response.json()['error'] == 'The upload is not complete.'
+
+    response = staff_client.put(url, b'01234', content_type='application/octet-stream', HTTP_CONTENT_RANGE='bytes 0-4/11')
+    assert response.status_code == 400
+    response = staff_client.put(url, b'01234', content_type='application/octet-stream', HTTP_CONTENT_RANGE='bytes 0-4/10')
+    assert response.status_code == 200
+    response = staff_client.get(url)
+    assert response.json()['offset'] == 10
+    assert response.json()['ranges'] == [[0, 10]]
+
+    response = staff_client.post(url)
+    assert response.status_code == 200
+    assert response.json()['urls'] == ['/storage/sub/data.bin']
+    assert (storage / 'sub' / 'data.bin').read_bytes() == b'0123456789'
+    assert list((tmp_dir / 'uploads' / 'storage').iterdir()) == []
+
+    response = staff_client.get(url)
+    assert response.status_code == 404
+
+    # Maximum size
+    settings.FILE_BROWSER_UPLOADS_MAX_SIZE = 5
+    response = staff_client.post(reverse('storage:file_browser_upload'), {'path': '', 'name': 'big.bin', 'size': 10})
+    assert response.status_code == 400
+    assert response.json()['error'] == 'The file is too large (maximum size: 5 B).'
+
+
+def test_upload__deleted_session(tmp_dir):
+    from django_web_utils.file_browser import uploads
+    session = uploads.UploadSession.create(tmp_dir / 'uploads', '', 'data.bin', 10)
+
+    class Stream:
+        def read(self, size):
+            # Session removed while the chunk is received
+            session.delete()
+            return b'x' * size
+
+    with pytest.raises(uploads.UploadNotFound):
+        session.write(0, 5, Stream())
+    with pytest.raises(uploads.UploadNotFound):
+        session.write(0, 5, Stream())
+
+
+def test_download__zip(staff_client, settings):
+    url = reverse('storage:file_browser_action')
+    response = staff_client.get(url, {'action': 'download', 'path': '/', 'name_0': 'a dir', 'name_1': 'image.png'})
+    assert response.status_code == 200
+    assert response.streaming
+    assert response['Content-Type'] == 'application/zip'
+    assert response['Content-Disposition'] == 'attachment; filename="files.zip"'
+    with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as zip_file:
+        assert zip_file.testzip() is None
+        infos = {info.filename: info for info in zip_file.infolist()}
+        assert sorted(infos) == ['a dir/', 'a dir/lorem.md', 'a dir/test file.txt', 'image.png']
+        assert infos['a dir/lorem.md'].compress_type == zipfile.ZIP_DEFLATED
+        # Already compressed files are stored
+        assert infos['image.png'].compress_type == zipfile.ZIP_STORED
+        storage = settings.FILE_BROWSER_DIRS['storage'][0]
+        with open(os.path.join(storage, 'a dir', 'test file.txt'), 'rb') as fo:
+            assert zip_file.read('a dir/test file.txt') == fo.read()
+
+    response = staff_client.get(url, {'action': 'download', 'path': '/a dir', 'name_0': 'lorem.md', 'store': '1'})
+    assert response['Content-Disposition'] == 'attachment; filename="lorem.md.zip"'
+    with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as zip_file:
+        assert [info.compress_type for info in zip_file.infolist()] == [zipfile.ZIP_STORED]
+
+    response = staff_client.get(url, {'action': 'download', 'path': '/', 'name_0': '../settings.py'})
+    assert response.status_code == 400
+
+
+def test_download__zip_errors(tmp_dir):
+    from django_web_utils.zip_utils import stream_zip
+    path = tmp_dir / 'file.txt'
+    path.write_text('content')
+    # Files which cannot be opened are skipped
+    data = b''.join(stream_zip([(str(tmp_dir / 'missing.txt'), 'missing.txt'), (str(path), 'file.txt')]))
+    with zipfile.ZipFile(io.BytesIO(data)) as zip_file:
+        assert zip_file.namelist() == ['file.txt']
+    # Read errors abort the archive (reading this file at offset 0 fails)
+    with pytest.raises(OSError):
+        b''.join(stream_zip([('/proc/self/mem', 'mem')]))
+
+
+def test_dirs__lazy(staff_client, settings, tmp_dir):
+    storage = tmp_dir / 'storage'
+    (storage / 'a' / 'b' / 'c').mkdir(parents=True)
+    (storage / 'd').mkdir()
+    (storage / 'a' / 'file.txt').write_text('not a dir')
+    settings.FILE_BROWSER_DIRS = {'storage': (str(storage), '/storage')}
+    url = reverse('storage:file_browser_dirs')
+
+    response = staff_client.get(url, {'path': '/'})
+    assert response.status_code == 200
+    assert response.json() == {
+        'path': '/',
+        'dir_name': 'Root folder',
+        'dirs': [
+            {'dir_name': 'a', 'has_children': True},
+            {'dir_name': 'd', 'has_children': False},
+        ]
+    }
+
+    response = staff_client.get(url, {'path': '/a/', 'depth': 2})
+    assert response.json() == {
+        'path': 'a/',
+        'dir_name': 'a',
+        'dirs': [
+            {'dir_name': 'b', 'has_children': True, 'sub_dirs': [{'dir_name': 'c', 'has_children': False}]},
+        ]
+    }
+
+    # The cache is invalidated when a directory changes
+    (storage / 'd' / 'e').mkdir()
+    response = staff_client.get(url, {'path': '/'})
+    assert response.json()['dirs'][1] == {'dir_name': 'd', 'has_children': True}
+
+    response = staff_client.get(url, {'path': '/a', 'depth': 0})
+    assert response.status_code == 400
+
+    # Without path, the root tree is returned on a limited depth (0 for the complete tree)
+    response = staff_client.get(url)
+    assert [info.get('sub_dirs') for info in response.json()['dirs'][0]['sub_dirs']] == [None, None]
+    response = staff_client.get(url, {'depth': 0})
+    assert response.json()['dirs'][0]['sub_dirs'][0]['sub_dirs'][0]['sub_dirs'][0] == {
+        'dir_name': 'c', 'has_children': False, 'sub_dirs': []}
+    response = staff_client.get(url, {'depth': -1})
+    assert response.status_code == 400
+    response = staff_client.get(url, {'path': '/missing'})
+    assert response.status_code == 400
+
+
+def test_remove_tree(tmp_dir):
+    tree = tmp_dir / 'tree'
+    for index in range(3):
+        (tree / f'd{index}' / 'sub').mkdir(parents=True)
+        (tree / f'd{index}' / 'sub' / 'file').write_text('content')
+        (tree / f'd{index}' / 'file').write_text('content')
+    outside = tmp_dir / 'outside'
+    outside.mkdir()
+    (outside / 'kept').write_text('content')
+    (tree / 'link').symlink_to(outside)
+    progress = []
+
+    assert operations.remove_tree(tree, lambda f, d: progress.append((f, d))) == (7, 7)
+    assert not tree.exists()
+    # Symbolic links are removed, not followed
+    assert (outside / 'kept').exists()
+    assert operations.remove_tree(outside / 'kept') == (1, 0)
+
+
+def test_remove_tree__progress(tmp_dir, monkeypatch):
+    monkeypatch.setattr(operations, 'PROGRESS_INTERVAL', 2)
+    tree = tmp_dir / 'tree'
+    tree.mkdir()
+    for index in range(5):
+        (tree / f'file{index}').write_text('content')
+    progress = []
+
+    # Progress is reported (and the removal can be stopped) inside a directory
+    def on_progress(files, dirs):
+        progress.append((files, dirs))
+        if files >= 4:
+            raise jobs.JobCanceled()
+
+    with pytest.raises(jobs.JobCanceled):
+        operations.remove_tree(tree, on_progress)
+    assert progress == [(2, 0), (4, 0)]
+    assert len(os.listdir(tree)) == 1
+
+
+def test_delete__job(staff_client, settings, tmp_dir):
+    storage = tmp_dir / 'storage'
+    (storage / 'big' / 'sub').mkdir(parents=True)
+    for index in range(20):
+        (storage / 'big' / 'sub' / f'file{index}').write_text('content')
+    (storage / 'small.txt').write_text('content')
+    settings.FILE_BROWSER_DIRS = {'storage': (str(storage), '/storage')}
+    settings.FILE_BROWSER_JOBS_DIR = str(tmp_dir / 'jobs')
+    url = reverse('storage:file_browser_action')
+
+    response = staff_client.post(url, {'action': 'delete', 'path': '/', 'name_0': 'small.txt'})
+    assert response.status_code == 200
+    assert response.json() == {'message': '1 file(s) and 0 directory(ies) successfully deleted.'}
+
+    # The response is returned before the end of the job
+    settings.FILE_BROWSER_JOBS_WAIT = 0
+    response = staff_client.post(url, {'action': 'delete', 'path': '/', 'name_0': 'big'})
+    assert response.status_code == 200
+    data = response.json()
+    if 'job_url' in data:
+        for _i in range(50):
+            response = staff_client.get(data['job_url'])
+            assert response.status_code == 200
+            if response.json()['status'] == 'done':
+                break
+            time.sleep(0.1)
+        data = response.json()
+        assert data['kind'] == 'delete'
+        assert data['progress'] == {'current': None, 'files': 20, 'dirs': 2}
+    assert data['message'] == '20 file(s) and 2 directory(ies) successfully deleted.'
+    assert list(storage.iterdir()) == []
+
+
+def test_copy_tree(tmp_dir):
+    src = tmp_dir / 'src'
+    (src / 'sub').mkdir(parents=True)
+    (src / 'sub' / 'data.bin').write_bytes(os.urandom(3 * 1024 * 1024))
+    (src / 'file.txt').write_text('content')
+    (src / 'link').symlink_to('file.txt')
+    os.utime(src / 'file.txt', ns=(10 ** 18, 10 ** 18))
+    copied = []
+
+    assert operations.copy_tree(src, tmp_dir / 'dst', copied.append) == (3, 2)
+    assert sum(copied) == 3 * 1024 * 1024 + 7
+    assert (tmp_dir / 'dst' / 'sub' / 'data.bin').read_bytes() == (src / 'sub' / 'data.bin').read_bytes()
+    assert (tmp_dir / 'dst' / 'file.txt').stat().st_mtime_ns == 10 ** 18
+    assert os.readlink(tmp_dir / 'dst' / 'link') == 'file.txt'
+    assert operations.get_tree_size(src) == 3 * 1024 * 1024 + 7
+
+    assert operations.move_tree(src, tmp_dir / 'moved') is False
+    assert not src.exists()
+    assert (tmp_dir / 'moved' / 'file.txt').read_text() == 'content'
+
+
+def test_job__cancel(tmp_dir):
+    def function(job):
+        job.set_progress(force=True, done=1)
+        return 'Not canceled'
+
+    job = jobs.Job.create(tmp_dir / 'jobs', 'test')
+    job.cancel()
+    jobs.start(job, function).result()
+    job = jobs.Job.load(tmp_dir / 'jobs', job.id)
+    assert job.get_status() == {
+        'id': job.id,
+        'kind': 'test',
+        'status': 'canceled',
+        'progress': {},
+        'message': None,
+        'error': 'The operation has been canceled.',
+    }
+    assert not job.cancel_path.exists()
+
+
+def test_job__interrupted(tmp_dir):
+    import subprocess
+    process = subprocess.Popen(['true'])
+    process.wait()
+
+    job = jobs.Job.create(tmp_dir / 'jobs', 'test')
+    job.info.update(status=jobs.RUNNING, pid=process.pid)
+    job.save()
+    job = jobs.Job.load(tmp_dir / 'jobs', job.id)
+    assert job.status == 'failed'
+    assert job.get_status()['error'] == 'The operation has been interrupted.'
+    # The job is removed like other finished jobs
+    assert jobs.clean_expired_jobs(tmp_dir / 'jobs', max_age=-1) == 1
+
+    # Jobs of the current process or of other hosts are not changed
+    job = jobs.Job.create(tmp_dir / 'jobs', 'test')
+    assert jobs.Job.load(tmp_dir / 'jobs', job.id).status == 'pending'
+    job.info.update(host='other', pid=process.pid)
+    job.save()
+    assert jobs.Job.load(tmp_dir / 'jobs', job.id).status == 'pending'
+
+
+def test_move_copy__job(staff_client, settings, tmp_dir):
+    storage = tmp_dir / 'storage'
+    (storage / 'a' / 'sub').mkdir(parents=True)
+    (storage / 'a' / 'sub' / 'file.txt').write_text('content')
+    (storage / 'b').mkdir()
+    settings.FILE_BROWSER_DIRS = {'storage': (str(storage), '/storage')}
+    settings.FILE_BROWSER_JOBS_DIR = str(tmp_dir / 'jobs')
+    url = reverse('storage:file_browser_action')
+
+    response = staff_client.post(url, {'action': 'copy', 'path': '/', 'name_0': 'a', 'new_path': 'b'})
+    assert response.status_code == 200
+    assert response.json() == {'message': '1 file(s) successfully copied.'}
+    assert (storage / 'b' / 'a' / 'sub' / 'file.txt').read_text() == 'content'
+
+    response = staff_client.post(url, {'action': 'copy', 'path': '/', 'name_0': 'a', 'new_path': 'b'})
+    assert response.status_code == 400
+    assert response.json() == {'error': 'Unable to copy file a: The file "a" already exists.'}
+
+    response = staff_client.post(url, {'action': 'move', 'path': '/', 'name_0': 'a', 'new_path': 'a/sub'})
+    assert response.status_code == 400
+    assert response.json() == {'error': 'Unable to move file a: A folder cannot be moved or copied in itself.'}
+
+    response = staff_client.post(url, {'action': 'move', 'path': '/b', 'name_0': 'a', 'new_path': '#'})
+    assert response.status_code == 400
+    response = staff_client.post(url, {'action': 'move', 'path': '/b/a', 'name_0': 'sub', 'new_path': '#'})
+    assert response.status_code == 200
+    assert response.json() == {'message': '1 file(s) successfully moved.'}
+    assert sorted(os.listdir(storage)) == ['a', 'b', 'sub']
+    assert os.listdir(storage / 'b' / 'a') == []
+
+
+@pytest.mark.parametrize('action', ['rename', 'move', 'copy', 'delete'])
+@pytest.mark.parametrize('name', ['..', '.', 'a/../../outside', '../storage/a'])
+def test_actions__invalid_name(staff_client, settings, tmp_dir, action, name):
+    storage = tmp_dir / 'storage'
+    (storage / 'a').mkdir(parents=True)
+    (tmp_dir / 'outside').write_text('content')
+    settings.FILE_BROWSER_DIRS = {'storage': (str(storage), '/storage')}
+    settings.FILE_BROWSER_JOBS_DIR = str(tmp_dir / 'jobs')
+    url = reverse('storage:file_browser_action')
+
+    response = staff_client.post(url, {'action': action, 'path': '/a', 'name_0': name, 'new_path': '#', 'new_name': 'b'})
+    assert response.status_code == 400
+    assert response.json() == {'error': 'Invalid name.'}
+    assert (tmp_dir / 'outside').read_text() == 'content'
+    assert os.listdir(storage) == ['a']
+
+
+def test_content__conditional(staff_client, index_settings, tmp_dir):
+    storage = tmp_dir / 'storage'
+    (storage / 'sub').mkdir(parents=True)
+    index_settings.FILE_BROWSER_DIRS = {'storage': (str(storage), '/storage')}
+    size_index.get_size_index('storage').refresh()
+    url = reverse('storage:file_browser_content')
+
+    response = staff_client.get(url, {'path': '/', 'limit': 10})
+    assert response.status_code == 200
+    etag = response['ETag']
+    assert response['Last-Modified']
+    assert 'no-cache' in response['Cache-Control']
+
+    response = staff_client.get(url, {'path': '/', 'limit': 10}, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+    assert response.content == b''
+    # The ETag depends on the parameters
+    response = staff_client.get(url, {'path': '/', 'limit': 20}, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+
+    (storage / 'new.txt').write_text('content')
+    os.utime(storage, ns=(10 ** 18, 10 ** 18))
+    response = staff_client.get(url, {'path': '/', 'limit': 10}, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert [f['name'] for f in response.json()['files']] == ['sub', 'new.txt']
+
+    # A file modified in place (the dir modification time does not change)
+    etag = response['ETag']
+    dir_mtime = os.stat(storage).st_mtime_ns
+    (storage / 'new.txt').write_text('other content')
+    os.utime(storage / 'new.txt', ns=(2 * 10 ** 18, 2 * 10 ** 18))
+    assert os.stat(storage).st_mtime_ns == dir_mtime
+    response = staff_client.get(url, {'path': '/', 'limit': 10}, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response.json()['files'][1]['size'] == 13
+
+    # Without size index, sizes of sub dirs can change without any change in the dir so the content is always sent
+    index_settings.FILE_BROWSER_INDEX_DIR = None
+    response = staff_client.get(url, {'path': '/', 'limit': 10}, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert 'ETag' not in response
+
+    url = reverse('storage:file_browser_dirs')
+    response = staff_client.get(url, {'path': '/'})
+    assert response.status_code == 200
+    etag = response['ETag']
+    response = staff_client.get(url, {'path': '/'}, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+    assert response['ETag'] == etag
+    # A dir added in a sub dir changes its "has_children" value
+    (storage / 'sub' / 'sub2').mkdir()
+    response = staff_client.get(url, {'path': '/'}, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response.json()['dirs'] == [{'dir_name': 'sub', 'has_children': True}]
+    response = staff_client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+    assert response.status_code == 200
+    response = staff_client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+    assert response.status_code == 304
+
+
+def test_download(staff_client, settings, tmp_dir):
+    storage = tmp_dir / 'storage'
+    storage.mkdir()
+    (storage / 'some file.txt').write_bytes(b'0123456789')
+    settings.FILE_BROWSER_DIRS = {'storage': (str(storage), '/storage')}
+    url = reverse('storage:file_browser_download')
+
+    response = staff_client.get(url, {'path': '/some file.txt'})
+    assert response.status_code == 200
+    assert response['Content-Type'] == 'text/plain'
+    assert response['Accept-Ranges'] == 'bytes'
+    assert b''.join(response.streaming_content) == b'0123456789'
+
+    response = staff_client.get(url, {'path': '/some file.txt'}, HTTP_RANGE='bytes=2-4')
+    assert response.status_code == 206
+    assert response['Content-Range'] == 'bytes 2-4/10'
+    assert response['Content-Length'] == '3'
+    assert b''.join(response.streaming_content) == b'234'
+    response = staff_client.get(url, {'path': '/some file.txt'}, HTTP_RANGE='bytes=-3')
+    assert b''.join(response.streaming_content) == b'789'
+    response = staff_client.get(url, {'path': '/some file.txt'}, HTTP_RANGE='bytes=20-')
+    assert response.status_code == 416
+    assert response['Content-Range'] == 'bytes */10'
+
+    settings.FILE_BROWSER_SENDFILE = 'x-accel-redirect'
+    response = staff_client.get(url, {'path': '/some file.txt', 'attachment': '1'})
+    assert response.status_code == 200
+    assert response['X-Accel-Redirect'] == '/protected/storage/some%20file.txt'
+    assert response['Content-Disposition'] == 'attachment; filename="some file.txt"'
+    assert 'Content-Type' not in response
+    assert response.content == b''
+
+    settings.FILE_BROWSER_SENDFILE = 'x-sendfile'
+    response = staff_client.get(url, {'path': '/some file.txt'})
+    assert response['X-Sendfile'] == str(storage / 'some file.txt')
+
+    response = staff_client.get(url, {'path': '/missing.txt'})
+    assert response.status_code == 404
+    response = staff_client.get(url, {'path': '/../settings.py'})
+    assert response.status_code == 400
+
+
+def test_duplicates(index_settings, tmp_dir):
+    from django.core.management import call_command
+
+    storage = tmp_dir / 'storage'
+    (storage / 'a').mkdir(parents=True)
+    (storage / 'b').mkdir()
+    content = os.urandom(300000)
+    (storage / 'a' / 'video.mp4').write_bytes(content)
+    (storage / 'b' / 'copy.mp4').write_bytes(content)
+    (storage / 'b' / 'copy2.mp4').write_bytes(content)
+    # Same size, same first and last blocks but different content
+    (storage / 'b' / 'other.mp4').write_bytes(content[:150000] + bytes([content[150000] ^ 0xff]) + content[150001:])
+    (storage / 'a' / 'small.txt').write_text('small')
+    (storage / 'b' / 'small.txt').write_text('small')
+    os.link(storage / 'a' / 'small.txt', storage / 'a' / 'small-link.txt')
+    (storage / 'b' / 'unique.txt').write_text('unique')
+    index_settings.FILE_BROWSER_DIRS = {'storage': (str(storage), '/storage')}
+    index = size_index.get_size_index('storage')
+    index.refresh()
+
+    out = io.StringIO()
+    call_command('file_browser_duplicates', 'storage', stdout=out)
+    assert out.getvalue() == (
+        '300.0 kB (3):\n'
+        '    a/video.mp4\n'
+        '    b/copy.mp4\n'
+        '    b/copy2.mp4\n'
+        '5 B (2):\n'
+        '    a/small-link.txt\n'
+        '    a/small.txt\n'
+        '    b/small.txt\n'
+        '3 duplicate file(s) in 2 group(s), reclaimable space: 600.0 kB.\n'
+    )
+
+    out = io.StringIO()
+    call_command('file_browser_duplicates', 'storage', '--hardlink', '--min-size', '10', stdout=out)
+    assert out.getvalue().endswith('2 file(s) replaced by hard links, reclaimed space: 600.0 kB.\n')
+    assert (storage / 'b' / 'copy.mp4').stat().st_ino == (storage / 'a' / 'video.mp4').stat().st_ino
+    assert (storage / 'b' / 'copy.mp4').read_bytes() == content
+
+    out = io.StringIO()
+    call_command('file_browser_duplicates', 'storage', '--delete', stdout=out)
+    assert out.getvalue().endswith('1 file(s) deleted, reclaimed space: 5 B.\n')
+    assert not (storage / 'b' / 'small.txt').exists()
+    assert (storage / 'b' / 'copy.mp4').exists()
+    # The sizes of changed dirs are refreshed
+    assert index.get('b') == {'size': 900006, 'nb_files': 4, 'nb_dirs': 0, 'stale': False}
+    assert index.get('') == {'size': 1200016, 'nb_files': 7, 'nb_dirs': 2, 'stale': False}
@@ -69,6 +69,20 @@ def test_reverse_read():
     assert next(reader) == b'agna fermentum augue, et ultricies lacus'
 
 
+@pytest.mark.parametrize('n, end, max_bytes, expected', [
+    pytest.param(2, None, None, (b'line 8\nline 9\n', 56, 70), id='last'),
+    pytest.param(0, None, None, (b'', 70, 70), id='none'),
+    pytest.param(20, None, None, (b''.join(b'line %d\n' % i for i in range(10)), 0, 70), id='all'),
+    pytest.param(2, 56, None, (b'line 6\nline 7\n', 42, 56), id='before'),
+    pytest.param(1, 53, None, (b'line', 49, 53), id='incomplete'),
+    pytest.param(3, None, 10, (b' 8\nline 9\n', 60, 70), id='max_bytes'),
+])
+def test_tail_lines(tmp_dir, n, end, max_bytes, expected):
+    path = tmp_dir / 'test.log'
+    path.write_bytes(b''.join(b'line %d\n' % i for i in range(10)))
+    assert files_utils.tail_lines(path, n, max_bytes=max_bytes, end=end, buf_size=4) == expected
+
+
 def test_backup_file(tmp_dir):
     path = tmp_dir / 'test.file'
     path.touch()
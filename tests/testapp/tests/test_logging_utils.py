@@ -0,0 +1,55 @@
+import gzip
+import logging
+import time
+
+from django_web_utils.logging_utils import RotatingCompressedFileHandler
+
+
+def get_logger(handler):
+    test_logger = logging.getLogger('djwutils.tests.rotation')
+    test_logger.handlers = [handler]
+    test_logger.propagate = False
+    test_logger.setLevel(logging.INFO)
+    return test_logger
+
+
+def test_rotating_handler__size(tmp_dir):
+    path = tmp_dir / 'test.log'
+    handler = RotatingCompressedFileHandler(path, max_bytes=100, backup_count=2)
+    test_logger = get_logger(handler)
+    for index in range(10):
+        test_logger.info('Line %s: %s', index, 'x' * 40)
+    handler.close()
+
+    assert sorted(p.name for p in tmp_dir.iterdir()) == ['test.log', 'test.log.1.gz', 'test.log.2.gz']
+    # Each line is 48 bytes long, so files contain 2 lines
+    assert path.read_text() == f'Line 8: {"x" * 40}\nLine 9: {"x" * 40}\n'
+    with gzip.open(tmp_dir / 'test.log.1.gz', 'rt') as fo:
+        assert fo.read() == f'Line 6: {"x" * 40}\nLine 7: {"x" * 40}\n'
+
+
+def test_rotating_handler__interval(tmp_dir):
+    path = tmp_dir / 'test.log'
+    handler = RotatingCompressedFileHandler(path, interval=0.05, compress=False)
+    test_logger = get_logger(handler)
+    test_logger.info('first')
+    time.sleep(0.06)
+    test_logger.info('second')
+    handler.close()
+
+    assert sorted(p.name for p in tmp_dir.iterdir()) == ['test.log', 'test.log.1']
+    assert path.read_text() == 'second\n'
+    assert (tmp_dir / 'test.log.1').read_text() == 'first\n'
+
+
+def test_rotating_handler__cleared(tmp_dir):
+    # The log file can be cleared while the handler is writing in it
+    path = tmp_dir / 'test.log'
+    handler = RotatingCompressedFileHandler(path, max_bytes=1000)
+    test_logger = get_logger(handler)
+    test_logger.info('first')
+    path.write_text('')
+    test_logger.info('second')
+    handler.close()
+
+    assert path.read_text() == 'second\n'
@@ -1,4 +1,5 @@
 import json
+import os
 
 import pytest
 from django.urls import reverse
@@ -19,6 +20,9 @@ def test_anonymous(client):
     response = client.get(reverse('monitoring:monitoring-status'))
     assert response.status_code == 302
 
+    response = client.get(reverse('monitoring:monitoring-events'))
+    assert response.status_code == 302
+
     response = client.get(reverse('monitoring:monitoring-config', args=['hosts']))
     assert response.status_code == 302
 
@@ -113,3 +117,170 @@ def test_sysinfo():
         'info_memory',
         'info_network'
     ]
+
+
+def test_daemons_status(tmp_dir, rf):
+    from django_web_utils.monitoring import utils
+    pid_path = tmp_dir / 'daemon.pid'
+    pid_path.write_text(str(os.getpid()))
+    log_path = tmp_dir / 'daemon.log'
+    log_path.write_bytes(b'x' * 2000)
+    daemons = [
+        dict(name='alive', pid_path=pid_path, log_path=log_path),
+        dict(name='missing', pid_path=tmp_dir / 'missing.pid'),
+    ]
+    request = rf.get('/')
+    request.session = {}
+    utils.clear_status_cache()
+    statuses = utils.get_daemons_status(request, daemons)
+    assert statuses['alive']['running'] is True
+    assert statuses['alive']['log_size'] == '2.0 kB'
+    assert statuses['missing'] == {'running': False, 'need_password': False, 'log_size': '', 'log_mtime': ''}
+
+    # States are cached for a short time
+    pid_path.write_text('invalid')
+    assert utils.get_daemon_status(request, daemons[0])['running'] is True
+    utils.clear_status_cache()
+    assert utils.get_daemon_status(request, daemons[0])['running'] is False
+
+    # The cached state of a daemon is cleared after a command
+    assert utils.get_daemon_status(request, daemons[0])['log_size'] == '2.0 kB'
+    assert utils.execute_daemon_command(request, daemons[0], 'clear_log') == (True, 'Log file cleared.')
+    assert utils.get_daemon_status(request, daemons[0])['log_size'] == '0 B'
+
+
+def test_daemons_status__root(tmp_dir, rf, monkeypatch):
+    from django_web_utils import system_utils
+    from django_web_utils.monitoring import events, utils
+    pid_path = tmp_dir / 'daemon.pid'
+    pid_path.write_text(str(os.getpid()))
+    daemon = dict(name='root', pid_path=pid_path, is_root=True)
+
+    def read_pid_file(path):
+        raise PermissionError()
+
+    calls = []
+    monkeypatch.setattr(system_utils, 'read_pid_file', read_pid_file)
+    monkeypatch.setattr(system_utils, 'is_pid_running', lambda path, user, request: calls.append(request) or True)
+    utils.clear_status_cache()
+    request = rf.get('/')
+    request.session = {}
+    assert utils.get_daemon_status(request, daemon) == {'running': None, 'need_password': True, 'log_size': '', 'log_mtime': ''}
+
+    # The result of the command run with the password is not shared with other requests
+    request_pwd = rf.get('/')
+    request_pwd.session = {'pwd': 'pwd'}
+    assert utils.get_daemon_status(request_pwd, daemon)['running'] is True
+    assert utils.get_daemon_status(request, daemon)['need_password'] is True
+    assert calls == [request_pwd]
+
+    # The status is sent again when the pid file changes
+    signature = events.get_state_signature(utils.collect_daemons_states([daemon])['root'])
+    os.utime(pid_path, ns=(10 ** 18, 10 ** 18))
+    utils.clear_status_cache()
+    assert events.get_state_signature(utils.collect_daemons_states([daemon])['root']) != signature
+
+
+def test_events(client, settings):
+    from django.contrib.auth.models import User
+    settings.MONITORING_EVENTS_TIMEOUT = 1
+    user = User.objects.create(username='mn_admin', is_superuser=True)
+    client.force_login(user)
+
+    # Events are disabled by default
+    response = client.get(reverse('monitoring:monitoring-panel'))
+    assert b'eventsURL' not in response.content
+    response = client.get(reverse('monitoring:monitoring-events'))
+    assert response.status_code == 404
+
+    settings.MONITORING_EVENTS_ENABLED = True
+    response = client.get(reverse('monitoring:monitoring-panel'))
+    assert b'eventsURL' in response.content
+    response = client.get(reverse('monitoring:monitoring-events'))
+    assert response.status_code == 200
+    assert response['Content-Type'] == 'text/event-stream'
+    chunks = [chunk.decode('utf-8') for chunk in response.streaming_content]
+    assert chunks[0] == 'retry: 1000\n\n'
+    # All statuses are sent in the first event, then nothing changes until the end of the stream
+    events = [chunk for chunk in chunks if chunk.startswith('event: status\n')]
+    assert len(events) == 1
+    content = json.loads(events[0].split('data: ', 1)[1])
+    assert sorted(content.keys()) == ['dummy', 'fake', 'hosts']
+    assert content['fake'] == {'running': False, 'need_password': False, 'log_size': '', 'log_mtime': ''}
+
+
+def test_read_log_updates(tmp_dir):
+    from django_web_utils.monitoring.utils import read_log_updates
+    path = tmp_dir / 'daemon.log'
+    path.write_bytes(b'line 1\n')
+    result = read_log_updates(path, 0)
+    assert result['content'] == 'line 1\n'
+    assert result['offset'] == 7
+    assert not result['reset']
+    inode = result['inode']
+
+    # Incomplete characters are kept for the next read
+    with open(path, 'ab') as fo:
+        fo.write('line 2 é'.encode('utf-8')[:-1])
+    result = read_log_updates(path, 7, inode)
+    assert result['content'] == 'line 2 '
+    assert result['offset'] == 14
+    with open(path, 'ab') as fo:
+        fo.write('é'.encode('utf-8')[-1:] + b'\n')
+    assert read_log_updates(path, 14, inode)['content'] == 'é\n'
+
+    # Truncation
+    path.write_bytes(b'new\n')
+    result = read_log_updates(path, 17, inode)
+    assert result == {'content': 'new\n', 'offset': 4, 'inode': inode, 'reset': True, 'skipped': False}
+
+    # Rotation
+    path.rename(tmp_dir / 'daemon.log.1')
+    path.write_bytes(b'rotated log file\n')
+    result = read_log_updates(path, 4, inode)
+    assert result['content'] == 'rotated log file\n'
+    assert result['reset']
+    assert result['inode'] != inode
+
+    # Only the end is read if too much data has been appended
+    result = read_log_updates(path, 0, result['inode'], max_size=5)
+    assert result['content'] == 'file\n'
+    assert result['skipped']
+
+
+def test_log_updates(client):
+    from django.contrib.auth.models import User
+    user = User.objects.create(username='mn_admin', is_superuser=True)
+    client.force_login(user)
+
+    url = reverse('monitoring:monitoring-log', args=['fake'])
+    response = client.get(url, {'offset': '0'})
+    assert response.status_code == 200
+    assert response['Content-Type'] == 'application/json'
+    content = json.loads(response.content.decode('utf-8'))
+    assert content == {'content': '', 'offset': 0, 'inode': None, 'reset': False, 'skipped': False}
+
+    response = client.get(url, {'offset': 'a'})
+    assert response.status_code == 400
+
+
+def test_log_view__tail(tmp_dir, rf):
+    from django_web_utils.monitoring.utils import log_view
+    path = tmp_dir / 'daemon.log'
+    path.write_text(''.join('line %s\n' % i for i in range(2000)))
+
+    request = rf.get('/', {'tail': '', 'lines': '1000'})
+    result = log_view(request, path=path)
+    assert result['content'].startswith('...\nline 1000\n')
+    assert result['content'].endswith('line 1999\n')
+    assert result['offset'] == path.stat().st_size
+    assert result['can_follow']
+    assert [link['selected'] for link in result['tail_links']] == [False, True, False]
+    assert result['older_url'] == '?lines=1000&before=8890&tail'
+
+    request = rf.get('/', {'tail': '', 'lines': '1000', 'before': '8890'})
+    result = log_view(request, path=path)
+    assert result['content'].startswith('line 0\n')
+    assert result['content'].endswith('line 999\n')
+    assert not result['can_follow']
+    assert result['older_url'] is None